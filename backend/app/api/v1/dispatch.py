@@ -13,7 +13,13 @@ from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.core.database import get_db
+from app.core.executors import run_blocking, run_google_io
+from app.google_sheet_parser.quota_governor import QuotaExceededError
+from app.google_sheet_parser.sheet_pilgrim_parser import sheet_pilgrim_parser
 from app.services.document_rules import normalize_document
+from app.services.manifest_compare import compare_manifest
+from app.services.manifest_store import manifest_store
+from app.services.pilgrim_record import PilgrimRecord
 from db.models import (
     DispatchJob, DispatchJobStatus,
     Tour, TourStatus, Pilgrim, TourOffer,
@@ -72,7 +78,10 @@ class DispatchEnqueueRequest(BaseModel):
     tour: DispatchTourSnapshot
     selection: DispatchSelectionSnapshot
     dispatch_overrides: DispatchOverridesSnapshot = Field(default_factory=DispatchOverridesSnapshot)
-    results: DispatchResultsSnapshot
+    results: Optional[DispatchResultsSnapshot] = None
+    # Вместо results: id из /manifest/upload — сверка манифеста с листом
+    # тура выполняется на сервере
+    manifest_id: Optional[str] = None
     manifest_filename: str = ""
     max_attempts: Optional[int] = None
 
@@ -193,6 +202,47 @@ def _save_normalized(db: Session, request: "DispatchEnqueueRequest") -> Tour:
     return tour
 
 
+async def _results_from_manifest(request: "DispatchEnqueueRequest") -> DispatchResultsSnapshot:
+    """Сверка загруженного манифеста с листом тура, как в /manifest/compare"""
+    if not request.manifest_id:
+        raise HTTPException(status_code=400, detail="Нужны results или manifest_id")
+    manifest = manifest_store.get(request.manifest_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Манифест не найден или устарел. Загрузите файл заново")
+    if not request.manifest_filename:
+        request.manifest_filename = manifest.filename
+
+    # Лист читается в пуле Google I/O, а не в общем threadpool Starlette
+    parsed = await run_google_io(
+        sheet_pilgrim_parser.get_parsed_sheet,
+        request.tour.spreadsheet_id,
+        request.tour.sheet_name,
+    )
+    result = compare_manifest(manifest.pilgrims, parsed)
+
+    # Пакет по номеру документа, как при сравнении: записи общего списка
+    # (сверка) и пакетов не всегда равны целиком — тип комнаты и питание
+    # в общем списке тянутся через границы пакетов
+    package_names: Dict[str, str] = {}
+    for package in parsed.packages:
+        for pilgrim in package["pilgrims"]:
+            document = normalize_document(pilgrim.document.upper())
+            if document:
+                package_names.setdefault(document, package["package_name"])
+
+    def _person(pilgrim: PilgrimRecord) -> DispatchPerson:
+        return DispatchPerson(
+            surname=pilgrim.surname,
+            name=pilgrim.name,
+            document=pilgrim.document,
+            package_name=package_names.get(normalize_document(pilgrim.document.upper()), ""),
+        )
+
+    return DispatchResultsSnapshot(
+        **{key: [_person(pilgrim) for pilgrim in pilgrims] for key, pilgrims in result.items()}
+    )
+
+
 def _as_job_response(job: DispatchJob) -> DispatchJobResponse:
     raw_payload = job.payload if isinstance(job.payload, dict) else {}
     prepared_payload = job.prepared_payload if isinstance(job.prepared_payload, dict) else {}
@@ -275,12 +325,26 @@ def _enqueue_unavailable_message(is_retry: bool = False) -> str:
 
 
 @router.post("/jobs/enqueue", response_model=DispatchJobResponse)
-def enqueue_dispatch_job(request: DispatchEnqueueRequest, db: Session = Depends(get_db)):
-    try:
-        max_attempts = request.max_attempts or settings.DISPATCH_MAX_ATTEMPTS
-        if max_attempts < 1:
-            raise HTTPException(status_code=400, detail="max_attempts must be >= 1")
+async def enqueue_dispatch_job(request: DispatchEnqueueRequest, db: Session = Depends(get_db)):
+    max_attempts = request.max_attempts or settings.DISPATCH_MAX_ATTEMPTS
+    if max_attempts < 1:
+        raise HTTPException(status_code=400, detail="max_attempts must be >= 1")
+
+    if request.results is None:
+        try:
+            request.results = await _results_from_manifest(request)
+        except (HTTPException, QuotaExceededError):
+            raise
+        except Exception as e:
+            logger.error("Ошибка сверки манифеста для dispatch job: %s", e, exc_info=True)
+            raise HTTPException(status_code=500, detail="Не удалось подготовить отправку. Проверьте данные и повторите попытку.")
 
+    # Работа с БД и брокером — синхронная, в threadpool
+    return await run_blocking(_enqueue_job, request, db, max_attempts)
+
+
+def _enqueue_job(request: DispatchEnqueueRequest, db: Session, max_attempts: int) -> DispatchJobResponse:
+    try:
         # Сохраняем в нормализованные таблицы (tours, pilgrims, tour_offers)
         tour = _save_normalized(db, request)
 
@@ -310,7 +374,7 @@ def enqueue_dispatch_job(request: DispatchEnqueueRequest, db: Session = Depends(
         logger.info("🧾 Dispatch job queued: %s", job.id)
         return _as_job_response(job)
 
-    except HTTPException:
+    except (HTTPException, QuotaExceededError):
         raise
     except IntegrityError:
         db.rollback()
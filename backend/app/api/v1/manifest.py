@@ -1,16 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from pydantic import BaseModel
-from typing import List
+from typing import AsyncIterator, List, Optional
+import asyncio
 import logging
+import os
 
-from app.google_sheet_parser.manifest_parser import manifest_parser
+from app.core.config import settings
+from app.core.executors import run_blocking, run_cpu_bound, run_google_io
+from app.core.parse_trace import parse_trace, trace_event
+from app.core.uploads import UploadTooLargeError, save_upload, upload_digest
+from app.google_sheet_parser.manifest_parser import MANIFEST_EXTENSIONS, parse_manifest_content
 from app.google_sheet_parser.sheet_pilgrim_parser import sheet_pilgrim_parser
-from app.services.document_rules import normalize_document
+from app.google_sheet_parser.quota_governor import QuotaExceededError
+from app.services.manifest_compare import compare_manifest
+from app.services.manifest_store import StoredManifest, manifest_store
+from app.services.pilgrim_record import COMPARE_FIELDS, MANIFEST_FIELDS, PilgrimRecord
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/manifest", tags=["manifest"])
 
+# Одновременные разборы манифестов в этом процессе: каждый держит файл
+# и результат в памяти, поэтому их число ограничено
+_parse_slots = asyncio.Semaphore(settings.MANIFEST_PARSE_CONCURRENCY)
+
 
 class Pilgrim(BaseModel):
     surname: str
@@ -23,7 +37,11 @@ class Pilgrim(BaseModel):
 class CompareRequest(BaseModel):
     spreadsheet_id: str
     sheet_name: str
-    manifest_pilgrims: List[Pilgrim]
+    # id из /manifest/upload; если не передан — нужен manifest_pilgrims
+    manifest_id: Optional[str] = None
+    manifest_pilgrims: Optional[List[Pilgrim]] = None
+    # Записать трассу разбора листа (GET /tours/traces/{trace_id})
+    debug: bool = False
 
 
 class CompareResponse(BaseModel):
@@ -34,6 +52,9 @@ class CompareResponse(BaseModel):
     in_sheet_not_in_manifest: List[Pilgrim]
     # Есть в манифесте, но НЕТ в таблице
     in_manifest_not_in_sheet: List[Pilgrim]
+    # Ревизия таблицы, с которой сравнивали
+    revision: Optional[str] = None
+    trace_id: Optional[str] = None
     message: str = ""
 
 
@@ -41,27 +62,54 @@ class CompareResponse(BaseModel):
 async def upload_manifest(file: UploadFile = File(...)):
     try:
         # Проверяем расширение файла
-        if not file.filename.endswith(('.xlsx', '.xls')):
+        extension = os.path.splitext(file.filename or "")[1].lower()
+        allowed = [ext for ext in MANIFEST_EXTENSIONS if ext in settings.ALLOWED_EXTENSIONS]
+        if extension not in allowed:
             raise HTTPException(
                 status_code=400,
-                detail="Неверный формат файла. Поддерживаются только .xlsx и .xls"
+                detail=f"Неверный формат файла. Поддерживаются только {', '.join(allowed)}"
             )
 
         logger.info(f"Загрузка манифеста: {file.filename}")
 
-        # Читаем содержимое файла
-        content = await file.read()
-
-        # Парсим манифест
-        pilgrims = manifest_parser.parse_manifest(content, file.filename)
+        # Файл уже сохранён Starlette (размер ограничен UploadSizeLimitMiddleware):
+        # хешируем его на месте, без копии, и вне цикла событий
+        max_bytes = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+        if file.size is not None and file.size > max_bytes:
+            raise UploadTooLargeError(max_bytes)
+        content_digest = await run_blocking(upload_digest, file.file, max_bytes)
+
+        # Тот же файл уже разбирали этой версией парсера — берём результат из кэша
+        manifest_id = manifest_store.manifest_id(content_digest, extension)
+        manifest = manifest_store.get(manifest_id)
+        cached = manifest is not None
+        if manifest is None:
+            async with _parse_slot():
+                # Процесс разбора получает путь и читает файл сам: содержимое
+                # не копируется в память воркера и не сериализуется pickle
+                path = await run_blocking(save_upload, file.file, extension)
+                try:
+                    pilgrims = await run_cpu_bound(parse_manifest_content, path, file.filename)
+                finally:
+                    await run_blocking(os.remove, path)
+            manifest = manifest_store.put(manifest_id, file.filename, pilgrims)
+        else:
+            logger.info(f"Манифест {file.filename} уже разобран ({manifest_id[:12]})")
+        pilgrims = manifest.pilgrims
 
         return {
             "success": True,
-            "pilgrims": pilgrims,
+            "manifest_id": manifest_id,
+            "cached": cached,
+            "pilgrims": [p.to_dict(MANIFEST_FIELDS) for p in pilgrims],
             "count": len(pilgrims),
             "message": f"Загружено {len(pilgrims)} паломников"
         }
 
+    except HTTPException:
+        raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -75,61 +123,30 @@ async def upload_manifest(file: UploadFile = File(...)):
 @router.post("/compare", response_model=CompareResponse)
 async def compare_with_sheet(request: CompareRequest):
     try:
+        manifest_pilgrims = _manifest_pilgrims(request)
         logger.info(
             f"Сравнение манифеста с листом '{request.sheet_name}' "
-            f"(манифест: {len(request.manifest_pilgrims)} чел.)"
+            f"(манифест: {len(manifest_pilgrims)} чел.)"
         )
 
-        # Парсим паломников из Google Sheets
-        sheet_pilgrims = sheet_pilgrim_parser.parse_sheet_pilgrims(
-            request.spreadsheet_id,
-            request.sheet_name
-        )
+        async with parse_trace("manifest-compare", enabled=request.debug) as trace:
+            # Разбор листа общий с /tours/sheet-pilgrims (кэш по ревизии таблицы)
+            parsed = await run_google_io(
+                sheet_pilgrim_parser.get_parsed_sheet,
+                request.spreadsheet_id,
+                request.sheet_name
+            )
 
-        # Создаём множества для быстрого поиска (по номеру паспорта)
-        manifest_docs = {
-            normalize_document(p.document.upper())
-            for p in request.manifest_pilgrims
-            if normalize_document(p.document.upper())
-        }
-        sheet_docs_map = {
-            normalize_document(p["document"].upper()): p
-            for p in sheet_pilgrims
-            if normalize_document((p.get("document") or "").upper())
-        }
+            result = compare_manifest(manifest_pilgrims, parsed)
+            trace_event("compare", **{key: len(value) for key, value in result.items()})
 
-        # Те кто есть и в манифесте и в таблице
-        matched = []
-        for mp in request.manifest_pilgrims:
-            doc = normalize_document(mp.document.upper())
-            if doc in sheet_docs_map:
-                sp = sheet_docs_map[doc]
-                matched.append(Pilgrim(
-                    surname=sp["surname"],
-                    name=sp["name"],
-                    document=sp["document"],
-                    iin=sp.get("iin", ""),
-                    manager=sp["manager"]
-                ))
-
-        # Есть в таблице, но НЕТ в манифесте
-        in_sheet_not_in_manifest = []
-        for doc, sp in sheet_docs_map.items():
-            if doc not in manifest_docs:
-                in_sheet_not_in_manifest.append(Pilgrim(
-                    surname=sp["surname"],
-                    name=sp["name"],
-                    document=sp["document"],
-                    iin=sp.get("iin", ""),
-                    manager=sp["manager"]
-                ))
-
-        # Есть в манифесте, но НЕТ в таблице
-        in_manifest_not_in_sheet = []
-        for mp in request.manifest_pilgrims:
-            doc = normalize_document(mp.document.upper())
-            if not doc or doc not in sheet_docs_map:
-                in_manifest_not_in_sheet.append(mp)
+        matched = [Pilgrim(**p.to_dict(COMPARE_FIELDS)) for p in result["matched"]]
+        in_sheet_not_in_manifest = [
+            Pilgrim(**p.to_dict(COMPARE_FIELDS)) for p in result["in_sheet_not_in_manifest"]
+        ]
+        in_manifest_not_in_sheet = [
+            Pilgrim(**p.to_dict(COMPARE_FIELDS)) for p in result["in_manifest_not_in_sheet"]
+        ]
 
         logger.info(
             f"✅ Сравнение завершено: "
@@ -143,12 +160,51 @@ async def compare_with_sheet(request: CompareRequest):
             matched=matched,
             in_sheet_not_in_manifest=in_sheet_not_in_manifest,
             in_manifest_not_in_sheet=in_manifest_not_in_sheet,
+            revision=parsed.revision,
+            trace_id=trace.id if trace else None,
             message="Сравнение завершено успешно"
         )
 
+    except (HTTPException, QuotaExceededError):
+        raise
     except Exception as e:
         logger.error(f"Ошибка сравнения: {e}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка сравнения: {str(e)}"
         )
+
+
+def _manifest_pilgrims(request: CompareRequest) -> List[PilgrimRecord]:
+    if request.manifest_id:
+        return _load_manifest(request.manifest_id).pilgrims
+    if request.manifest_pilgrims is None:
+        raise HTTPException(status_code=400, detail="Нужен manifest_id или manifest_pilgrims")
+    return [PilgrimRecord.from_mapping(p.model_dump()) for p in request.manifest_pilgrims]
+
+
+def _load_manifest(manifest_id: str) -> StoredManifest:
+    """Манифест из /manifest/upload по id; 404, если кэш его уже вытеснил"""
+    manifest = manifest_store.get(manifest_id)
+    if manifest is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Манифест не найден или устарел. Загрузите файл заново"
+        )
+    return manifest
+
+
+@asynccontextmanager
+async def _parse_slot() -> AsyncIterator[None]:
+    """Место в очереди разбора; 503, если не освободилось за MANIFEST_PARSE_WAIT_SECONDS"""
+    try:
+        await asyncio.wait_for(_parse_slots.acquire(), timeout=settings.MANIFEST_PARSE_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Сервер занят разбором других манифестов. Повторите попытку позже"
+        )
+    try:
+        yield
+    finally:
+        _parse_slots.release()
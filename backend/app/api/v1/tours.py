@@ -1,11 +1,21 @@
 
 from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 from pydantic import BaseModel
+import asyncio
+import json
 import logging
 
+from app.core.config import settings
+from app.core.executors import run_google_io
+from app.core.parse_trace import parse_trace, trace_store
 from app.google_sheet_parser.google_sheets_service import google_sheets_service
-from app.google_sheet_parser.sheet_pilgrim_parser import sheet_pilgrim_parser
+from app.google_sheet_parser.sheet_pilgrim_parser import sheet_flight, sheet_pilgrim_parser, sheet_values_cache
+from app.google_sheet_parser.quota_governor import QuotaExceededError, google_read_quota
+from app.google_sheet_parser.sheet_prefetch import sheet_prefetcher
+from app.services.column_map_cache import column_map_cache
+from app.services.manifest_store import manifest_store
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/tours", tags=["tours"])
@@ -20,6 +30,19 @@ class SearchByDateRequest(BaseModel):
         }
 
 
+class SearchByRangeRequest(BaseModel):
+    date_from: str  # "10.02" или "10.02.2026"
+    date_to: str    # "20.02" или "20.02.2026"
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "date_from": "10.02",
+                "date_to": "20.02"
+            }
+        }
+
+
 class TourOption(BaseModel):
     spreadsheet_id: str
     spreadsheet_name: str
@@ -55,6 +78,8 @@ class SearchByDateResponse(BaseModel):
 class SheetPilgrimsRequest(BaseModel):
     spreadsheet_id: str
     sheet_name: str
+    # Записать трассу разбора (GET /tours/traces/{trace_id})
+    debug: bool = False
 
     class Config:
         json_schema_extra = {
@@ -65,6 +90,31 @@ class SheetPilgrimsRequest(BaseModel):
         }
 
 
+class SheetRef(BaseModel):
+    spreadsheet_id: str
+    sheet_name: str
+
+
+class BatchSheetPilgrimsRequest(BaseModel):
+    sheets: List[SheetRef]
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "sheets": [
+                    {
+                        "spreadsheet_id": "1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms",
+                        "sheet_name": "17.02.2026-24.02.2026 ALA-JED"
+                    },
+                    {
+                        "spreadsheet_id": "1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms",
+                        "sheet_name": "17.02.2026-24.02.2026 NQZ-JED"
+                    }
+                ]
+            }
+        }
+
+
 class PilgrimInPackage(BaseModel):
     surname: str
     name: str
@@ -85,6 +135,29 @@ class SheetPilgrimsResponse(BaseModel):
     success: bool
     packages: List[PackageInfo]
     total_count: int
+    revision: Optional[str] = None
+    # Ревизия прошлого разбора листа и пакеты, изменившиеся с неё
+    previous_revision: Optional[str] = None
+    changed_packages: Optional[List[str]] = None
+    trace_id: Optional[str] = None
+    message: str = ""
+
+class SheetPilgrimsResult(BaseModel):
+    spreadsheet_id: str
+    sheet_name: str
+    success: bool
+    packages: List[PackageInfo] = []
+    total_count: int = 0
+    revision: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchSheetPilgrimsResponse(BaseModel):
+    # True, если все листы разобраны без ошибок
+    success: bool
+    results: List[SheetPilgrimsResult]
+    total_count: int
+    failed_count: int
     message: str = ""
 
 @router.post("/search-by-date", response_model=SearchByDateResponse)
@@ -95,7 +168,10 @@ async def search_tours_by_date(
         logger.info(f"Поиск туров по дате: {request.date_short}")
 
         # Ищем в Google Sheets
-        sheets_results = google_sheets_service.find_sheets_by_date(request.date_short)
+        sheets_results = await run_google_io(
+            google_sheets_service.find_sheets_by_date,
+            request.date_short,
+        )
 
         if not sheets_results:
             return SearchByDateResponse(
@@ -105,26 +181,53 @@ async def search_tours_by_date(
                 message=f"Туры на дату {request.date_short} не найдены"
             )
 
-        # Преобразуем результаты
-        tours = []
-        for item in sheets_results:
-            # Определяем город вылета по маршруту
-            route = item.get("route", "")
-            departure_city = _get_departure_city(route)
-
-            tours.append(TourOption(
-                spreadsheet_id=item["spreadsheet_id"],
-                spreadsheet_name=item["spreadsheet_name"],
-                sheet_name=item["sheet_name"],
-                date_start=item["date_start"],
-                date_end=item["date_end"],
-                days=item["days"],
-                route=route or "Не указан",
-                departure_city=departure_city
-            ))
+        tours = _to_tour_options(sheets_results)
 
         logger.info(f"✅ Найдено {len(tours)} туров")
 
+        # Оператор почти всегда открывает один из найденных листов — готовим их заранее
+        sheet_prefetcher.schedule([(tour.spreadsheet_id, tour.sheet_name) for tour in tours])
+
+        return SearchByDateResponse(
+            success=True,
+            found_count=len(tours),
+            tours=tours,
+            message=f"Найдено {len(tours)} вариантов тура"
+        )
+
+    except QuotaExceededError:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка поиска туров: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка поиска туров: {str(e)}"
+        )
+
+
+@router.post("/search-by-range", response_model=SearchByDateResponse)
+async def search_tours_by_range(
+    request: SearchByRangeRequest,
+):
+    try:
+        logger.info(f"Поиск туров по диапазону: {request.date_from} - {request.date_to}")
+
+        sheets_results = await run_google_io(
+            google_sheets_service.find_sheets_by_date_range,
+            request.date_from,
+            request.date_to,
+        )
+
+        if not sheets_results:
+            return SearchByDateResponse(
+                success=False,
+                found_count=0,
+                tours=[],
+                message=f"Туры с {request.date_from} по {request.date_to} не найдены"
+            )
+
+        tours = _to_tour_options(sheets_results)
+
         return SearchByDateResponse(
             success=True,
             found_count=len(tours),
@@ -132,6 +235,10 @@ async def search_tours_by_date(
             message=f"Найдено {len(tours)} вариантов тура"
         )
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QuotaExceededError:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка поиска туров: {e}", exc_info=True)
         raise HTTPException(
@@ -140,6 +247,26 @@ async def search_tours_by_date(
         )
 
 
+def _to_tour_options(sheets_results: List[dict]) -> List[TourOption]:
+    tours = []
+    for item in sheets_results:
+        # Определяем город вылета по маршруту
+        route = item.get("route", "")
+        departure_city = _get_departure_city(route)
+
+        tours.append(TourOption(
+            spreadsheet_id=item["spreadsheet_id"],
+            spreadsheet_name=item["spreadsheet_name"],
+            sheet_name=item["sheet_name"],
+            date_start=item["date_start"],
+            date_end=item["date_end"],
+            days=item["days"],
+            route=route or "Не указан",
+            departure_city=departure_city
+        ))
+    return tours
+
+
 def _get_departure_city(route: str) -> str:
     route_map = {
         "ALA-JED": "Almaty",
@@ -155,7 +282,7 @@ def _get_departure_city(route: str) -> str:
 @router.get("/test")
 async def test_google_sheets():
     try:
-        tables = google_sheets_service.get_all_spreadsheets()
+        tables = await run_google_io(google_sheets_service.get_all_spreadsheets)
         return {
             "success": True,
             "tables_count": len(tables),
@@ -165,6 +292,43 @@ async def test_google_sheets():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/quota")
+def get_google_quota():
+    """Метрики общего лимита запросов к Google API"""
+    return google_read_quota.metrics()
+
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Попадания/промахи и объём кэшей Google Sheets, объединённые запросы"""
+    return {
+        "sheet_values": sheet_values_cache.stats(),
+        "singleflight": {
+            "google_sheets": google_sheets_service.flight.stats(),
+            "sheet_pilgrims": sheet_flight.stats(),
+        },
+        "prefetch": sheet_prefetcher.stats(),
+        "column_maps": column_map_cache.stats(),
+        "manifests": manifest_store.stats(),
+    }
+
+
+@router.post("/catalog/refresh")
+def refresh_sheet_catalog():
+    """Сбрасывает кэш каталога таблиц/листов и строит его заново"""
+    try:
+        google_sheets_service.invalidate_catalog()
+        catalog = google_sheets_service.refresh_catalog()
+        return {
+            "success": True,
+            "tables_count": len(catalog.spreadsheets),
+            "indexed_tables_count": len(catalog.worksheets),
+        }
+    except Exception as e:
+        logger.error(f"Ошибка обновления каталога: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/sheet-pilgrims", response_model=SheetPilgrimsResponse)
 async def get_sheet_pilgrims(request: SheetPilgrimsRequest):
     try:
@@ -173,34 +337,31 @@ async def get_sheet_pilgrims(request: SheetPilgrimsRequest):
             f"(spreadsheet: {request.spreadsheet_id})"
         )
 
-        packages_raw = sheet_pilgrim_parser.parse_sheet_by_packages(
-            request.spreadsheet_id,
-            request.sheet_name
-        )
+        async with parse_trace("sheet-pilgrims", enabled=request.debug) as trace:
+            parsed = await run_google_io(
+                sheet_pilgrim_parser.get_parsed_sheet,
+                request.spreadsheet_id,
+                request.sheet_name
+            )
 
-        packages = []
-        total = 0
-
-        for pkg in packages_raw:
-            pilgrims = [
-                PilgrimInPackage(**p) for p in pkg["pilgrims"]
-            ]
-            packages.append(PackageInfo(
-                package_name=pkg["package_name"],
-                pilgrims=pilgrims,
-                count=pkg["count"]
-            ))
-            total += pkg["count"]
+        packages = [_to_package_info(pkg) for pkg in parsed.packages]
+        total = sum(pkg.count for pkg in packages)
 
         return SheetPilgrimsResponse(
             success=True,
             packages=packages,
             total_count=total,
+            revision=parsed.revision,
+            previous_revision=parsed.previous_revision,
+            changed_packages=parsed.changed_packages,
+            trace_id=trace.id if trace else None,
             message=f"Найдено {len(packages)} пакетов, всего {total} паломников"
         )
 
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except QuotaExceededError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения паломников: {e}", exc_info=True)
         raise HTTPException(
@@ -209,10 +370,190 @@ async def get_sheet_pilgrims(request: SheetPilgrimsRequest):
         )
 
 
+@router.post("/sheet-pilgrims/stream")
+async def stream_sheet_pilgrims(request: SheetPilgrimsRequest):
+    """
+    Паломники листа в формате NDJSON: одна строка JSON на пакет (PackageInfo
+    с "type": "package"), как только пакет разобран. Последняя строка —
+    {"type": "done", total_count, package_count, revision, previous_revision,
+    changed_packages} или
+    {"type": "error", message}, если лист сломался посреди разбора.
+    Трасса (debug) в потоковом режиме не записывается.
+    """
+    logger.info(
+        f"Потоковый запрос паломников из листа '{request.sheet_name}' "
+        f"(spreadsheet: {request.spreadsheet_id})"
+    )
+
+    packages = sheet_pilgrim_parser.parse_sheet_by_packages_iter(
+        request.spreadsheet_id,
+        request.sheet_name
+    )
+
+    # Первый пакет — до начала ответа: ошибки загрузки листа и
+    # превышение квоты уходят обычными HTTP-статусами
+    try:
+        first = await run_google_io(next, packages, None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QuotaExceededError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения паломников: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка получения паломников: {str(e)}"
+        )
+
+    return StreamingResponse(
+        _package_lines(request.spreadsheet_id, request.sheet_name, first, packages),
+        media_type="application/x-ndjson",
+    )
+
+
+async def _package_lines(
+    spreadsheet_id: str,
+    sheet_name: str,
+    first: Optional[Dict],
+    packages: Iterator[Dict],
+) -> AsyncIterator[str]:
+    total = 0
+    count = 0
+    pkg = first
+    try:
+        # Каждый следующий пакет парсится в пуле Google I/O: генератор
+        # сам догружает лист, event loop не блокируется
+        while pkg is not None:
+            info = _to_package_info(pkg)
+            yield _ndjson_line({"type": "package", **info.model_dump()})
+            total += pkg["count"]
+            count += 1
+            pkg = await run_google_io(next, packages, None)
+
+        # Генератор дошёл до конца и положил разбор в кэш
+        revision = await run_google_io(google_sheets_service.get_revision, spreadsheet_id)
+        parsed = sheet_pilgrim_parser.last_parsed(spreadsheet_id, sheet_name)
+        if parsed is not None and parsed.revision != revision:
+            parsed = None
+        yield _ndjson_line({
+            "type": "done",
+            "total_count": total,
+            "package_count": count,
+            "revision": revision,
+            "previous_revision": parsed.previous_revision if parsed else None,
+            "changed_packages": parsed.changed_packages if parsed else None,
+        })
+    except Exception as e:
+        # Заголовки уже отправлены — сообщаем об ошибке последней строкой
+        logger.error(f"Ошибка потоковой выдачи паломников: {e}", exc_info=True)
+        yield _ndjson_line({"type": "error", "message": str(e)})
+    finally:
+        # Клиент отключился, пока пакет ещё парсится в пуле: генератор
+        # занят потоком, его закроет сборщик мусора
+        try:
+            packages.close()
+        except ValueError:
+            pass
+
+
+def _ndjson_line(payload: Dict) -> str:
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+
+@router.post("/sheet-pilgrims/batch", response_model=BatchSheetPilgrimsResponse)
+async def get_sheet_pilgrims_batch(request: BatchSheetPilgrimsRequest):
+    """
+    Паломники нескольких листов за один запрос. Листы одной таблицы
+    загружаются одним values.batchGet, затем разбираются параллельно
+    (не больше GOOGLE_SHEETS_FETCH_CONCURRENCY листов одновременно).
+    Ошибка по листу не прерывает остальные — она в results[].error.
+    """
+    sheets = list(dict.fromkeys((s.spreadsheet_id, s.sheet_name) for s in request.sheets))
+    if not sheets:
+        raise HTTPException(status_code=400, detail="Не указаны листы")
+    if len(sheets) > settings.SHEET_BATCH_MAX_SHEETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Не больше {settings.SHEET_BATCH_MAX_SHEETS} листов за запрос"
+        )
+
+    logger.info(f"Пакетный запрос паломников: {len(sheets)} листов")
+
+    try:
+        await run_google_io(sheet_pilgrim_parser.preload_sheet_values, sheets)
+    except QuotaExceededError:
+        raise
+    except Exception as e:
+        # Не страшно: каждый лист загрузится сам при разборе
+        logger.warning(f"Пакетная загрузка листов не удалась: {e}")
+
+    # Запрос занимает не больше GOOGLE_SHEETS_FETCH_CONCURRENCY потоков
+    # google_io_executor: остальные остаются интерактивным запросам
+    slots = asyncio.Semaphore(settings.GOOGLE_SHEETS_FETCH_CONCURRENCY)
+
+    async def parse_sheet(spreadsheet_id: str, sheet_name: str):
+        async with slots:
+            return await run_google_io(sheet_pilgrim_parser.get_parsed_sheet, spreadsheet_id, sheet_name)
+
+    parsed_sheets = await asyncio.gather(
+        *(parse_sheet(spreadsheet_id, sheet_name) for spreadsheet_id, sheet_name in sheets),
+        return_exceptions=True,
+    )
+
+    results = []
+    for (spreadsheet_id, sheet_name), parsed in zip(sheets, parsed_sheets):
+        if isinstance(parsed, BaseException):
+            logger.error(f"Ошибка получения паломников листа '{sheet_name}': {parsed}")
+            results.append(SheetPilgrimsResult(
+                spreadsheet_id=spreadsheet_id,
+                sheet_name=sheet_name,
+                success=False,
+                error=str(parsed),
+            ))
+            continue
+
+        packages = [_to_package_info(pkg) for pkg in parsed.packages]
+        results.append(SheetPilgrimsResult(
+            spreadsheet_id=spreadsheet_id,
+            sheet_name=sheet_name,
+            success=True,
+            packages=packages,
+            total_count=sum(pkg.count for pkg in packages),
+            revision=parsed.revision,
+        ))
+
+    failed = sum(1 for result in results if not result.success)
+    total = sum(result.total_count for result in results)
+    return BatchSheetPilgrimsResponse(
+        success=failed == 0,
+        results=results,
+        total_count=total,
+        failed_count=failed,
+        message=f"Разобрано {len(results) - failed} из {len(results)} листов, всего {total} паломников"
+    )
+
+
+def _to_package_info(pkg: Dict) -> PackageInfo:
+    return PackageInfo(
+        package_name=pkg["package_name"],
+        pilgrims=[PilgrimInPackage(**p.to_dict()) for p in pkg["pilgrims"]],
+        count=pkg["count"]
+    )
+
+
+@router.get("/traces/{trace_id}")
+def get_parse_trace(trace_id: str):
+    """Трасса разбора листа, записанная запросом с debug=true"""
+    trace = trace_store.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Трасса {trace_id} не найдена или устарела")
+    return trace
+
+
 @router.get("/debug/sheets/{table_name}")
 async def debug_get_sheets(table_name: str):
     try:
-        tables = google_sheets_service.get_all_spreadsheets()
+        tables = await run_google_io(google_sheets_service.get_all_spreadsheets)
         table_id = None
         for name, tid in tables.items():
             if table_name.lower() in name.lower():
@@ -222,7 +563,7 @@ async def debug_get_sheets(table_name: str):
         if not table_id:
             raise HTTPException(status_code=404, detail=f"Таблица {table_name} не найдена")
 
-        sheets = google_sheets_service.get_sheet_names(table_id)
+        sheets = await run_google_io(google_sheets_service.get_sheet_names, table_id)
 
         return {
             "success": True,
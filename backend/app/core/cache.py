@@ -0,0 +1,189 @@
+"""
+Кэши общего назначения.
+
+LRUCache — L1 в памяти процесса с ограничением по объёму и числу записей.
+TwoTierCache — L1 + L2 в Redis (JSON, сжатый zlib), общий для всех воркеров.
+Оба считают попадания/промахи, чтобы их можно было смотреть через API.
+"""
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import redis
+
+from app.core.redis_client import get_redis, redis_key
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+
+    def __init__(self, max_bytes: int = 0, max_entries: int = 0):
+        """max_bytes/max_entries = 0 — без ограничения по этому параметру"""
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key: Hashable, value: Any, size: int = 1) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            if self.max_bytes and size > self.max_bytes:
+                # Запись больше всего кэша — не вытесняем ради неё остальное
+                return
+
+            self._data[key] = (value, size)
+            self._bytes += size
+
+            while self._data and (
+                (self.max_bytes and self._bytes > self.max_bytes)
+                or (self.max_entries and len(self._data) > self.max_entries)
+            ):
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self._bytes -= item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class TwoTierCache:
+    """
+    Ключ — кортеж строк. Значение должно сериализоваться в JSON;
+    encode/decode позволяют хранить собственные типы.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        l1_max_bytes: int,
+        ttl_seconds: int,
+        encode: Callable[[Any], Any] = lambda value: value,
+        decode: Callable[[Any], Any] = lambda value: value,
+    ):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.l1 = LRUCache(max_bytes=l1_max_bytes)
+        self._encode = encode
+        self._decode = decode
+        self._stats_lock = threading.Lock()
+        self.l2_hits = 0
+        self.l2_misses = 0
+
+    def get(self, key: Tuple[str, ...]) -> Optional[Any]:
+        value = self.l1.get(key)
+        if value is not None:
+            return value
+
+        client = get_redis()
+        if client is None:
+            return None
+
+        try:
+            raw = client.get(self._redis_key(key))
+        except redis.RedisError as e:
+            logger.warning("Кэш %s: Redis недоступен: %s", self.namespace, e)
+            return None
+
+        if raw is None:
+            self._count(l2_hit=False)
+            return None
+
+        try:
+            payload = zlib.decompress(raw)
+            value = self._decode(json.loads(payload))
+        except (zlib.error, ValueError) as e:
+            logger.warning("Кэш %s: повреждённая запись: %s", self.namespace, e)
+            return None
+
+        self._count(l2_hit=True)
+        self.l1.set(key, value, size=len(payload))
+        return value
+
+    def set(self, key: Tuple[str, ...], value: Any) -> None:
+        payload = json.dumps(
+            self._encode(value), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        self.l1.set(key, value, size=len(payload))
+
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.set(self._redis_key(key), zlib.compress(payload, 6), ex=self.ttl_seconds)
+        except redis.RedisError as e:
+            logger.warning("Кэш %s: не удалось записать в Redis: %s", self.namespace, e)
+
+    def get_or_load(self, key: Tuple[str, ...], loader: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def delete(self, key: Tuple[str, ...]) -> None:
+        self.l1.delete(key)
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.delete(self._redis_key(key))
+        except redis.RedisError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            l2 = {"hits": self.l2_hits, "misses": self.l2_misses}
+        return {"l1": self.l1.stats(), "l2": l2}
+
+    def _count(self, l2_hit: bool) -> None:
+        with self._stats_lock:
+            if l2_hit:
+                self.l2_hits += 1
+            else:
+                self.l2_misses += 1
+
+    def _redis_key(self, key: Tuple[str, ...]) -> str:
+        digest = hashlib.sha1("\x1f".join(key).encode("utf-8")).hexdigest()
+        return redis_key("cache", self.namespace, digest)
@@ -46,14 +46,66 @@ class Settings(BaseSettings):
     # Google Sheets
     GOOGLE_SHEETS_CREDENTIALS_FILE: str = "./credentials/credentials.json"
     GOOGLE_SHEETS_SPREADSHEET_ID: str = ""
+    # Кэш каталога таблиц/листов (названия и id). Между полными пересборками
+    # каталог сверяется с пробой ревизий Drive каждые REFRESH секунд.
+    GOOGLE_SHEETS_CATALOG_TTL_SECONDS: int = 21600
+    GOOGLE_SHEETS_CATALOG_REFRESH_SECONDS: int = 60
+    GOOGLE_SHEETS_REVISION_PROBE_SECONDS: int = 30
+    # Сколько таблиц/листов читаем параллельно: при построении каталога
+    # и в одном /tours/sheet-pilgrims/batch (меньше GOOGLE_IO_THREADS)
+    GOOGLE_SHEETS_FETCH_CONCURRENCY: int = 4
+    # Пул авторизованных клиентов (по одному на поток Google I/O)
+    GOOGLE_CLIENT_POOL_SIZE: int = 8
+    # Обновлять токен, когда до истечения осталось меньше
+    GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS: int = 600
+    # Общий для всех процессов лимит чтений Google API (token bucket в Redis)
+    GOOGLE_API_READS_PER_MINUTE: int = 60
+    GOOGLE_API_BURST: int = 15
+    GOOGLE_API_QUOTA_MODE: str = "queue"  # queue — ждать токен, reject — сразу отказ
+    GOOGLE_API_QUOTA_MAX_WAIT_SECONDS: float = 30
+    # Кэш значений листов (L1 в памяти процесса + L2 в Redis, ключ с ревизией)
+    SHEET_VALUES_CACHE_MAX_MB: int = 64
+    SHEET_VALUES_CACHE_TTL_SECONDS: int = 86400
+    # Загружать из листа только колонки, нужные парсеру. Меньше данных, но
+    # холодный лист стоит 1–3 запроса (токена квоты) вместо одного values.get:
+    # проба + первые строки, заголовки ниже них, нужные колонки. Когда в бюджете
+    # меньше 3 токенов, лист читается одним values.get
+    SHEET_COLUMN_RESTRICTED_FETCH: bool = True
+    # Карты колонок по сигнатуре строки-заголовка (общие для листов и манифестов)
+    COLUMN_MAP_CACHE_ENTRIES: int = 1024
+    # Предзагрузка листов, найденных поиском по дате
+    SHEET_PREFETCH_ENABLED: bool = True
+    SHEET_PREFETCH_MAX_SHEETS: int = 3
+    SHEET_PREFETCH_WORKERS: int = 2
+    # Не предзагружать, если в бюджете Google API осталось меньше токенов
+    SHEET_PREFETCH_MIN_TOKENS: int = 5
+    # Сколько листов можно запросить одним /tours/sheet-pilgrims/batch
+    SHEET_BATCH_MAX_SHEETS: int = 50
+
+    # Пулы исполнения: потоки для запросов к Google, процессы для парсинга
+    # файлов (0 — парсить в потоках без отдельных процессов)
+    GOOGLE_IO_THREADS: int = 8
+    PARSE_PROCESSES: int = 2
 
     # File Storage
     UPLOAD_DIR: str = "./uploads"
     MAX_UPLOAD_SIZE_MB: int = 10
     ALLOWED_EXTENSIONS: List[str] = [".xlsx", ".xls", ".csv"]
+    # Сколько манифестов разбирается одновременно в процессе воркера;
+    # остальные ждут до MANIFEST_PARSE_WAIT_SECONDS, затем 503
+    MANIFEST_PARSE_CONCURRENCY: int = 2
+    MANIFEST_PARSE_WAIT_SECONDS: float = 30
+    # Разобранные манифесты по хешу содержимого (L1 в памяти + Redis)
+    MANIFEST_CACHE_MAX_MB: int = 32
+    MANIFEST_CACHE_TTL_SECONDS: int = 86400
 
     # Logging
     LOG_LEVEL: str = "INFO"
+    # Трассировка парсинга листов (включается флагом debug в запросе)
+    PARSE_TRACE_TTL_SECONDS: int = 3600
+    PARSE_TRACE_MAX_EVENTS: int = 20000
+    # Сколько трасс держать в памяти процесса, если Redis недоступен
+    PARSE_TRACE_LOCAL_MAX: int = 50
 
     # Dispatch
     DISPATCH_DRY_RUN: bool = False
@@ -0,0 +1,82 @@
+"""
+Пулы исполнения для блокирующей работы из async-эндпоинтов.
+
+- google_io_executor — ограниченный пул потоков для запросов к Google API
+  (gspread/requests блокируют поток, но не держат GIL во время ожидания);
+- пул процессов — для CPU-тяжёлого парсинга (pandas/openpyxl), чтобы он
+  не конкурировал за GIL с обработкой запросов;
+- run_blocking — общий threadpool Starlette для коротких синхронных
+  вызовов (SQLAlchemy, проверки).
+
+Event loop воркера при этом остаётся свободным для других запросов.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+google_io_executor = ThreadPoolExecutor(
+    max_workers=settings.GOOGLE_IO_THREADS,
+    thread_name_prefix="google-io",
+)
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул процессов для парсинга; None, если отключён (PARSE_PROCESSES=0)"""
+    global _parse_pool
+    if settings.PARSE_PROCESSES <= 0:
+        return None
+    if _parse_pool is None:
+        # spawn: форк процесса с запущенными потоками и соединениями небезопасен
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=settings.PARSE_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _parse_pool
+
+
+async def run_google_io(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Выполняет func в пуле Google I/O, сохраняя contextvars запроса"""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        google_io_executor,
+        functools.partial(ctx.run, func, *args, **kwargs),
+    )
+
+
+async def run_cpu_bound(func: Callable, *args: Any) -> Any:
+    """
+    Выполняет func в пуле процессов. func и аргументы должны
+    сериализоваться pickle (функция уровня модуля, bytes/str).
+    """
+    pool = get_parse_pool()
+    if pool is None:
+        return await run_in_threadpool(func, *args)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, func, *args)
+
+
+async def run_blocking(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Короткий синхронный вызов (БД и т.п.) в общем threadpool"""
+    return await run_in_threadpool(func, *args, **kwargs)
+
+
+def shutdown_executors() -> None:
+    global _parse_pool
+    google_io_executor.shutdown(wait=False, cancel_futures=True)
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
@@ -0,0 +1,155 @@
+"""
+Трассировка парсинга по запросу.
+
+Парсеры записывают структурные события (найден пакет, строка-заголовок,
+строка пропущена и почему) в буфер текущего запроса вместо построчных
+INFO-логов. Трассировка выключена по умолчанию и включается флагом debug
+в запросе; без неё запись события — одна проверка contextvar.
+
+Буфер привязан к contextvar, поэтому переходит вместе с запросом в пул
+Google I/O (run_google_io копирует контекст). После запроса трасса
+сохраняется в Redis (или в память процесса) из пула потоков, не блокируя
+event loop, и доступна по id.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import redis
+
+from app.core.config import settings
+from app.core.executors import run_blocking
+from app.core.redis_client import get_redis, redis_key
+
+logger = logging.getLogger(__name__)
+
+_current_trace: ContextVar[Optional["ParseTrace"]] = ContextVar("parse_trace", default=None)
+
+
+class ParseTrace:
+
+    def __init__(self, name: str, max_events: int):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.max_events = max_events
+        self.events: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._started = time.perf_counter()
+        self._started_at = time.time()
+        self._lock = threading.Lock()
+
+    def event(self, kind: str, **fields: Any) -> None:
+        item = {
+            "ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "event": kind,
+            **fields,
+        }
+        with self._lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(item)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self.events)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "started_at": self._started_at,
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "events": events,
+            "dropped": self.dropped,
+        }
+
+
+class TraceStore:
+    """Готовые трассы: Redis с TTL, без Redis — последние трассы в памяти"""
+
+    def __init__(self, ttl_seconds: int, local_max: int):
+        self.ttl_seconds = ttl_seconds
+        self.local_max = local_max
+        self._local: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, trace: ParseTrace) -> None:
+        data = trace.to_dict()
+        client = get_redis()
+        if client is not None:
+            payload = zlib.compress(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"), 6)
+            try:
+                client.set(redis_key("parse_trace", trace.id), payload, ex=self.ttl_seconds)
+                return
+            except redis.RedisError as e:
+                logger.warning(f"Трасса {trace.id} не сохранена в Redis: {e}")
+
+        with self._lock:
+            self._local[trace.id] = data
+            while len(self._local) > self.local_max:
+                self._local.popitem(last=False)
+
+    def get(self, trace_id: str) -> Optional[Dict]:
+        with self._lock:
+            data = self._local.get(trace_id)
+        if data is not None:
+            return data
+
+        client = get_redis()
+        if client is None:
+            return None
+        try:
+            raw = client.get(redis_key("parse_trace", trace_id))
+        except redis.RedisError as e:
+            logger.warning(f"Трасса {trace_id} не прочитана из Redis: {e}")
+            return None
+        if raw is None:
+            return None
+        return json.loads(zlib.decompress(raw))
+
+
+@asynccontextmanager
+async def parse_trace(name: str, enabled: bool = True) -> AsyncIterator[Optional[ParseTrace]]:
+    """
+    Включает трассировку на время блока (async with); после блока трасса
+    сохраняется в пуле потоков. enabled=False — ничего не записывается,
+    внутри блока трасса None.
+    """
+    if not enabled:
+        yield None
+        return
+
+    trace = ParseTrace(name, max_events=settings.PARSE_TRACE_MAX_EVENTS)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.event("error", message=str(e))
+        raise
+    finally:
+        _current_trace.reset(token)
+        await run_blocking(trace_store.save, trace)
+
+
+def current_trace() -> Optional[ParseTrace]:
+    """Трасса текущего запроса; в горячих циклах берётся один раз до цикла"""
+    return _current_trace.get()
+
+
+def trace_event(kind: str, **fields: Any) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.event(kind, **fields)
+
+
+# Синглтон
+trace_store = TraceStore(
+    ttl_seconds=settings.PARSE_TRACE_TTL_SECONDS,
+    local_max=settings.PARSE_TRACE_LOCAL_MAX,
+)
@@ -0,0 +1,59 @@
+"""
+Общий Redis-клиент для кэшей и координации между процессами
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд не пытаться переподключиться после неудачи
+REDIS_RETRY_AFTER_SECONDS = 30
+REDIS_KEY_PREFIX = "tour_code:"
+
+_client: Optional[redis.Redis] = None
+_unavailable_until = 0.0
+_lock = threading.Lock()
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Возвращает Redis-клиент или None, если Redis недоступен.
+    Кэши при None работают только в памяти процесса.
+    """
+    global _client, _unavailable_until
+
+    if _client is not None:
+        return _client
+
+    if time.monotonic() < _unavailable_until:
+        return None
+
+    with _lock:
+        if _client is not None:
+            return _client
+        try:
+            client = redis.Redis.from_url(
+                settings.REDIS_URL,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                socket_timeout=2,
+                socket_connect_timeout=2,
+            )
+            client.ping()
+            _client = client
+        except redis.RedisError as e:
+            _unavailable_until = time.monotonic() + REDIS_RETRY_AFTER_SECONDS
+            logger.warning("Redis недоступен, кэш только в памяти: %s", e)
+            return None
+
+    return _client
+
+
+def redis_key(*parts: str) -> str:
+    """Собирает ключ Redis с общим префиксом проекта"""
+    return REDIS_KEY_PREFIX + ":".join(parts)
@@ -0,0 +1,216 @@
+"""
+Объединение одинаковых одновременных запросов (singleflight).
+
+Когда несколько операторов открывают один и тот же лист, вызов к Google
+и парсинг выполняет только первый запрос («ведущий»), остальные ждут его
+результат:
+- внутри процесса — через threading.Event;
+- между процессами — через блокировку в Redis (SET NX) и ключ результата
+  (JSON, сжатый zlib), помеченный токеном блокировки.
+
+Без Redis объединение работает только внутри процесса.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import redis
+
+from app.core.redis_client import get_redis, redis_key
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+
+    def __init__(
+        self,
+        namespace: str,
+        lock_seconds: int = 60,
+        result_ttl_seconds: int = 30,
+        poll_interval: float = 0.1,
+    ):
+        self.namespace = namespace
+        self.lock_seconds = lock_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.poll_interval = poll_interval
+        self._calls: Dict[Tuple[str, ...], _Call] = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"executed": 0, "shared_local": 0, "shared_remote": 0}
+
+    def do(
+        self,
+        key: Tuple[str, ...],
+        fn: Callable[[], Any],
+        shared: bool = True,
+        encode: Callable[[Any], Any] = lambda value: value,
+        decode: Callable[[Any], Any] = lambda value: value,
+    ) -> Any:
+        """
+        Выполняет fn один раз на все одновременные вызовы с тем же key.
+        shared=False — объединять только внутри процесса (результат не JSON).
+        Ошибка ведущего вызова получают все ожидающие в этом процессе.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            self._count("shared_local")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if shared:
+                call.result = self._do_shared(key, fn, encode, decode)
+            else:
+                call.result = self._execute(fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._lock:
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+    def _do_shared(
+        self,
+        key: Tuple[str, ...],
+        fn: Callable[[], Any],
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+    ) -> Any:
+        client = get_redis()
+        if client is None:
+            return self._execute(fn)
+
+        lock_key, result_key = self._redis_keys(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_seconds
+
+        while time.monotonic() < deadline:
+            try:
+                acquired = client.set(lock_key, token, nx=True, ex=self.lock_seconds)
+                if not acquired:
+                    leader_token = client.get(lock_key)
+                    if leader_token is None:
+                        continue
+                    found, value = self._wait_for_result(client, lock_key, result_key, leader_token, deadline)
+                    if found:
+                        self._count("shared_remote")
+                        return decode(value)
+                    # Ведущий процесс завершился без результата — пробуем стать ведущим
+                    continue
+            except redis.RedisError as e:
+                logger.warning("Singleflight %s: Redis недоступен: %s", self.namespace, e)
+                return self._execute(fn)
+
+            return self._lead(client, lock_key, result_key, token, fn, encode)
+
+        logger.warning("Singleflight %s: не дождались результата, выполняем сами", self.namespace)
+        return self._execute(fn)
+
+    def _lead(
+        self,
+        client: redis.Redis,
+        lock_key: str,
+        result_key: str,
+        token: str,
+        fn: Callable[[], Any],
+        encode: Callable[[Any], Any],
+    ) -> Any:
+        try:
+            value = self._execute(fn)
+            payload = json.dumps(
+                {"token": token, "value": encode(value)},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            ).encode("utf-8")
+            try:
+                # Сначала результат, потом снятие блокировки: ожидающие
+                # видят либо блокировку, либо готовый результат
+                client.set(result_key, zlib.compress(payload, 6), ex=self.result_ttl_seconds)
+            except redis.RedisError as e:
+                logger.warning("Singleflight %s: не удалось сохранить результат: %s", self.namespace, e)
+            return value
+        finally:
+            try:
+                if client.get(lock_key) == token.encode():
+                    client.delete(lock_key)
+            except redis.RedisError:
+                pass
+
+    def _wait_for_result(
+        self,
+        client: redis.Redis,
+        lock_key: str,
+        result_key: str,
+        leader_token: bytes,
+        deadline: float,
+    ) -> Tuple[bool, Any]:
+        token = leader_token.decode()
+        while time.monotonic() < deadline:
+            found, value = self._read_result(client, result_key, token)
+            if found:
+                return True, value
+
+            if client.get(lock_key) != leader_token:
+                # Блокировка снята: результат мог появиться прямо перед этим
+                return self._read_result(client, result_key, token)
+
+            time.sleep(self.poll_interval)
+
+        return False, None
+
+    def _read_result(self, client: redis.Redis, result_key: str, token: str) -> Tuple[bool, Any]:
+        raw = client.get(result_key)
+        if raw is None:
+            return False, None
+        try:
+            data = json.loads(zlib.decompress(raw))
+        except (zlib.error, ValueError):
+            return False, None
+        if data.get("token") != token:
+            return False, None
+        return True, data.get("value")
+
+    def _execute(self, fn: Callable[[], Any]) -> Any:
+        self._count("executed")
+        return fn()
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _redis_keys(self, key: Tuple[str, ...]) -> Tuple[str, str]:
+        digest = hashlib.sha1("\x1f".join(key).encode("utf-8")).hexdigest()
+        return (
+            redis_key("flight", self.namespace, digest, "lock"),
+            redis_key("flight", self.namespace, digest, "result"),
+        )
@@ -0,0 +1,144 @@
+"""
+Приём загружаемых файлов с ограничением размера.
+
+- UploadSizeLimitMiddleware отклоняет multipart-запрос больше лимита ещё
+  до того, как Starlette разберёт тело и сохранит файл: по Content-Length,
+  а без него — как только прочитано больше лимита.
+- upload_digest считает sha256 прямо по файлу, который уже сохранил
+  Starlette (UploadFile.file), без второй копии; вызывается в пуле потоков.
+- save_upload переносит файл на диск под именем: процесс разбора открывает
+  его сам, а не получает содержимое через pickle. Копия делается только
+  при промахе кэша манифестов, под слотом разбора.
+"""
+import hashlib
+import logging
+import shutil
+import tempfile
+from typing import BinaryIO, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+# Запас на границы и заголовки частей multipart сверх размера файла
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"Файл больше {max_bytes // (1024 * 1024)} МБ")
+
+
+def upload_digest(file: BinaryIO, max_bytes: int) -> str:
+    """
+    sha256 содержимого загруженного файла; UploadTooLargeError — сверх
+    лимита. Блокирующий: вызывать через run_blocking.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLargeError(max_bytes)
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def save_upload(file: BinaryIO, suffix: str) -> str:
+    """
+    Копирует загрузку в именованный временный файл и возвращает путь;
+    удаляет его вызывающий. Блокирующий: вызывать через run_blocking.
+    """
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+        shutil.copyfileobj(file, target, CHUNK_SIZE)
+    return target.name
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Ограничивает тело multipart-запросов (загрузки файлов).
+    Остальные запросы проходят без изменений.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes + MULTIPART_OVERHEAD_BYTES
+        self._file_max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not _is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = _content_length(scope)
+        if content_length is not None and content_length > self.max_bytes:
+            # Тело не читаем: клиент получит ответ, не дослав файл
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Для приложения — обрыв соединения: разбор тела прекращается
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            # Ответ приложения на оборванное тело заменяется на 413
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send) -> None:
+        logger.warning(f"Загрузка отклонена: тело запроса {scope.get('path')} больше лимита")
+        response = JSONResponse(
+            status_code=413,
+            content={"detail": str(UploadTooLargeError(self._file_max_bytes))},
+        )
+        await response(scope, receive, send)
+
+
+def _header(scope: Scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers") or []:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _is_multipart(scope: Scope) -> bool:
+    content_type = _header(scope, b"content-type") or b""
+    return content_type.lower().startswith(b"multipart/")
+
+
+def _content_length(scope: Scope) -> Optional[int]:
+    value = _header(scope, b"content-length")
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
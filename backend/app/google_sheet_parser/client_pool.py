@@ -0,0 +1,178 @@
+"""
+Пул авторизованных клиентов Google Sheets.
+
+requests.Session внутри gspread не рассчитан на одновременное использование
+из нескольких потоков, поэтому каждый поток пула Google I/O берёт свой
+клиент на время запроса. Клиенты держат keep-alive соединения, а токен
+service account общий и обновляется в фоне заранее, до истечения —
+запросы не платят ни за OAuth, ни за TLS-рукопожатие.
+"""
+import datetime
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import gspread
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2.service_account import Credentials
+
+logger = logging.getLogger(__name__)
+
+# Хосты, с которыми заранее устанавливаем соединение при прогреве
+WARM_UP_URLS = [
+    "https://sheets.googleapis.com/",
+    "https://www.googleapis.com/",
+]
+TOKEN_CHECK_INTERVAL_SECONDS = 60
+
+
+class GoogleClientPool:
+
+    def __init__(
+        self,
+        credentials_file: str,
+        scopes: List[str],
+        size: int,
+        refresh_margin_seconds: int,
+        borrow_timeout: float = 60,
+    ):
+        self._credentials_file = credentials_file
+        self._scopes = scopes
+        self.size = max(1, size)
+        self._refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self._borrow_timeout = borrow_timeout
+        self._credentials: Optional[Credentials] = None
+        self._idle: "queue.LifoQueue[gspread.Client]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._token_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        self.token_refreshes = 0
+
+    @contextmanager
+    def client(self) -> Iterator[gspread.Client]:
+        """Берёт клиент из пула на время запроса"""
+        client = self._borrow()
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def warm_up(self) -> None:
+        """Создаёт все клиенты, получает токен и открывает соединения"""
+        self.refresh_token_if_needed()
+
+        # Занятые запросами клиенты не ждём — они и так уже прогреты
+        clients = []
+        for _ in range(self.size):
+            client = self._borrow(wait=False)
+            if client is None:
+                break
+            clients.append(client)
+        try:
+            for client in clients:
+                for url in WARM_UP_URLS:
+                    try:
+                        client.http_client.session.head(url, timeout=5)
+                    except Exception as e:
+                        logger.warning(f"Прогрев соединения {url} не удался: {e}")
+        finally:
+            for client in clients:
+                self._idle.put(client)
+
+        logger.info(f"Пул Google клиентов прогрет: {len(clients)} из {self.size}")
+
+    def refresh_token_if_needed(self) -> bool:
+        """Обновляет токен, если до истечения осталось меньше refresh_margin"""
+        credentials = self._get_credentials()
+        with self._token_lock:
+            expiry = credentials.expiry
+            # expiry у google-auth — naive UTC
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            if credentials.token and expiry is not None and expiry - now > self._refresh_margin:
+                return False
+
+            credentials.refresh(Request())
+            self.token_refreshes += 1
+            logger.info(f"Токен Google обновлён, действует до {credentials.expiry}")
+            return True
+
+    def start_background_refresh(self) -> None:
+        """Фоновый поток: прогрев пула, затем проактивное обновление токена"""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop,
+            name="google-token-refresher",
+            daemon=True,
+        )
+        self._refresher.start()
+
+    def stop_background_refresh(self) -> None:
+        self._stop_event.set()
+
+    def stats(self) -> Dict:
+        credentials = self._credentials
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+            "token_refreshes": self.token_refreshes,
+            "token_expiry": credentials.expiry.isoformat() if credentials and credentials.expiry else None,
+        }
+
+    def _refresh_loop(self) -> None:
+        try:
+            self.warm_up()
+        except Exception as e:
+            logger.error(f"Ошибка прогрева Google клиентов: {e}")
+
+        while not self._stop_event.wait(TOKEN_CHECK_INTERVAL_SECONDS):
+            try:
+                self.refresh_token_if_needed()
+            except Exception as e:
+                logger.error(f"Ошибка обновления токена Google: {e}")
+
+    def _borrow(self, wait: bool = True) -> Optional[gspread.Client]:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                client = self._create_client()
+                self._created += 1
+                return client
+
+        if not wait:
+            return None
+        try:
+            return self._idle.get(timeout=self._borrow_timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет свободного Google клиента в пуле")
+
+    def _create_client(self) -> gspread.Client:
+        try:
+            session = AuthorizedSession(self._get_credentials())
+            client = gspread.authorize(self._get_credentials(), session=session)
+            logger.info("Google Sheets клиент подключен")
+            return client
+        except Exception as e:
+            logger.error(f"Ошибка подключения к Google Sheets: {e}")
+            raise
+
+    def _get_credentials(self) -> Credentials:
+        if self._credentials is None:
+            with self._token_lock:
+                if self._credentials is None:
+                    self._credentials = Credentials.from_service_account_file(
+                        self._credentials_file,
+                        scopes=self._scopes,
+                    )
+        return self._credentials
@@ -0,0 +1,184 @@
+"""
+Построчное чтение первого листа Excel (или CSV) для парсера манифестов.
+
+Движки перебираются по порядку, используется первый установленный,
+который умеет читать расширение файла:
+- python-calamine (необязательная зависимость) — быстрый ридер на Rust,
+  читает .xlsx/.xlsm/.xlsb/.xls/.ods;
+- openpyxl в режиме read_only — строки читаются из XML по одной,
+  лист целиком в памяти не собирается;
+- csv из стандартной библиотеки — кодировка и разделитель определяются
+  по началу файла; если utf-8 ломается дальше начала, файл дочитывается
+  в cp1251.
+Если подходящего движка нет (например .xls без calamine), парсер
+манифестов читает файл через pandas.
+"""
+import codecs
+import csv
+from datetime import date, datetime, time
+from io import BytesIO, TextIOWrapper
+from itertools import islice
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+Row = Sequence[Any]
+# Содержимое файла (bytes) или путь к нему на диске (str)
+Source = Union[bytes, str]
+RowReader = Callable[[Source], Iterator[Row]]
+
+
+def open_source(source: Source) -> Union[BytesIO, str]:
+    """То, что принимают ридеры: файловый объект для bytes, путь как есть"""
+    return BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _calamine_rows(source: Source) -> Iterator[Row]:
+    workbook = CalamineWorkbook.from_object(open_source(source))
+    sheet = workbook.get_sheet_by_index(0)
+    for row in sheet.iter_rows():
+        # Дату без времени calamine отдаёт как date — приводим к datetime,
+        # как у openpyxl и pandas
+        yield [datetime.combine(cell, time()) if type(cell) is date else cell for cell in row]
+
+
+def _openpyxl_rows(source: Source) -> Iterator[Row]:
+    # Импорт здесь: разбор CSV не должен загружать openpyxl
+    import openpyxl
+
+    # data_only — значения формул, как их сохранил Excel (так же читает pandas)
+    workbook = openpyxl.load_workbook(open_source(source), read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # Размеры листа в файле бывают неверными — читаем до последней строки
+        sheet.reset_dimensions()
+        yield from sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# Начало CSV, по которому определяются кодировка и разделитель
+CSV_SAMPLE_BYTES = 64 * 1024
+# Разделитель ищем только по первым строкам: Sniffer перебирает символы в Python
+CSV_SNIFF_LINES = 50
+CSV_DELIMITERS = ",;\t|"
+
+
+def _csv_encoding(sample: bytes) -> str:
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # Образец может обрываться посреди символа — final=False
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        # Выгрузки из Excel/1С под русской Windows
+        return "cp1251"
+
+
+def _csv_delimiter(lines: List[str]) -> str:
+    try:
+        return csv.Sniffer().sniff("\n".join(lines), delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        # Одна колонка или неровные строки — самый частый разделитель первой строки
+        first = next((line for line in lines if line.strip()), "")
+        delimiter = max(CSV_DELIMITERS, key=first.count)
+        return delimiter if first.count(delimiter) else ","
+
+
+def _csv_rows(source: Source) -> Iterator[Row]:
+    with _open_binary(source) as raw:
+        sample = raw.read(CSV_SAMPLE_BYTES)
+    encoding = _csv_encoding(sample)
+    lines = sample.decode(encoding, errors="ignore").splitlines()
+    if len(sample) == CSV_SAMPLE_BYTES:
+        # Файл длиннее образца — последняя строка может быть неполной
+        lines = lines[:-1]
+    lines = lines[:CSV_SNIFF_LINES] or [""]
+
+    # Excel пишет первой строкой "sep=;", если разделитель не запятая
+    explicit = lines[0].startswith("sep=") and len(lines[0]) == 5
+    delimiter = lines[0][4] if explicit else _csv_delimiter(lines)
+
+    read = 0
+    try:
+        for row in _read_csv(source, encoding, delimiter, explicit):
+            yield row
+            read += 1
+    except UnicodeDecodeError:
+        if encoding != "utf-8":
+            raise
+        # Образец был ASCII, а русский текст в cp1251 начался дальше него:
+        # дочитываем файл в cp1251 после уже отданных строк
+        yield from islice(_read_csv(source, "cp1251", delimiter, explicit), read, None)
+
+
+def _open_binary(source: Source) -> BinaryIO:
+    return open(source, "rb") if isinstance(source, str) else BytesIO(source)
+
+
+def _read_csv(source: Source, encoding: str, delimiter: str, skip_sep_line: bool) -> Iterator[Row]:
+    with _open_binary(source) as raw:
+        reader = csv.reader(TextIOWrapper(raw, encoding=encoding, newline=""), delimiter=delimiter)
+        if skip_sep_line:
+            next(reader, None)
+        yield from reader
+
+
+# (название, расширения, ридер) в порядке предпочтения
+ENGINES: List[Tuple[str, Tuple[str, ...], Optional[RowReader]]] = [
+    (
+        "calamine",
+        (".xlsx", ".xlsm", ".xlsb", ".xls", ".ods"),
+        _calamine_rows if CalamineWorkbook is not None else None,
+    ),
+    ("openpyxl", (".xlsx", ".xlsm"), _openpyxl_rows),
+    ("csv", (".csv",), _csv_rows),
+]
+
+
+def excel_row_reader(filename: str) -> Optional[Tuple[str, RowReader]]:
+    """Первый установленный движок для расширения файла или None"""
+    extension = "." + filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    for name, extensions, reader in ENGINES:
+        if reader is not None and extension in extensions:
+            return name, reader
+    return None
+
+
+def is_blank_row(row: Row) -> bool:
+    return all(cell is None or cell == "" for cell in row)
+
+
+def header_labels(row: Row) -> List[Any]:
+    """
+    Названия колонок из строки-заголовка по правилам pandas.read_excel:
+    пустые — "Unnamed: N", повторы — "Name.1", "Name.2", ...
+    """
+    labels = [
+        _header_label(cell) if cell is not None and cell != "" else f"Unnamed: {idx}"
+        for idx, cell in enumerate(row)
+    ]
+
+    counts: Dict[Any, int] = {}
+    for idx, label in enumerate(labels):
+        count = counts.get(label, 0)
+        while count > 0:
+            counts[label] = count + 1
+            label = f"{label}.{count}"
+            count = counts.get(label, 0)
+        labels[idx] = label
+        counts[label] = count + 1
+    return labels
+
+
+def _header_label(cell: Any) -> Any:
+    # Число в заголовке: calamine отдаёт 1.0, openpyxl и pandas — 1
+    if isinstance(cell, float) and cell.is_integer():
+        return int(cell)
+    return cell
@@ -1,13 +1,22 @@
 
 import logging
+import threading
 import time
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import MimeType, absolute_range_name, fill_gaps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
 import re
 
 from app.core.config import settings
+from app.core.singleflight import SingleFlight
+from app.google_sheet_parser.client_pool import GoogleClientPool
+from app.google_sheet_parser.quota_governor import QuotaExceededError, google_read_quota
+from app.google_sheet_parser.revision_probe import SheetRevisionProbe
+from app.google_sheet_parser.sheet_catalog import SheetCatalog, SheetCatalogCache
+from app.google_sheet_parser.sheet_date_index import SheetDateIndex
 
 logger = logging.getLogger(__name__)
 
@@ -15,47 +24,101 @@ SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
 ]
+# Из метаданных таблицы запрашиваем только названия листов
+SHEET_TITLES_FIELDS = "sheets.properties.title"
+REVISION_FIELDS = "nextPageToken,files(id,name,modifiedTime,version)"
 
 
 class GoogleSheetsService:
 
     def __init__(self):
-        self._client = None
-
-    @property
-    def client(self) -> gspread.Client:
-        """Lazy loading клиента"""
-        if self._client is None:
-            try:
-                creds = Credentials.from_service_account_file(
-                    settings.GOOGLE_SHEETS_CREDENTIALS_FILE,
-                    scopes=SCOPES
-                )
-                self._client = gspread.authorize(creds)
-                logger.info("Google Sheets клиент подключен")
-            except Exception as e:
-                logger.error(f"Ошибка подключения к Google Sheets: {e}")
-                raise
-        return self._client
-
-    def _api_call_with_retry(self, func, max_retries=3):
-        """Вызов API с retry при 429 ошибке"""
+        self.client_pool = GoogleClientPool(
+            settings.GOOGLE_SHEETS_CREDENTIALS_FILE,
+            SCOPES,
+            size=settings.GOOGLE_CLIENT_POOL_SIZE,
+            refresh_margin_seconds=settings.GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS,
+        )
+        self._date_index: Optional[SheetDateIndex] = None
+        self._date_index_lock = threading.Lock()
+        # Одинаковые одновременные чтения выполняются одним запросом к Google
+        self.flight = SingleFlight("google_sheets")
+        self.catalog = SheetCatalogCache(
+            lambda: self.flight.do(
+                ("catalog",),
+                self._load_catalog,
+                encode=SheetCatalog.to_json,
+                decode=SheetCatalog.from_json,
+            ),
+            ttl_seconds=settings.GOOGLE_SHEETS_CATALOG_TTL_SECONDS,
+        )
+        self.revision_probe = SheetRevisionProbe(
+            list_files=self._list_spreadsheet_revisions,
+            get_file=self._get_file_revision,
+            ttl_seconds=settings.GOOGLE_SHEETS_REVISION_PROBE_SECONDS,
+            years=self._target_years,
+        )
+
+    def _api_call_with_retry(self, func, max_retries=3, cost=1):
+        """
+        Вызов API через общий лимит запросов: func(client) получает клиент
+        из пула. При 429 штрафуем общий bucket, и следующая попытка ждёт
+        токен вместе со всеми процессами.
+        """
         for attempt in range(max_retries):
+            google_read_quota.acquire(cost)
             try:
-                return func()
+                with self.client_pool.client() as client:
+                    return func(client)
             except gspread.exceptions.APIError as e:
                 if e.response.status_code == 429 and attempt < max_retries - 1:
                     wait = 2 ** attempt * 5  # 5s, 10s, 20s
-                    logger.warning(f"Rate limit, ждём {wait}с...")
-                    time.sleep(wait)
+                    logger.warning(f"Rate limit, пауза квоты {wait}с...")
+                    google_read_quota.penalize(wait)
                 else:
                     raise
 
+    def start_client_refresher(self) -> None:
+        """Прогрев пула клиентов и фоновое обновление токена"""
+        self.client_pool.start_background_refresh()
+
+    def stop_client_refresher(self) -> None:
+        self.client_pool.stop_background_refresh()
+
+    def get_sheet_values(self, spreadsheet_id: str, sheet_name: str) -> List[List]:
+        """Все значения листа одним запросом values.get"""
+        return self.flight.do(
+            ("values", spreadsheet_id, sheet_name),
+            lambda: fill_gaps(self._api_call_with_retry(
+                lambda client: client.http_client.values_get(
+                    spreadsheet_id,
+                    absolute_range_name(sheet_name),
+                )
+            ).get("values", [])),
+        )
+
+    def batch_get_values(
+        self,
+        spreadsheet_id: str,
+        ranges: List[str],
+        major_dimension: str = "ROWS",
+    ) -> List[List[List]]:
+        """Несколько диапазонов одной таблицы одним запросом values.batchGet"""
+        response = self.flight.do(
+            ("batch", spreadsheet_id, major_dimension, *ranges),
+            lambda: self._api_call_with_retry(
+                lambda client: client.http_client.values_batch_get(
+                    spreadsheet_id,
+                    ranges,
+                    params={"majorDimension": major_dimension},
+                )
+            ),
+        )
+        value_ranges = response.get("valueRanges", [])
+        return [value_ranges[i].get("values", []) if i < len(value_ranges) else [] for i in range(len(ranges))]
+
     def get_all_spreadsheets(self) -> Dict[str, str]:
         try:
-            result = self._api_call_with_retry(
-                lambda: {ss.title: ss.id for ss in self.client.openall()}
-            )
+            result = dict(self._get_catalog().spreadsheets)
             logger.info(f"Найдено {len(result)} таблиц")
             return result
         except Exception as e:
@@ -64,88 +127,247 @@ class GoogleSheetsService:
 
     def get_sheet_names(self, spreadsheet_id: str) -> List[str]:
         try:
-            result = self._api_call_with_retry(
-                lambda: [ws.title for ws in self.client.open_by_key(spreadsheet_id).worksheets()]
-            )
+            catalog = self._get_catalog()
+            if spreadsheet_id in catalog.worksheets:
+                return list(catalog.worksheets[spreadsheet_id])
+
+            result = self._fetch_sheet_names(spreadsheet_id)
+            self.catalog.remember_worksheets(spreadsheet_id, result)
             return result
         except Exception as e:
             logger.error(f"Ошибка получения листов: {e}")
             return []
 
+    def get_revision(self, spreadsheet_id: str) -> Optional[str]:
+        """Текущая ревизия таблицы (Drive version) или None"""
+        return self.revision_probe.get_revision(spreadsheet_id)
+
+    def sync_catalog_revisions(self) -> SheetCatalog:
+        """Перечитывает листы только тех таблиц, чья ревизия изменилась"""
+        return self.catalog.apply_revisions(
+            self.revision_probe.revisions(),
+            self.fetch_sheet_names_many,
+        )
+
+    def _get_catalog(self) -> SheetCatalog:
+        try:
+            return self.sync_catalog_revisions()
+        except QuotaExceededError:
+            return self.catalog.get()
+        except Exception as e:
+            logger.warning(f"Проба ревизий не удалась, используем каталог как есть: {e}")
+            return self.catalog.get()
+
+    def refresh_catalog(self) -> SheetCatalog:
+        """Принудительно перечитывает каталог таблиц и листов"""
+        return self.catalog.refresh()
+
+    def invalidate_catalog(self) -> None:
+        self.catalog.invalidate()
+
+    def start_catalog_refresher(self) -> None:
+        self.catalog.start_background_refresh(
+            settings.GOOGLE_SHEETS_CATALOG_REFRESH_SECONDS,
+            on_tick=self.sync_catalog_revisions,
+        )
+
+    def stop_catalog_refresher(self) -> None:
+        self.catalog.stop_background_refresh()
+
     def find_sheets_by_date(self, date_str: str) -> List[Dict]:
-        date_normalized = self._normalize_date(date_str)
-        target_tables = self._get_current_and_next_year_tables()
+        day_month = self._parse_day_month(date_str)
+        if day_month is None:
+            logger.warning(f"Некорректная дата для поиска: {date_str}")
+            return []
 
-        results = []
+        try:
+            index = self.get_date_index()
+        except QuotaExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка получения каталога таблиц: {e}")
+            return []
 
-        for table_name, table_id in target_tables.items():
-            try:
-                sheet_names = self.get_sheet_names(table_id)
-                time.sleep(1)
-                for sheet_name in sheet_names:
-                    if self._sheet_matches_date(sheet_name, date_normalized):
-                        parsed = self._parse_sheet_name(sheet_name)
-
-                        if parsed:
-                            results.append({
-                                "spreadsheet_id": table_id,
-                                "spreadsheet_name": table_name,
-                                "sheet_name": sheet_name,
-                                "date_start": parsed["date_start"],
-                                "date_end": parsed["date_end"],
-                                "days": parsed["days"],
-                                "route": parsed["route"]
-                            })
-
-                            logger.info(f"Найден лист: {sheet_name} в таблице {table_name}")
-
-            except Exception as e:
-                logger.error(f"Ошибка обработки таблицы {table_name}: {e}")
-                continue
+        results = [record.to_dict() for record in index.lookup(*day_month)]
 
         logger.info(f"Найдено {len(results)} листов для даты {date_str}")
         return results
 
+    def find_sheets_by_date_range(self, date_from: str, date_to: str) -> List[Dict]:
+        """
+        Листы с датой вылета в диапазоне. Границы — "10.02" (без года,
+        сравнение по дню и месяцу) или "10.02.2026" (с учётом года).
+        """
+        index = self.get_date_index()
+
+        full_from = self._parse_full_date(date_from)
+        full_to = self._parse_full_date(date_to)
+        if full_from and full_to:
+            records = index.range_by_date(full_from, full_to)
+        else:
+            start = self._parse_day_month(date_from)
+            end = self._parse_day_month(date_to)
+            if start is None or end is None:
+                raise ValueError(f"Некорректный диапазон дат: {date_from} - {date_to}")
+            records = index.range_by_day_month(start, end)
+
+        results = [record.to_dict() for record in records]
+        logger.info(f"Найдено {len(results)} листов в диапазоне {date_from} - {date_to}")
+        return results
+
+    def get_date_index(self) -> SheetDateIndex:
+        """Индекс листов по дате; перестраивается только при смене версии каталога"""
+        catalog = self._get_catalog()
+        index = self._date_index
+        if index is not None and index.version == catalog.version:
+            return index
+
+        with self._date_index_lock:
+            index = self._date_index
+            if index is None or index.version != catalog.version:
+                index = SheetDateIndex.build(
+                    self._filter_year_tables(catalog.spreadsheets),
+                    catalog.worksheets,
+                    self._parse_sheet_name,
+                    version=catalog.version,
+                )
+                self._date_index = index
+                logger.info(f"Индекс листов по дате построен: {len(index)} листов")
+        return index
+
     def _get_current_and_next_year_tables(self) -> Dict[str, str]:
         """Получить таблицы текущего и следующего года"""
+        return self._filter_year_tables(self.get_all_spreadsheets())
+
+    def _target_years(self) -> List[str]:
         now = datetime.now()
-        years = [str(now.year), str(now.year + 1)]
+        return [str(now.year), str(now.year + 1)]
+
+    def _filter_year_tables(self, all_tables: Dict[str, str]) -> Dict[str, str]:
+        years = self._target_years()
+        return {name: table_id for name, table_id in all_tables.items() if _is_year_table(name, years)}
 
-        all_tables = self.get_all_spreadsheets()
+    # ==================== Загрузка каталога из Google API ====================
 
-        target = {}
-        for name, table_id in all_tables.items():
-            if any(year in name for year in years):
-                target[name] = table_id
+    def _load_catalog(self) -> SheetCatalog:
+        """
+        Строит каталог: все таблицы (один запрос к Drive) и листы
+        таблиц текущего/следующего года.
+        """
+        files = self._api_call_with_retry(lambda client: client.list_spreadsheet_files())
+        spreadsheets = {f["name"]: f["id"] for f in files}
 
-        return target
+        revisions = self.revision_probe.revisions(force=True)
+        target_tables = self._filter_year_tables(spreadsheets)
+        worksheets = self.fetch_sheet_names_many(list(target_tables.values()))
 
-    def _normalize_date(self, date_str: str) -> str:
-        """Нормализует дату: 7.02 -> 07.02"""
+        for table_name, table_id in target_tables.items():
+            if table_id not in worksheets:
+                logger.error(f"Листы таблицы {table_name} не получены")
+
+        return SheetCatalog(
+            spreadsheets=spreadsheets,
+            worksheets=worksheets,
+            revisions={
+                spreadsheet_id: revisions.revision(spreadsheet_id)
+                for spreadsheet_id in worksheets
+                if revisions.revision(spreadsheet_id) is not None
+            },
+            built_at=time.time(),
+        )
+
+    def _list_spreadsheet_revisions(self, years: List[str]) -> List[Dict]:
+        """
+        files.list по годовым таблицам: только id, name, modifiedTime, version.
+        Год в названии проверяется здесь, а не в q: name contains в Drive
+        совпадает только с началом слова и пропустил бы "Hikmet2026",
+        который _filter_year_tables берёт в каталог.
+        """
+        params = {
+            "q": f'mimeType="{MimeType.google_sheets}" and trashed = false',
+            "pageSize": 1000,
+            "supportsAllDrives": True,
+            "includeItemsFromAllDrives": True,
+            "fields": REVISION_FIELDS,
+        }
+
+        files = []
+        while True:
+            page = self._api_call_with_retry(
+                lambda client: client.http_client.request(
+                    "get", DRIVE_FILES_API_V3_URL, params=dict(params)
+                ).json()
+            )
+            files.extend(f for f in page.get("files", []) if _is_year_table(f.get("name", ""), years))
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return files
+            params["pageToken"] = page_token
+
+    def _get_file_revision(self, spreadsheet_id: str) -> Dict:
+        return self._api_call_with_retry(
+            lambda client: client.http_client.request(
+                "get",
+                f"{DRIVE_FILES_API_V3_URL}/{spreadsheet_id}",
+                params={"fields": "id,name,modifiedTime,version", "supportsAllDrives": True},
+            ).json()
+        )
+
+    def fetch_sheet_names_many(self, spreadsheet_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        Параллельно получает названия листов нескольких таблиц.
+        Ошибка по одной таблице не мешает остальным.
+        """
+        if not spreadsheet_ids:
+            return {}
+
+        result = {}
+        workers = max(1, min(settings.GOOGLE_SHEETS_FETCH_CONCURRENCY, len(spreadsheet_ids)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sheets-meta") as pool:
+            futures = {
+                pool.submit(self._fetch_sheet_names, spreadsheet_id): spreadsheet_id
+                for spreadsheet_id in spreadsheet_ids
+            }
+            for future in as_completed(futures):
+                spreadsheet_id = futures[future]
+                try:
+                    result[spreadsheet_id] = future.result()
+                except Exception as e:
+                    logger.error(f"Ошибка получения листов таблицы {spreadsheet_id}: {e}")
+
+        return result
+
+    def _fetch_sheet_names(self, spreadsheet_id: str) -> List[str]:
+        """Один запрос метаданных, только названия листов (field mask)"""
+        metadata = self.flight.do(
+            ("titles", spreadsheet_id),
+            lambda: self._api_call_with_retry(
+                lambda client: client.http_client.fetch_sheet_metadata(
+                    spreadsheet_id,
+                    params={"includeGridData": "false", "fields": SHEET_TITLES_FIELDS},
+                )
+            ),
+        )
+        return [sheet["properties"]["title"] for sheet in metadata.get("sheets", [])]
+
+    def _parse_day_month(self, date_str: str) -> Optional[Tuple[int, int]]:
+        """Разбирает "7.02" / "07.02" / "07.02.2026" -> (7, 2)"""
         parts = date_str.strip().split(".")
-        if len(parts) == 2:
-            dd = parts[0].zfill(2)
-            mm = parts[1].zfill(2)
-            return f"{dd}.{mm}"
-        return date_str
-
-    def _sheet_matches_date(self, sheet_name: str, date_normalized: str) -> bool:
-        """Проверяет, соответствует ли название листа дате"""
-        parts = date_normalized.split(".")
-        if len(parts) == 2:
-            dd, mm = parts
-            variants = [
-                f"{dd}.{mm}",           # 07.03
-                f"{int(dd)}.{mm}",      # 7.03
-                f"{dd}.{int(mm)}",      # 07.3
-                f"{int(dd)}.{int(mm)}"  # 7.3
-            ]
-
-            for variant in variants:
-                if sheet_name.strip().startswith(variant):
-                    return True
-
-        return False
+        if len(parts) not in (2, 3):
+            return None
+        try:
+            day, month = int(parts[0]), int(parts[1])
+        except ValueError:
+            return None
+        if not (1 <= day <= 31 and 1 <= month <= 12):
+            return None
+        return day, month
+
+    def _parse_full_date(self, date_str: str) -> Optional[date]:
+        try:
+            return datetime.strptime(date_str.strip(), "%d.%m.%Y").date()
+        except ValueError:
+            return None
 
     def _parse_sheet_name(self, sheet_name: str) -> Optional[Dict]:
         try:
@@ -223,5 +445,10 @@ class GoogleSheetsService:
         return None
 
 
+def _is_year_table(name: str, years: List[str]) -> bool:
+    """Годовая таблица: год встречается в названии где угодно ("Hikmet2026")"""
+    return any(year in name for year in years)
+
+
 # Синглтон
 google_sheets_service = GoogleSheetsService()
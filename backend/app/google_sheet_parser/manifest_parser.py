@@ -1,128 +1,302 @@
 """
-Сервис для парсинга манифестов паломников из Excel файлов
+Сервис для парсинга манифестов паломников из Excel и CSV файлов
 """
+from __future__ import annotations
+
 import logging
 from decimal import Decimal, InvalidOperation
 import re
-from typing import List, Dict, Optional
-import pandas as pd
-from io import BytesIO
-from app.services.document_rules import normalize_document
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from app.google_sheet_parser.excel_rows import Source, excel_row_reader, header_labels, is_blank_row, open_source
+from app.services.column_map_cache import cached_column_map
+from app.services.document_rules import normalize_document, normalize_document_column
+from app.services.keyword_matcher import KeywordMatcher
+from app.services.pilgrim_record import PilgrimRecord
+
+if TYPE_CHECKING:
+    # pandas и numpy нужны только запасному пути через DataFrame и
+    # импортируются там: CSV и xlsx разбираются без них
+    import numpy as np
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_COLUMNS = ("surname", "name", "full_name", "document", "iin")
+# Входит в manifest_id: увеличивать при любом изменении правил разбора,
+# иначе повторные загрузки получат из кэша результат старой версии
+MANIFEST_PARSER_VERSION = 1
+# Форматы, которые принимает /manifest/upload (вместе с ALLOWED_EXTENSIONS)
+MANIFEST_EXTENSIONS = (".xlsx", ".xls", ".csv")
+
+
+def _normalize_header(value: str) -> str:
+    normalized = re.sub(r'[^a-z0-9а-яё]+', ' ', str(value).lower())
+    return re.sub(r'\s+', ' ', normalized).strip()
+
+
+def _column_matcher(aliases: List[str]) -> KeywordMatcher:
+    """Названия колонки в порядке приоритета, целыми словами"""
+    return KeywordMatcher([_normalize_header(alias) for alias in aliases], words=True)
+
+
+COLUMN_MATCHERS = {
+    "surname": _column_matcher(['surname', 'last name', 'lastname', 'фамилия']),
+    "name": _column_matcher(['name', 'first name', 'firstname', 'имя']),
+    "full_name": _column_matcher(['full name', 'first/last name', 'fio', 'фио']),
+    "document": _column_matcher([
+        'document number',
+        'document no',
+        'doc number',
+        'document',
+        'passport number',
+        'passport no',
+        'passport',
+        'номер паспорта',
+        'номер документа',
+        'паспорт',
+        'загранпаспорт',
+    ]),
+    "iin": _column_matcher(['iin', 'иин', 'iin number', 'personal id']),
+}
+
 
 class ManifestParser:
 
-    def parse_manifest(self, file_content: bytes, filename: str) -> List[Dict]:
+    def parse_manifest(self, source: Source, filename: str) -> List[PilgrimRecord]:
+        """source — содержимое файла или путь к нему (большие загрузки лежат на диске)"""
         try:
-            df = pd.read_excel(BytesIO(file_content), sheet_name=0)
-
-            logger.info(f"Парсинг манифеста {filename}: {len(df)} строк")
-
-            columns_map = {str(col).strip().lower(): col for col in df.columns}
-
-            surname_col = self._find_column(columns_map, ['surname', 'last name', 'lastname', 'фамилия'])
-            excluded = {surname_col} if surname_col else set()
-            name_col = self._find_column(columns_map, ['name', 'first name', 'firstname', 'имя'], exclude=excluded)
-            full_name_col = self._find_column(columns_map, ['full name', 'first/last name', 'fio', 'фио'], exclude=excluded)
-            document_col = self._find_column(
-                columns_map,
-                [
-                    'document number',
-                    'document no',
-                    'doc number',
-                    'document',
-                    'passport number',
-                    'passport no',
-                    'passport',
-                    'номер паспорта',
-                    'номер документа',
-                    'паспорт',
-                    'загранпаспорт',
-                ],
-                exclude=excluded,
-            )
-            iin_col = self._find_column(columns_map, ['iin', 'иин', 'iin number', 'personal id'], exclude=excluded)
+            engine, header, rows = self._read_table(source, filename)
+
+            logger.info("Парсинг манифеста %s (движок: %s)", filename, engine)
 
-            if surname_col is None:
+            columns_map = {str(col).strip().lower(): idx for idx, col in enumerate(header)}
+            columns = cached_column_map("manifest", list(columns_map), self._resolve_columns)
+
+            indices = {
+                field: columns_map[columns[field]] if columns[field] is not None else None
+                for field in MANIFEST_COLUMNS
+            }
+
+            if indices["surname"] is None:
                 raise ValueError("В манифесте не найдена колонка surname/last name")
 
-            pilgrims = []
+            if engine == "pandas":
+                pilgrims = self._records_from_frame(rows, indices)
+            else:
+                pilgrims = self._records_from_rows(rows, indices)
 
-            for idx, row in df.iterrows():
-                surname = self._to_text(row.get(surname_col)).upper()
-                if not surname:
-                    continue
-
-                name = self._to_text(row.get(name_col)).upper() if name_col else ""
-                if full_name_col and (not name or not surname):
-                    full_name = self._to_text(row.get(full_name_col))
-                    full_surname, full_name_name = self._split_full_name(full_name)
-                    if not surname:
-                        surname = full_surname.upper()
-                    if not name:
-                        name = full_name_name.upper()
-
-                if surname and not name and " " in surname:
-                    split_surname, split_name = self._split_full_name(surname)
-                    if split_name:
-                        surname = split_surname.upper()
-                        name = split_name.upper()
-
-                document = self._normalize_document(self._to_text(row.get(document_col))) if document_col else ""
-                iin = self._normalize_iin(self._to_text(row.get(iin_col))) if iin_col else ""
-
-                if not document and not iin and not name:
-                    continue
-
-                pilgrims.append({
-                    "surname": surname,
-                    "name": name,
-                    "document": document,
-                    "iin": iin,
-                })
-
-            logger.info(f"✅ Извлечено {len(pilgrims)} паломников из манифеста")
+            logger.info("✅ Извлечено %d паломников из манифеста", len(pilgrims))
             return pilgrims
 
         except Exception as e:
             logger.error(f"❌ Ошибка парсинга манифеста {filename}: {e}")
             raise ValueError(f"Не удалось распарсить манифест: {str(e)}")
 
-    def _find_column(self, columns_map: Dict[str, str], aliases: List[str], exclude: Optional[set] = None) -> Optional[str]:
+    def _read_table(
+        self, source: Source, filename: str
+    ) -> Tuple[str, List, Union[Iterable[Sequence], pd.DataFrame]]:
+        """
+        (движок, названия колонок, строки данных) первого листа.
+        Потоковый движок отдаёт строки по одной; если его нет для этого
+        формата или файл он не открыл — весь лист читается через pandas
+        и вместо строк возвращается DataFrame.
+        """
+        engine = excel_row_reader(filename)
+        if engine is not None:
+            engine_name, reader = engine
+            rows = reader(source)
+            try:
+                # Как и pandas, заголовок — первая непустая строка
+                header = next((row for row in rows if not is_blank_row(row)), None)
+                return engine_name, header_labels(header or []), rows
+            except Exception as e:
+                # CSV через pd.read_excel не прочитать — отдаём ошибку как есть
+                if engine_name == "csv":
+                    raise
+                logger.warning(f"Движок {engine_name} не прочитал манифест {filename}, читаем через pandas: {e}")
+
+        import pandas as pd
+
+        df = pd.read_excel(open_source(source), sheet_name=0)
+        return "pandas", list(df.columns), df
+
+    def _records_from_rows(
+        self, rows: Iterable[Sequence], indices: Dict[str, Optional[int]]
+    ) -> List[PilgrimRecord]:
+        surname_idx, name_idx, full_name_idx, document_idx, iin_idx = (
+            indices[field] for field in MANIFEST_COLUMNS
+        )
+        pilgrims = []
+
+        for row in rows:
+            surname = self._cell(row, surname_idx).upper()
+            if not surname:
+                continue
+
+            name = self._cell(row, name_idx).upper()
+            if full_name_idx is not None and (not name or not surname):
+                full_name = self._cell(row, full_name_idx)
+                full_surname, full_name_name = self._split_full_name(full_name)
+                if not surname:
+                    surname = full_surname.upper()
+                if not name:
+                    name = full_name_name.upper()
+
+            if surname and not name and " " in surname:
+                split_surname, split_name = self._split_full_name(surname)
+                if split_name:
+                    surname = split_surname.upper()
+                    name = split_name.upper()
+
+            document = self._normalize_document(self._cell(row, document_idx)) if document_idx is not None else ""
+            iin = self._normalize_iin(self._cell(row, iin_idx)) if iin_idx is not None else ""
+
+            if not document and not iin and not name:
+                continue
+
+            pilgrims.append(PilgrimRecord.make(
+                surname=surname,
+                name=name,
+                document=document,
+                iin=iin,
+            ))
+
+        return pilgrims
+
+    def _records_from_frame(
+        self, df: pd.DataFrame, indices: Dict[str, Optional[int]]
+    ) -> List[PilgrimRecord]:
+        """
+        То же, что _records_from_rows, но строковыми операциями над целыми
+        колонками вместо разбора каждой строки
+        """
+        import pandas as pd
+
+        surname = self._text_column(df.iloc[:, indices["surname"]]).str.upper()
+        # Строки без фамилии пропускаются — остальные колонки берём только для нужных строк
+        rows = (surname != "").to_numpy()
+        surname = surname[rows]
+        empty = pd.Series("", index=surname.index, dtype=object)
+
+        def column(field: str, mask: Optional[pd.Series] = None) -> pd.Series:
+            idx = indices[field]
+            if idx is None:
+                return empty
+            values = df.iloc[:, idx][rows]
+            return self._text_column(values if mask is None else values[mask])
+
+        name = column("name").str.upper()
+        if indices["full_name"] is not None:
+            no_name = name == ""
+            _, full_name_name = self._split_full_name_column(column("full_name", no_name))
+            name = name.mask(no_name, full_name_name.str.upper())
+
+        split = (name == "") & surname.str.contains(" ", regex=False)
+        if split.any():
+            split_surname, split_name = self._split_full_name_column(surname[split])
+            surname = surname.mask(split, split_surname.str.upper())
+            name = name.mask(split, split_name.str.upper())
+
+        document = normalize_document_column(column("document")) if indices["document"] is not None else empty
+        iin = self._normalize_iin_column(column("iin")) if indices["iin"] is not None else empty
+
+        keep = (document != "") | (iin != "") | (name != "")
+        return [
+            PilgrimRecord.make(surname=row_surname, name=row_name, document=row_document, iin=row_iin)
+            for row_surname, row_name, row_document, row_iin in zip(
+                surname[keep].tolist(), name[keep].tolist(), document[keep].tolist(), iin[keep].tolist()
+            )
+        ]
+
+    def _resolve_columns(self, headers: Sequence[str]) -> Dict[str, Optional[str]]:
+        """Поле паломника -> заголовок колонки (из headers) или None"""
+        surname = self._find_column(headers, "surname")
+        excluded = {surname} if surname else set()
+        columns = {"surname": surname}
+        for field_name in ("name", "full_name", "document", "iin"):
+            columns[field_name] = self._find_column(headers, field_name, exclude=excluded)
+        return columns
+
+    def _find_column(self, headers: Sequence[str], field_name: str, exclude: Optional[set] = None) -> Optional[str]:
+        """
+        Сначала точное совпадение заголовка с названием, затем вхождение
+        целым словом; в обоих случаях по приоритету названий.
+        """
+        matcher = COLUMN_MATCHERS[field_name]
         excluded = exclude or set()
         normalized_columns = [
-            (self._normalize_header(normalized), original)
-            for normalized, original in columns_map.items()
-            if original not in excluded
+            (_normalize_header(header), header)
+            for header in headers
+            if header not in excluded
         ]
 
-        for alias in aliases:
-            alias_normalized = self._normalize_header(alias)
-            for normalized, original in normalized_columns:
-                if normalized == alias_normalized:
-                    return original
-                
-        for alias in aliases:
-            alias_normalized = self._normalize_header(alias)
-            if not alias_normalized:
-                continue
-            alias_pattern = r'\b' + re.escape(alias_normalized).replace(r'\ ', r'\s+') + r'\b'
-            for normalized, original in normalized_columns:
-                if re.search(alias_pattern, normalized):
+        exact = {}
+        for normalized, original in normalized_columns:
+            exact.setdefault(normalized, original)
+        for alias in matcher.keywords:
+            if alias in exact:
+                return exact[alias]
+
+        found = [(matcher.found(normalized), original) for normalized, original in normalized_columns]
+        for alias in matcher.keywords:
+            for aliases, original in found:
+                if alias in aliases:
                     return original
 
         return None
 
+    def _cell(self, row: Sequence, idx: Optional[int]) -> str:
+        if idx is None or idx >= len(row):
+            return ""
+        return self._to_text(row[idx])
+
     def _to_text(self, value) -> str:
-        if value is None or pd.isna(value):
+        # value != value — NaN/NaT из pandas
+        if value is None or value != value:
             return ""
+        # Числа Excel хранит как float: 12345678.0 -> "12345678"
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
         return str(value).strip()
 
-    def _normalize_header(self, value: str) -> str:
-        normalized = re.sub(r'[^a-z0-9а-яё]+', ' ', str(value).lower())
-        return re.sub(r'\s+', ' ', normalized).strip()
+    def _text_column(self, column: pd.Series) -> pd.Series:
+        """_to_text для колонки DataFrame целиком"""
+        import numpy as np
+        import pandas as pd
+        from pandas.api.types import infer_dtype
+
+        kind = column.dtype.kind
+        if kind in "iub":
+            return column.astype(str)
+        if kind == "f":
+            # Целые числа (ИИН, номера) — через int64, str() только для дробных
+            numbers = column.to_numpy()
+            text = np.full(len(numbers), "", dtype=object)
+            with np.errstate(invalid="ignore"):
+                # inf % 1 -> nan, без предупреждения
+                integral = np.mod(numbers, 1) == 0
+            text[integral] = self._integral_text(numbers[integral])
+            fractional = ~integral & ~np.isnan(numbers)
+            text[fractional] = [str(value) for value in numbers[fractional].tolist()]
+            return pd.Series(text, index=column.index)
+        if kind != "O":
+            # Даты и прочее: astype(str) форматирует колонку не так, как str() значения
+            return column.map(self._to_text).astype(object)
+
+        text = column.astype(str).str.strip()
+        text[column.isna().to_numpy()] = ""
+        if infer_dtype(column, skipna=True) not in ("string", "empty"):
+            integral = column.map(lambda value: isinstance(value, float) and value.is_integer())
+            if integral.any():
+                text[integral] = self._integral_text(column[integral].to_numpy(dtype=float))
+        return text
+
+    def _integral_text(self, numbers: np.ndarray) -> List[str]:
+        import numpy as np
+
+        if (np.abs(numbers) < 2 ** 63).all():
+            return [str(value) for value in numbers.astype(np.int64).tolist()]
+        return [str(int(value)) for value in numbers.tolist()]
 
     def _split_full_name(self, value: str) -> tuple[str, str]:
         normalized = re.sub(r'\s+', ' ', str(value or "").strip())
@@ -133,6 +307,14 @@ class ManifestParser:
             return parts[0], ""
         return parts[0], " ".join(parts[1:])
 
+    def _split_full_name_column(self, values: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """_split_full_name для колонки: (первое слово, остальное)"""
+        normalized = values.str.strip().str.replace(r"\s+", " ", regex=True)
+        if normalized.empty:
+            return normalized, normalized
+        parts = normalized.str.partition(" ")
+        return parts[0], parts[2]
+
     def _normalize_document(self, value: str) -> str:
         cleaned = re.sub(r"[^\w]", "", value.upper().strip())
         return normalize_document(cleaned)
@@ -161,6 +343,48 @@ class ManifestParser:
         digits = re.sub(r'\D', '', upper_value)
         return digits if len(digits) >= 10 else ""
 
+    def _normalize_iin_column(self, values: pd.Series) -> pd.Series:
+        """_normalize_iin для колонки: те же правила по маскам"""
+        # Обычный ИИН — 10-13 цифр без пробелов, остаётся как есть;
+        # полный разбор только для остальных значений
+        plain = (values == "") | values.str.fullmatch(r"\d{10,13}")
+        if plain.all():
+            return values
+        result = values.where(plain, "")
+        rest = values[~plain].str.strip().str.replace(" ", "", regex=False).str.upper()
+
+        digits = rest.str.replace(r"\D", "", regex=True)
+        rest_result = digits.where(digits.str.len() >= 10, "")
+
+        rest_plain = rest.str.fullmatch(r"\d{10,13}")
+        rest_result = rest_result.mask(rest_plain, rest)
+
+        float_text = ~rest_plain & rest.str.fullmatch(r"\d+\.0+")
+        if float_text.any():
+            int_part = rest[float_text].str.split(".", n=1).str[0]
+            rest_result = rest_result.mask(float_text, int_part.where(int_part.str.len() >= 10, ""))
+
+        scientific = ~rest_plain & ~float_text & rest.str.contains("E", regex=False)
+        if scientific.any():
+            # Decimal разбирает не всё с "E" — остальное остаётся разбором по цифрам
+            parsed = rest[scientific].map(self._scientific_iin).dropna()
+            rest_result = rest_result.mask(scientific & rest.index.isin(parsed.index), parsed)
+
+        result[~plain] = rest_result
+        return result
+
+    def _scientific_iin(self, value: str) -> Optional[str]:
+        try:
+            sci_as_int = str(int(Decimal(value)))
+        except (InvalidOperation, ValueError):
+            return None
+        return sci_as_int if len(sci_as_int) >= 10 else ""
+
 
 # Синглтон
 manifest_parser = ManifestParser()
+
+
+def parse_manifest_content(source: Source, filename: str) -> List[PilgrimRecord]:
+    """Точка входа для пула процессов (функция уровня модуля сериализуется pickle)"""
+    return manifest_parser.parse_manifest(source, filename)
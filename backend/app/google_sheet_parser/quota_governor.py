@@ -0,0 +1,240 @@
+"""
+Общий для кластера лимит запросов к Google API.
+
+Все uvicorn-воркеры и Celery worker ходят в Google от одного service
+account, поэтому бюджет чтений на минуту хранится в Redis как token bucket.
+Перед каждым запросом процесс берёт токен: в режиме "queue" ждёт его
+появления (не дольше GOOGLE_API_QUOTA_MAX_WAIT_SECONDS), в режиме
+"reject" сразу получает QuotaExceededError. Без Redis работает такой же
+bucket внутри процесса.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Dict, Tuple
+
+import redis
+
+from app.core.config import settings
+from app.core.redis_client import get_redis, redis_key
+
+logger = logging.getLogger(__name__)
+
+QUOTA_MODE_QUEUE = "queue"
+QUOTA_MODE_REJECT = "reject"
+
+# KEYS[1] — hash bucket'а; ARGV: capacity, refill_per_ms, cost, penalty_ms
+# Возвращает {1, 0, остаток} если токены выданы, иначе {0, сколько мс ждать, остаток}.
+_TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local capacity = tonumber(ARGV[1])
+local refill_per_ms = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local penalty_ms = tonumber(ARGV[4])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill_per_ms)
+
+local allowed = 0
+local wait_ms = 0
+if penalty_ms > 0 then
+    tokens = -penalty_ms * refill_per_ms
+elseif tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait_ms = math.ceil((cost - tokens) / refill_per_ms)
+end
+
+redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', key, 120000)
+return {allowed, wait_ms, math.floor(tokens)}
+"""
+
+
+class QuotaExceededError(Exception):
+    """Бюджет запросов к Google API исчерпан"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(
+            f"Превышен лимит запросов к Google API, повторите через {math.ceil(retry_after)} с"
+        )
+
+
+class _LocalBucket:
+    """Token bucket в памяти процесса — запасной вариант без Redis"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._ts = 0.0
+
+    def take(self, capacity: float, refill_per_ms: float, cost: int, penalty_ms: int = 0) -> Tuple[bool, int, float]:
+        with self._lock:
+            now = time.monotonic() * 1000
+            if self._tokens is None:
+                self._tokens = capacity
+                self._ts = now
+
+            tokens = min(capacity, self._tokens + max(0.0, now - self._ts) * refill_per_ms)
+            self._ts = now
+
+            if penalty_ms > 0:
+                self._tokens = -penalty_ms * refill_per_ms
+                return False, 0, self._tokens
+
+            if tokens >= cost:
+                self._tokens = tokens - cost
+                return True, 0, self._tokens
+
+            self._tokens = tokens
+            return False, math.ceil((cost - tokens) / refill_per_ms), tokens
+
+
+class QuotaGovernor:
+
+    def __init__(self, name: str, per_minute: int, burst: int):
+        self.name = name
+        self.per_minute = per_minute
+        self.capacity = max(1, burst)
+        self._refill_per_ms = per_minute / 60000.0
+        self._bucket_key = redis_key("quota", name)
+        self._metrics_key = redis_key("quota", name, "metrics")
+        self._local_bucket = _LocalBucket()
+        self._script = None
+        self._metrics_lock = threading.Lock()
+        self._local_metrics: Dict[str, float] = {
+            "acquired": 0,
+            "tokens_consumed": 0,
+            "waited": 0,
+            "wait_ms_total": 0,
+            "rejected": 0,
+            "throttled": 0,
+        }
+
+    def acquire(self, cost: int = 1, mode: str = None, max_wait: float = None) -> float:
+        """
+        Берёт cost токенов. Возвращает время ожидания в секундах.
+        Бросает QuotaExceededError, если токены не получены.
+        """
+        mode = mode or settings.GOOGLE_API_QUOTA_MODE
+        max_wait = settings.GOOGLE_API_QUOTA_MAX_WAIT_SECONDS if max_wait is None else max_wait
+
+        started = time.monotonic()
+        slept = False
+        while True:
+            allowed, wait_ms, _ = self._take(cost)
+            waited = time.monotonic() - started if slept else 0.0
+
+            if allowed:
+                self._record(acquired=1, tokens_consumed=cost, waited=int(slept),
+                             wait_ms_total=int(waited * 1000))
+                return waited
+
+            wait_seconds = max(wait_ms, 10) / 1000.0
+            if mode == QUOTA_MODE_REJECT or waited + wait_seconds > max_wait:
+                self._record(rejected=1, wait_ms_total=int(waited * 1000))
+                logger.warning(
+                    "Квота Google API '%s' исчерпана, ожидание %.1f с отклонено",
+                    self.name, wait_seconds,
+                )
+                raise QuotaExceededError(wait_seconds)
+
+            time.sleep(wait_seconds)
+            slept = True
+
+    def try_acquire(self, cost: int = 1) -> bool:
+        """Неблокирующая попытка: True, если токены выданы"""
+        try:
+            self.acquire(cost, mode=QUOTA_MODE_REJECT)
+            return True
+        except QuotaExceededError:
+            return False
+
+    def available(self) -> float:
+        """Сколько токенов в bucket сейчас (не расходуя их)"""
+        return self._take(0)[2]
+
+    def penalize(self, seconds: float) -> None:
+        """
+        Google ответил 429: обнуляем общий bucket, чтобы все процессы
+        подождали, а не продолжали долбить API.
+        """
+        self._record(throttled=1)
+        self._take(0, penalty_ms=int(seconds * 1000))
+
+    def metrics(self) -> Dict:
+        with self._metrics_lock:
+            local = dict(self._local_metrics)
+
+        cluster = None
+        client = get_redis()
+        if client is not None:
+            try:
+                raw = client.hgetall(self._metrics_key)
+                cluster = {k.decode(): float(v) for k, v in raw.items()}
+            except redis.RedisError as e:
+                logger.warning("Не удалось прочитать метрики квоты: %s", e)
+
+        return {
+            "name": self.name,
+            "per_minute": self.per_minute,
+            "burst": self.capacity,
+            "mode": settings.GOOGLE_API_QUOTA_MODE,
+            "shared": client is not None,
+            "process": local,
+            "cluster": cluster,
+        }
+
+    def _take(self, cost: int, penalty_ms: int = 0) -> Tuple[bool, int, float]:
+        client = get_redis()
+        if client is not None:
+            try:
+                if self._script is None:
+                    self._script = client.register_script(_TOKEN_BUCKET_LUA)
+                allowed, wait_ms, tokens = self._script(
+                    keys=[self._bucket_key],
+                    args=[self.capacity, self._refill_per_ms, cost, penalty_ms],
+                )
+                return bool(allowed), int(wait_ms), float(tokens)
+            except redis.RedisError as e:
+                logger.warning("Квота в Redis недоступна, используем локальную: %s", e)
+
+        return self._local_bucket.take(self.capacity, self._refill_per_ms, cost, penalty_ms)
+
+    def _record(self, **values: float) -> None:
+        with self._metrics_lock:
+            for key, value in values.items():
+                self._local_metrics[key] += value
+
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, value in values.items():
+                if value:
+                    pipe.hincrby(self._metrics_key, key, int(value))
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+
+# Синглтон: бюджет чтений Sheets/Drive API на service account
+google_read_quota = QuotaGovernor(
+    "google_read",
+    per_minute=settings.GOOGLE_API_READS_PER_MINUTE,
+    burst=settings.GOOGLE_API_BURST,
+)
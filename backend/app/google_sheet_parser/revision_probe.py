@@ -0,0 +1,146 @@
+"""
+Проба ревизий таблиц через Drive API.
+
+Один запрос files.list (поля id, name, modifiedTime, version) по годовым
+таблицам даёт текущую ревизию каждой из них. Кэши каталога, значений листов
+и распарсенных пакетов сравнивают свою ревизию с этой и перечитывают
+таблицу только если она действительно менялась.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import redis
+
+from app.core.redis_client import get_redis, redis_key
+
+logger = logging.getLogger(__name__)
+
+REVISIONS_REDIS_KEY = redis_key("sheets", "revisions")
+
+
+class SpreadsheetRevisions:
+    """Снимок ревизий: spreadsheet_id -> {"name", "revision"}"""
+
+    def __init__(self, files: Dict[str, Dict[str, str]], probed_at: float):
+        self.files = files
+        self.probed_at = probed_at
+
+    def age(self) -> float:
+        return time.time() - self.probed_at
+
+    def revision(self, spreadsheet_id: str) -> Optional[str]:
+        item = self.files.get(spreadsheet_id)
+        return item["revision"] if item else None
+
+    def names(self) -> Dict[str, str]:
+        """{название таблицы: id}"""
+        return {item["name"]: spreadsheet_id for spreadsheet_id, item in self.files.items()}
+
+    def to_json(self) -> str:
+        return json.dumps({"files": self.files, "probed_at": self.probed_at}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw) -> "SpreadsheetRevisions":
+        data = json.loads(raw)
+        return cls(data.get("files") or {}, float(data.get("probed_at") or 0.0))
+
+
+class SheetRevisionProbe:
+    """
+    list_files(years) — один (постраничный) запрос files.list, возвращает
+    [{"id", "name", "modifiedTime", "version"}].
+    get_file(id) — метаданные одного файла для таблиц вне годовой выборки.
+    """
+
+    def __init__(
+        self,
+        list_files: Callable[[List[str]], List[Dict]],
+        get_file: Callable[[str], Dict],
+        ttl_seconds: int,
+        years: Callable[[], List[str]],
+    ):
+        self._list_files = list_files
+        self._get_file = get_file
+        self._ttl = ttl_seconds
+        self._years = years
+        self._snapshot: Optional[SpreadsheetRevisions] = None
+        self._lock = threading.Lock()
+        # Ревизии таблиц вне годовой выборки: id -> (revision, probed_at)
+        self._single: Dict[str, tuple] = {}
+
+    def revisions(self, force: bool = False) -> SpreadsheetRevisions:
+        snapshot = self._snapshot
+        if not force and snapshot is not None and snapshot.age() < self._ttl:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if not force and snapshot is not None and snapshot.age() < self._ttl:
+                return snapshot
+
+            if not force:
+                shared = self._load_shared()
+                if shared is not None and shared.age() < self._ttl:
+                    self._snapshot = shared
+                    return shared
+
+            files = self._list_files(self._years())
+            snapshot = SpreadsheetRevisions(
+                {
+                    f["id"]: {"name": f["name"], "revision": revision_of(f)}
+                    for f in files
+                },
+                time.time(),
+            )
+            self._snapshot = snapshot
+            self._store_shared(snapshot)
+            return snapshot
+
+    def get_revision(self, spreadsheet_id: str) -> Optional[str]:
+        """Текущая ревизия таблицы или None, если её не удалось узнать"""
+        try:
+            revision = self.revisions().revision(spreadsheet_id)
+            if revision is not None:
+                return revision
+
+            cached = self._single.get(spreadsheet_id)
+            if cached is not None and time.time() - cached[1] < self._ttl:
+                return cached[0]
+
+            revision = revision_of(self._get_file(spreadsheet_id))
+            self._single[spreadsheet_id] = (revision, time.time())
+            return revision
+        except Exception as e:
+            logger.warning("Не удалось получить ревизию таблицы %s: %s", spreadsheet_id, e)
+            return None
+
+    def _load_shared(self) -> Optional[SpreadsheetRevisions]:
+        client = get_redis()
+        if client is None:
+            return None
+        try:
+            raw = client.get(REVISIONS_REDIS_KEY)
+            return SpreadsheetRevisions.from_json(raw) if raw else None
+        except (redis.RedisError, ValueError) as e:
+            logger.warning("Не удалось прочитать ревизии из Redis: %s", e)
+            return None
+
+    def _store_shared(self, snapshot: SpreadsheetRevisions) -> None:
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.set(REVISIONS_REDIS_KEY, snapshot.to_json(), ex=max(1, self._ttl))
+        except redis.RedisError as e:
+            logger.warning("Не удалось сохранить ревизии в Redis: %s", e)
+
+
+def revision_of(file_meta: Dict) -> str:
+    """Drive version растёт при каждом изменении; modifiedTime — запасной вариант"""
+    version = file_meta.get("version")
+    if version:
+        return str(version)
+    return str(file_meta.get("modifiedTime") or "")
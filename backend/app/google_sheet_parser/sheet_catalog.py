@@ -0,0 +1,303 @@
+"""
+Кэш каталога Google Sheets: названия/id таблиц и названия их листов.
+
+Каталог меняется несколько раз в день, поэтому поиск по дате отвечает
+из памяти процесса (L1) или Redis (общий для всех воркеров), а обновление
+идёт по TTL, явной инвалидации или фоновым потоком.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import redis
+
+from app.core.redis_client import get_redis, redis_key
+from app.google_sheet_parser.revision_probe import SpreadsheetRevisions
+
+logger = logging.getLogger(__name__)
+
+CATALOG_REDIS_KEY = redis_key("sheets", "catalog")
+CATALOG_LOCK_REDIS_KEY = redis_key("sheets", "catalog", "lock")
+CATALOG_LOCK_SECONDS = 120
+
+
+@dataclass
+class SheetCatalog:
+    # Название таблицы -> spreadsheet_id
+    spreadsheets: Dict[str, str] = field(default_factory=dict)
+    # spreadsheet_id -> названия листов
+    worksheets: Dict[str, List[str]] = field(default_factory=dict)
+    # spreadsheet_id -> ревизия Drive, с которой сняты листы
+    revisions: Dict[str, str] = field(default_factory=dict)
+    # Время полной пересборки: по нему считается TTL
+    built_at: float = 0.0
+    # Время последнего частичного обновления по ревизиям
+    updated_at: float = 0.0
+
+    def age(self) -> float:
+        """Возраст с последней полной пересборки (частичные обновления не в счёт)"""
+        return time.time() - self.built_at
+
+    @property
+    def version(self) -> float:
+        """Меняется при любом обновлении каталога, полном или частичном"""
+        return max(self.built_at, self.updated_at)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "spreadsheets": self.spreadsheets,
+            "worksheets": self.worksheets,
+            "revisions": self.revisions,
+            "built_at": self.built_at,
+            "updated_at": self.updated_at,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw) -> "SheetCatalog":
+        data = json.loads(raw)
+        return cls(
+            spreadsheets=data.get("spreadsheets") or {},
+            worksheets=data.get("worksheets") or {},
+            revisions=data.get("revisions") or {},
+            built_at=float(data.get("built_at") or 0.0),
+            updated_at=float(data.get("updated_at") or 0.0),
+        )
+
+
+class SheetCatalogCache:
+    """
+    Двухуровневый кэш каталога (память процесса + Redis).
+
+    loader — функция, которая строит свежий каталог через Google API.
+    """
+
+    def __init__(self, loader: Callable[[], SheetCatalog], ttl_seconds: int):
+        self._loader = loader
+        self._ttl = ttl_seconds
+        self._catalog: Optional[SheetCatalog] = None
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def get(self) -> SheetCatalog:
+        """Каталог из памяти/Redis; строится заново только если истёк TTL"""
+        catalog = self._catalog
+        if catalog is not None and catalog.age() < self._ttl:
+            return catalog
+
+        shared = self._load_shared()
+        if shared is not None and shared.age() < self._ttl:
+            self._catalog = shared
+            return shared
+
+        try:
+            return self.refresh()
+        except Exception as e:
+            stale = catalog or shared
+            if stale is None:
+                raise
+            logger.error("Не удалось обновить каталог, используем устаревший: %s", e)
+            return stale
+
+    def refresh(self) -> SheetCatalog:
+        """Принудительно строит каталог через Google API"""
+        with self._refresh_lock:
+            catalog = self._loader()
+            self._catalog = catalog
+            self._store_shared(catalog)
+            logger.info(
+                "Каталог Google Sheets обновлён: %s таблиц, %s с листами",
+                len(catalog.spreadsheets),
+                len(catalog.worksheets),
+            )
+            return catalog
+
+    def apply_revisions(
+        self,
+        revisions: SpreadsheetRevisions,
+        fetch_sheet_names: Callable[[List[str]], Dict[str, List[str]]],
+    ) -> SheetCatalog:
+        """
+        Сверяет каталог с пробой ревизий и перечитывает листы только
+        у изменившихся, новых или удалённых таблиц.
+        """
+        catalog = self.get()
+        if not _changed_tables(catalog, revisions) and not _removed_tables(catalog, revisions):
+            return catalog
+
+        with self._refresh_lock:
+            catalog = self._catalog or catalog
+            changed = _changed_tables(catalog, revisions)
+            removed = _removed_tables(catalog, revisions)
+            if not changed and not removed:
+                return catalog
+
+            fetched = fetch_sheet_names(changed) if changed else {}
+
+            # Названия годовых таблиц берём из пробы (могли переименовать)
+            spreadsheets = {
+                name: spreadsheet_id
+                for name, spreadsheet_id in catalog.spreadsheets.items()
+                if spreadsheet_id not in revisions.files
+            }
+            spreadsheets.update(revisions.names())
+
+            worksheets = {
+                spreadsheet_id: titles
+                for spreadsheet_id, titles in catalog.worksheets.items()
+                if spreadsheet_id not in removed
+            }
+            worksheets.update(fetched)
+
+            # Ревизию фиксируем только для успешно перечитанных таблиц,
+            # остальные попробуем снова при следующей пробе
+            updated_revisions = {
+                spreadsheet_id: revision
+                for spreadsheet_id, revision in catalog.revisions.items()
+                if spreadsheet_id not in removed
+            }
+            for spreadsheet_id in fetched:
+                updated_revisions[spreadsheet_id] = revisions.revision(spreadsheet_id)
+
+            updated = SheetCatalog(
+                spreadsheets=spreadsheets,
+                worksheets=worksheets,
+                revisions=updated_revisions,
+                # built_at не трогаем: иначе при постоянных правках полная
+                # пересборка (и удаление пропавших таблиц) откладывалась бы
+                built_at=catalog.built_at,
+                updated_at=time.time(),
+            )
+            self._catalog = updated
+            self._store_shared(updated)
+            logger.info(
+                "Каталог обновлён по ревизиям: изменено %s, удалено %s таблиц",
+                len(fetched), len(removed),
+            )
+            return updated
+
+    def invalidate(self) -> None:
+        """Сбрасывает каталог в памяти и в Redis"""
+        self._catalog = None
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.delete(CATALOG_REDIS_KEY)
+        except redis.RedisError as e:
+            logger.warning("Не удалось удалить каталог из Redis: %s", e)
+
+    def remember_worksheets(self, spreadsheet_id: str, sheet_names: List[str]) -> None:
+        """Дополняет каталог листами таблицы, загруженными вне обновления"""
+        catalog = self._catalog
+        if catalog is None:
+            return
+        catalog.worksheets[spreadsheet_id] = list(sheet_names)
+        self._store_shared(catalog)
+
+    # ==================== Фоновое обновление ====================
+
+    def start_background_refresh(
+        self,
+        interval_seconds: int,
+        on_tick: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Фоновый поток: полная пересборка раз в TTL, а между ними — on_tick
+        (сверка с пробой ревизий) каждые interval_seconds.
+        """
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop,
+            args=(interval_seconds, on_tick),
+            name="sheet-catalog-refresher",
+            daemon=True,
+        )
+        self._refresher.start()
+
+    def stop_background_refresh(self) -> None:
+        self._stop_event.set()
+
+    def _refresh_loop(self, interval_seconds: int, on_tick: Optional[Callable[[], None]]) -> None:
+        while True:
+            try:
+                self._refresh_if_stale(self._ttl)
+                if on_tick is not None:
+                    on_tick()
+            except Exception as e:
+                logger.error("Ошибка фонового обновления каталога: %s", e)
+
+            if self._stop_event.wait(interval_seconds):
+                return
+
+    def _refresh_if_stale(self, max_age: int) -> None:
+        """
+        Обновляет каталог, если ни один процесс не сделал это недавно.
+        Блокировка в Redis не даёт нескольким воркерам обновлять одновременно.
+        """
+        shared = self._load_shared()
+        if shared is not None and shared.age() < max_age:
+            self._catalog = shared
+            return
+
+        client = get_redis()
+        if client is not None:
+            try:
+                if not client.set(CATALOG_LOCK_REDIS_KEY, "1", nx=True, ex=CATALOG_LOCK_SECONDS):
+                    return
+            except redis.RedisError:
+                pass
+
+        try:
+            self.refresh()
+        finally:
+            if client is not None:
+                try:
+                    client.delete(CATALOG_LOCK_REDIS_KEY)
+                except redis.RedisError:
+                    pass
+
+    # ==================== Redis ====================
+
+    def _load_shared(self) -> Optional[SheetCatalog]:
+        client = get_redis()
+        if client is None:
+            return None
+        try:
+            raw = client.get(CATALOG_REDIS_KEY)
+            return SheetCatalog.from_json(raw) if raw else None
+        except (redis.RedisError, ValueError) as e:
+            logger.warning("Не удалось прочитать каталог из Redis: %s", e)
+            return None
+
+    def _store_shared(self, catalog: SheetCatalog) -> None:
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            # Храним дольше TTL: устаревший каталог лучше пустого при ошибках API
+            client.set(CATALOG_REDIS_KEY, catalog.to_json(), ex=self._ttl * 4)
+        except redis.RedisError as e:
+            logger.warning("Не удалось сохранить каталог в Redis: %s", e)
+
+
+def _changed_tables(catalog: SheetCatalog, revisions: SpreadsheetRevisions) -> List[str]:
+    return [
+        spreadsheet_id
+        for spreadsheet_id, item in revisions.files.items()
+        if catalog.revisions.get(spreadsheet_id) != item["revision"]
+    ]
+
+
+def _removed_tables(catalog: SheetCatalog, revisions: SpreadsheetRevisions) -> List[str]:
+    return [
+        spreadsheet_id
+        for spreadsheet_id in catalog.revisions
+        if spreadsheet_id not in revisions.files
+    ]
@@ -0,0 +1,140 @@
+"""
+Индекс листов по дате вылета.
+
+Строится один раз на версию каталога: название каждого листа разбирается
+один раз, после чего поиск по дате — обращение к словарю, а поиск по
+диапазону дат — бинарный поиск по отсортированному списку.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Ведущая дата в названии листа: "7.02-14.02 ...", "17.02.2026-24.02.2026 ..."
+LEADING_DAY_MONTH_RE = re.compile(r'^(\d{1,2})\.(\d{1,2})(?!\d)')
+
+
+@dataclass(frozen=True)
+class SheetRecord:
+    spreadsheet_id: str
+    spreadsheet_name: str
+    sheet_name: str
+    date_start: str
+    date_end: str
+    days: int
+    route: Optional[str]
+    departure: date
+
+    def to_dict(self) -> Dict:
+        return {
+            "spreadsheet_id": self.spreadsheet_id,
+            "spreadsheet_name": self.spreadsheet_name,
+            "sheet_name": self.sheet_name,
+            "date_start": self.date_start,
+            "date_end": self.date_end,
+            "days": self.days,
+            "route": self.route,
+        }
+
+
+class SheetDateIndex:
+
+    def __init__(self, records: Iterable[SheetRecord], version: float = 0.0):
+        self.version = version
+        self._by_day_month: Dict[Tuple[int, int], List[SheetRecord]] = {}
+
+        ordered = sorted(records, key=lambda r: (r.departure, r.spreadsheet_name, r.sheet_name))
+        for record in ordered:
+            key = _leading_day_month(record.sheet_name)
+            if key is not None:
+                self._by_day_month.setdefault(key, []).append(record)
+
+        # Для диапазонов с годом — по полной дате
+        self._by_date = ordered
+        self._date_keys = [r.departure for r in ordered]
+
+        # Для диапазонов без года — по (месяц, день)
+        self._by_month_day = sorted(ordered, key=lambda r: (r.departure.month, r.departure.day))
+        self._month_day_keys = [(r.departure.month, r.departure.day) for r in self._by_month_day]
+
+    def __len__(self) -> int:
+        return len(self._by_date)
+
+    @classmethod
+    def build(
+        cls,
+        tables: Dict[str, str],
+        worksheets: Dict[str, List[str]],
+        parse_sheet_name: Callable[[str], Optional[Dict]],
+        version: float = 0.0,
+    ) -> "SheetDateIndex":
+        """
+        tables — {название таблицы: id}, worksheets — {id: названия листов}.
+        parse_sheet_name возвращает date_start/date_end/days/route или None.
+        """
+        records = []
+        for table_name, table_id in tables.items():
+            for sheet_name in worksheets.get(table_id, []):
+                if _leading_day_month(sheet_name) is None:
+                    continue
+
+                parsed = parse_sheet_name(sheet_name)
+                if not parsed:
+                    continue
+
+                try:
+                    departure = datetime.strptime(parsed["date_start"], "%d.%m.%Y").date()
+                except ValueError:
+                    continue
+
+                records.append(SheetRecord(
+                    spreadsheet_id=table_id,
+                    spreadsheet_name=table_name,
+                    sheet_name=sheet_name,
+                    date_start=parsed["date_start"],
+                    date_end=parsed["date_end"],
+                    days=parsed["days"],
+                    route=parsed["route"],
+                    departure=departure,
+                ))
+
+        return cls(records, version=version)
+
+    def lookup(self, day: int, month: int) -> List[SheetRecord]:
+        """Листы, название которых начинается с даты day.month"""
+        return list(self._by_day_month.get((day, month), []))
+
+    def range_by_date(self, start: date, end: date) -> List[SheetRecord]:
+        """Листы с датой вылета в [start, end] (с учётом года)"""
+        lo = bisect_left(self._date_keys, start)
+        hi = bisect_right(self._date_keys, end)
+        return self._by_date[lo:hi]
+
+    def range_by_day_month(self, start: Tuple[int, int], end: Tuple[int, int]) -> List[SheetRecord]:
+        """
+        Листы с датой вылета в [start, end], где границы — (день, месяц)
+        без года. Диапазон через Новый год (20.12–10.01) тоже поддерживается.
+        """
+        start_key = (start[1], start[0])
+        end_key = (end[1], end[0])
+
+        if start_key <= end_key:
+            return self._month_day_slice(start_key, end_key)
+
+        return (
+            self._month_day_slice(start_key, (12, 31))
+            + self._month_day_slice((1, 1), end_key)
+        )
+
+    def _month_day_slice(self, start_key: Tuple[int, int], end_key: Tuple[int, int]) -> List[SheetRecord]:
+        lo = bisect_left(self._month_day_keys, start_key)
+        hi = bisect_right(self._month_day_keys, end_key)
+        return self._by_month_day[lo:hi]
+
+
+def _leading_day_month(sheet_name: str) -> Optional[Tuple[int, int]]:
+    match = LEADING_DAY_MONTH_RE.match(sheet_name.strip())
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
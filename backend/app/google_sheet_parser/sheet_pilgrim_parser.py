@@ -1,225 +1,779 @@
+import hashlib
 import logging
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from decimal import Decimal, InvalidOperation
-from typing import List, Dict, Optional, Tuple
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Tuple
 import re
+from gspread.utils import absolute_range_name, fill_gaps, rowcol_to_a1
+from app.core.cache import TwoTierCache
+from app.core.config import settings
+from app.core.parse_trace import ParseTrace, current_trace, trace_event
+from app.core.singleflight import SingleFlight
 from app.google_sheet_parser.google_sheets_service import google_sheets_service
+from app.google_sheet_parser.quota_governor import QuotaExceededError, google_read_quota
+from app.services.column_map_cache import cached_column_map
 from app.services.document_rules import normalize_document
+from app.services.keyword_matcher import KeywordMatcher
+from app.services.pilgrim_record import PilgrimRecord
 
 logger = logging.getLogger(__name__)
 PACKAGE_HEADER_RE = re.compile(r'\d{1,2}\.\d{1,2}\s*[-–]\s*\d{1,2}\.\d{1,2}')
 PACKAGE_KEYWORDS = ['niyet', 'hikma', 'izi', '4u', '4 u', '4 you', 'amal', 'aroya', 'aa', 'shohada', '7d', '10d']
 CANCEL_KEYWORDS = ['отмена', 'cancel', 'cancelled', 'canceled', 'не едет', 'не летит']
-LOG_PACKAGE_PILGRIMS = True
+HEADER_KEYWORDS = [
+    'surname', 'name', 'document', 'passport', 'document number',
+    'фамилия', 'имя', 'паспорт', 'last name', 'first name',
+    'first/last name', 'iin', 'иин'
+]
+# Разделитель ячеек при склейке строки; str.strip() считает его пробелом
+CELL_SEPARATOR = "\x1f"
+HEADER_MATCHER = KeywordMatcher(HEADER_KEYWORDS)
+PACKAGE_MATCHER = KeywordMatcher(PACKAGE_KEYWORDS)
+CANCEL_MATCHER = KeywordMatcher(CANCEL_KEYWORDS)
+# Поле паломника -> названия колонки (подстрока заголовка)
+COLUMN_MATCHERS = {
+    "surname": KeywordMatcher(['surname', 'фамилия', 'lastname', 'last name']),
+    "name": KeywordMatcher(['name', 'имя', 'firstname', 'first name']),
+    "full_name": KeywordMatcher(['first/last name', 'full name', 'fio', 'фио']),
+    "document": KeywordMatcher([
+        'document number',
+        'document no',
+        'doc number',
+        'document',
+        'passport number',
+        'passport no',
+        'passport',
+        'номер паспорта',
+        'номер документа',
+        'паспорт',
+        'загранпаспорт',
+    ]),
+    "iin": KeywordMatcher(['iin', 'иин', 'iin number', 'personal id']),
+    "manager": KeywordMatcher(['manager', 'менеджер', 'manager name']),
+    "room_type": KeywordMatcher(['type of room', 'room', 'комната', 'тип комнаты', 'тип']),
+    "meal_type": KeywordMatcher(['meal a day', 'meal', 'питание']),
+    "comment": KeywordMatcher(['comment', 'сomment', 'коммент', 'примеч']),
+}
+# Сколько первых колонок читаем в первой фазе частичной загрузки листа:
+# в них названия пакетов (row[:5]) и начало строк-заголовков
+PROBE_COLUMNS = 8
+# Первые строки листа читаем целиком в том же запросе, что и пробу: заголовок
+# первого (часто единственного) пакета тогда не требует отдельного запроса
+PROBE_FULL_ROWS = 20
+# Частичная загрузка — до 3 запросов (токенов квоты) против одного values.get
+RESTRICTED_FETCH_MAX_REQUESTS = 3
+# Заголовок пакета ищется в стольких строках после его названия
+PACKAGE_HEADER_LOOKAHEAD = 5
+
+
+PARSED_CACHE_MAX_SHEETS = 64
+
+# Сырые значения листов: ключ (spreadsheet_id, sheet_name, revision)
+sheet_values_cache = TwoTierCache(
+    "sheet_values",
+    l1_max_bytes=settings.SHEET_VALUES_CACHE_MAX_MB * 1024 * 1024,
+    ttl_seconds=settings.SHEET_VALUES_CACHE_TTL_SECONDS,
+)
+# Одновременные загрузки и парсинг одного листа выполняются один раз
+sheet_flight = SingleFlight("sheet_pilgrims")
+
+
+ROW_BLANK = "blank"
+ROW_PACKAGE = "package"
+ROW_HEADER = "header"
+ROW_DATA = "data"
+
+
+@dataclass
+class SheetLayout:
+    """
+    Результат одного прохода по листу: тип каждой строки, строки-заголовки
+    и текст первых ячеек (кандидаты в названия пакетов).
+    """
+    kinds: List[str]
+    # row[:5] одной строкой — для названий пакетов
+    titles: List[str]
+    # Индексы строк-заголовков по возрастанию
+    header_rows: List[int]
+    # Нормализованные ячейки строк-заголовков
+    header_cells: Dict[int, List[str]]
+    column_maps: Dict[int, Dict[str, Optional[int]]] = field(default_factory=dict)
+
+    def find_header(self, start: int = 0, end: int = 20) -> Optional[int]:
+        """Первая строка-заголовок в [start, end)"""
+        pos = bisect_left(self.header_rows, start)
+        if pos < len(self.header_rows) and self.header_rows[pos] < end:
+            return self.header_rows[pos]
+        return None
+
+
+@dataclass
+class ParsedSheet:
+    """
+    Один разбор листа для обоих режимов: пакеты (/tours/sheet-pilgrims)
+    и все паломники одним блоком (/manifest/compare).
+    """
+    spreadsheet_id: str
+    sheet_name: str
+    # Ревизия таблицы (Drive version), по которой получен результат
+    revision: Optional[str]
+    # [{"package_name", "pilgrims": [PilgrimRecord], "count", "fingerprint"}]
+    packages: List[Dict] = field(default_factory=list)
+    pilgrims: List[PilgrimRecord] = field(default_factory=list)
+    # Ревизия предыдущего разбора и пакеты, изменившиеся с него
+    # (None — лист разбирается впервые)
+    previous_revision: Optional[str] = None
+    changed_packages: Optional[List[str]] = None
+    # Нормализованный номер документа -> паломник из pilgrims
+    documents: Dict[str, PilgrimRecord] = field(init=False, default_factory=dict)
+    # Отпечаток строк блока -> пакет; для повторного разбора
+    blocks: Dict[str, Dict] = field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        for pilgrim in self.pilgrims:
+            document = normalize_document(pilgrim.document.upper())
+            if document:
+                self.documents[document] = pilgrim
+        for package in self.packages:
+            if package.get("fingerprint"):
+                self.blocks[package["fingerprint"]] = package
+
+    def track_changes(self, previous: Optional["ParsedSheet"]) -> None:
+        """Запоминает, какие пакеты изменились по сравнению с previous"""
+        if previous is None or previous.revision == self.revision:
+            return
+        self.previous_revision = previous.revision
+        self.changed_packages = [
+            package["package_name"]
+            for package in self.packages
+            if package.get("fingerprint") not in previous.blocks
+        ]
 
 
 class SheetPilgrimParser:
+    def __init__(self):
+        self._parsed_cache: "OrderedDict[Tuple[str, str], ParsedSheet]" = OrderedDict()
+        self._parsed_lock = threading.Lock()
+
     def parse_sheet_pilgrims(
         self,
         spreadsheet_id: str,
         sheet_name: str
+    ) -> List[PilgrimRecord]:
+        return self.get_parsed_sheet(spreadsheet_id, sheet_name).pilgrims
+
+    # ==================== Новый метод (по пакетам) ====================
+
+    def parse_sheet_by_packages(
+        self,
+        spreadsheet_id: str,
+        sheet_name: str
     ) -> List[Dict]:
+        return self.get_parsed_sheet(spreadsheet_id, sheet_name).packages
+
+    def parse_sheet_by_packages_iter(
+        self,
+        spreadsheet_id: str,
+        sheet_name: str
+    ) -> Iterator[Dict]:
+        """
+        Пакеты листа по одному, сразу как пакет разобран.
+        Если лист по текущей ревизии уже разобран — пакеты берутся из кэша,
+        после последнего пакета разбор попадает в тот же кэш.
+        """
+        revision = google_sheets_service.get_revision(spreadsheet_id)
+        cached = self._cached_sheet(spreadsheet_id, sheet_name, revision)
+        if cached is not None:
+            yield from cached.packages
+            return
+
+        previous = self.last_parsed(spreadsheet_id, sheet_name)
         try:
-            logger.info(f"Парсинг паломников из листа '{sheet_name}'")
+            logger.info("Потоковый парсинг листа '%s'", sheet_name)
+            trace_event("sheet", sheet_name=sheet_name, revision=revision, streaming=True)
 
             all_values = self._get_sheet_values(spreadsheet_id, sheet_name)
-
             if not all_values:
-                return []
+                return
 
-            header_row_idx = self._find_header_row(all_values)
+            layout = self._classify_rows(all_values)
+            packages = []
+            reuse = previous.blocks if previous is not None else {}
+            for package in self._iter_packages(all_values, layout, sheet_name, reuse):
+                packages.append(package)
+                yield package
 
-            if header_row_idx is None:
-                logger.warning("Не найдена строка с заголовками")
-                return []
+            pilgrims = self._parse_all_pilgrims(all_values, layout)
 
-            headers = [str(h).strip().lower() for h in all_values[header_row_idx]]
-            col_map = self._build_column_map(headers)
+        except QuotaExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка парсинга листа: {e}")
+            raise ValueError(f"Не удалось распарсить лист: {str(e)}")
 
-            if not self._has_name_source(col_map):
-                logger.error("Не найдены обязательные колонки с ФИО")
-                return []
+        parsed = ParsedSheet(
+            spreadsheet_id=spreadsheet_id,
+            sheet_name=sheet_name,
+            revision=revision,
+            **_share_records(packages, pilgrims),
+        )
+        parsed.track_changes(previous)
+        self._remember(parsed)
 
-            pilgrims = self._parse_rows(
-                all_values,
-                header_row_idx + 1,
-                len(all_values),
-                col_map,
-                require_room=False,
-                require_meal=False,
+    def get_parsed_sheet(self, spreadsheet_id: str, sheet_name: str) -> ParsedSheet:
+        """
+        Разобранный лист с ревизией таблицы, по которой он получен.
+        Пока ревизия не изменилась, лист не скачивается и не парсится заново.
+        """
+        revision = google_sheets_service.get_revision(spreadsheet_id)
+        previous = self.last_parsed(spreadsheet_id, sheet_name)
+
+        if current_trace() is not None:
+            # Запрос с трассировкой разбирает лист целиком и сам: кэш разбора,
+            # готовые пакеты и чужой разбор (singleflight) спрятали бы
+            # решения парсера из трассы. Значения листа берутся из кэша
+            result = self._parse_sheet(spreadsheet_id, sheet_name)
+        else:
+            cached = self._cached_sheet(spreadsheet_id, sheet_name, revision)
+            if cached is not None:
+                return cached
+
+            # Пакеты, строки которых не менялись с прошлой ревизии, не парсятся заново
+            reuse = previous.blocks if previous is not None else {}
+            result = sheet_flight.do(
+                ("sheet", spreadsheet_id, sheet_name, revision or ""),
+                lambda: self._parse_sheet(spreadsheet_id, sheet_name, reuse),
+                decode=_decode_parse_result,
             )
 
-            logger.info(f"✅ Извлечено {len(pilgrims)} паломников из листа")
-            return pilgrims
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка парсинга листа: {e}")
-            raise ValueError(f"Не удалось распарсить лист: {str(e)}")
+        parsed = ParsedSheet(
+            spreadsheet_id=spreadsheet_id,
+            sheet_name=sheet_name,
+            revision=revision,
+            packages=result["packages"],
+            pilgrims=result["pilgrims"],
+        )
+        parsed.track_changes(previous)
+        self._remember(parsed)
+        return parsed
+
+    def preload_sheet_values(self, sheets: List[Tuple[str, str]]) -> int:
+        """
+        Загружает значения нескольких листов: один values.batchGet на таблицу,
+        таблицы параллельно. Значения кладутся в кэш по ревизии, откуда их
+        затем берёт get_parsed_sheet. Уже разобранные и закэшированные листы
+        и таблицы без ревизии пропускаются. Возвращает число загруженных листов.
+        """
+        groups: Dict[Tuple[str, str], List[str]] = {}
+        for spreadsheet_id, sheet_name in dict.fromkeys(sheets):
+            revision = google_sheets_service.get_revision(spreadsheet_id)
+            if revision is None:
+                continue
+            parsed = self.last_parsed(spreadsheet_id, sheet_name)
+            if parsed is not None and parsed.revision == revision:
+                continue
+            if sheet_values_cache.get((spreadsheet_id, sheet_name, revision)) is not None:
+                continue
+            groups.setdefault((spreadsheet_id, revision), []).append(sheet_name)
+
+        if not groups:
+            return 0
+
+        loaded = 0
+        workers = max(1, min(settings.GOOGLE_SHEETS_FETCH_CONCURRENCY, len(groups)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sheets-batch") as pool:
+            # Одинаковые одновременные предзагрузки (поиск + префетч, несколько
+            # воркеров) идут к Google одним batchGet
+            futures = {
+                pool.submit(
+                    sheet_flight.do,
+                    ("batch", spreadsheet_id, revision, *sheet_names),
+                    partial(self._preload_group, spreadsheet_id, revision, sheet_names),
+                ): spreadsheet_id
+                for (spreadsheet_id, revision), sheet_names in groups.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    loaded += future.result()
+                except QuotaExceededError:
+                    raise
+                except Exception as e:
+                    # Например, один из листов переименован — batchGet отклоняет весь
+                    # запрос; листы этой таблицы загрузятся по одному при разборе
+                    logger.warning(f"Пакетная загрузка листов таблицы {futures[future]} не удалась: {e}")
+
+        return loaded
+
+    def _preload_group(self, spreadsheet_id: str, revision: str, sheet_names: List[str]) -> int:
+        blocks = google_sheets_service.batch_get_values(
+            spreadsheet_id,
+            [absolute_range_name(sheet_name) for sheet_name in sheet_names],
+        )
+        for sheet_name, values in zip(sheet_names, blocks):
+            sheet_values_cache.set(
+                (spreadsheet_id, sheet_name, revision),
+                fill_gaps(values) if values else [],
+            )
+        trace_event("batch_values", spreadsheet_id=spreadsheet_id, sheets=sheet_names)
+        logger.info(f"Таблица {spreadsheet_id}: {len(sheet_names)} листов одним batchGet")
+        return len(sheet_names)
 
-    # ==================== Новый метод (по пакетам) ====================
+    def last_parsed(self, spreadsheet_id: str, sheet_name: str) -> Optional[ParsedSheet]:
+        """Последний разбор листа из кэша, даже если ревизия уже устарела"""
+        with self._parsed_lock:
+            return self._parsed_cache.get((spreadsheet_id, sheet_name))
 
-    def parse_sheet_by_packages(
+    def _cached_sheet(
         self,
         spreadsheet_id: str,
-        sheet_name: str
-    ) -> List[Dict]:
+        sheet_name: str,
+        revision: Optional[str],
+    ) -> Optional[ParsedSheet]:
+        if revision is None:
+            return None
+
+        key = (spreadsheet_id, sheet_name)
+        with self._parsed_lock:
+            cached = self._parsed_cache.get(key)
+            if cached is None or cached.revision != revision:
+                return None
+            self._parsed_cache.move_to_end(key)
+
+        logger.info("Лист '%s' не менялся (ревизия %s), берём из кэша", sheet_name, revision)
+        trace_event("parsed_cache_hit", sheet_name=sheet_name, revision=revision)
+        return cached
+
+    def _remember(self, parsed: ParsedSheet) -> None:
+        # Без ревизии нельзя понять, устарел ли разбор, — такие не кэшируем
+        if parsed.revision is None:
+            return
+
+        key = (parsed.spreadsheet_id, parsed.sheet_name)
+        with self._parsed_lock:
+            self._parsed_cache[key] = parsed
+            self._parsed_cache.move_to_end(key)
+            while len(self._parsed_cache) > PARSED_CACHE_MAX_SHEETS:
+                self._parsed_cache.popitem(last=False)
+
+    def _parse_sheet(
+        self,
+        spreadsheet_id: str,
+        sheet_name: str,
+        reuse: Optional[Dict[str, Dict]] = None,
+    ) -> Dict[str, List]:
+        """Одна загрузка и один проход по строкам для обоих режимов"""
         try:
-            logger.info(f"Парсинг по пакетам из листа '{sheet_name}'")
+            logger.info("Парсинг листа '%s'", sheet_name)
+            trace_event("sheet", sheet_name=sheet_name)
 
             all_values = self._get_sheet_values(spreadsheet_id, sheet_name)
 
             if not all_values:
-                return []
+                return {"packages": [], "pilgrims": []}
 
-            package_boundaries = self._find_package_boundaries(all_values)
-            package_boundaries = self._prepend_leading_package_block(
-                all_values,
-                package_boundaries,
-                sheet_name
-            )
+            layout = self._classify_rows(all_values)
+            packages = list(self._iter_packages(all_values, layout, sheet_name, reuse))
+            pilgrims = self._parse_all_pilgrims(all_values, layout)
+            return _share_records(packages, pilgrims)
 
-            if not package_boundaries:
-                logger.warning("Пакеты не найдены, парсим как один блок")
-                header_idx = self._find_header_row(all_values)
-                if header_idx is None:
-                    return []
-                headers = [str(h).strip().lower() for h in all_values[header_idx]]
-                col_map = self._build_column_map(headers)
-                if not self._has_name_source(col_map):
-                    return []
-                pilgrims = self._parse_rows(
-                    all_values,
-                    header_idx + 1,
-                    len(all_values),
-                    col_map,
-                    require_room=False,
-                    require_meal=True,
-                )
-                return [{
-                    "package_name": sheet_name,
-                    "pilgrims": pilgrims,
-                    "count": len(pilgrims)
-                }]
+        except QuotaExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка парсинга листа: {e}")
+            raise ValueError(f"Не удалось распарсить лист: {str(e)}")
 
-            packages = []
+    def _parse_all_pilgrims(self, all_values: List[List], layout: SheetLayout) -> List[PilgrimRecord]:
+        """Все паломники под первым заголовком листа, без деления на пакеты"""
+        header_row_idx = layout.find_header()
 
-            for pkg_name, start_row, end_row in package_boundaries:
-                header_idx = self._find_header_row(all_values, start_row, min(start_row + 20, end_row))
+        if header_row_idx is None:
+            logger.warning("Не найдена строка с заголовками")
+            trace_event("all_pilgrims_skipped", reason="no_header")
+            return []
 
-                if header_idx is None:
-                    logger.warning(f"Заголовок не найден в пакете '{pkg_name}'")
-                    continue
+        col_map = self._column_map(layout, header_row_idx)
+        trace_event("all_pilgrims", header_row=header_row_idx, columns=col_map)
 
-                headers = [str(h).strip().lower() for h in all_values[header_idx]]
-                col_map = self._build_column_map(headers)
+        if not self._has_name_source(col_map):
+            logger.error("Не найдены обязательные колонки с ФИО")
+            trace_event("all_pilgrims_skipped", reason="no_name_columns", header_row=header_row_idx)
+            return []
 
-                if not self._has_name_source(col_map):
-                    logger.warning(f"Колонки с ФИО не найдены в пакете '{pkg_name}'")
-                    continue
+        pilgrims = self._parse_rows(
+            all_values,
+            header_row_idx + 1,
+            len(all_values),
+            col_map,
+            require_room=False,
+            require_meal=False,
+        )
 
-                pilgrims = self._parse_rows(
-                    all_values,
-                    header_idx + 1,
-                    end_row,
-                    col_map,
-                    require_room=False,
-                    require_meal=True,
-                )
+        logger.info("✅ Извлечено %d паломников из листа", len(pilgrims))
+        return pilgrims
 
-                if pilgrims:
-                    packages.append({
-                        "package_name": pkg_name,
-                        "pilgrims": pilgrims,
-                        "count": len(pilgrims)
-                    })
-                    logger.info(f"Пакет '{pkg_name}': {len(pilgrims)} паломников")
-                    if LOG_PACKAGE_PILGRIMS:
-                        self._log_package_pilgrims(pkg_name, pilgrims)
+    def _iter_packages(
+        self,
+        all_values: List[List],
+        layout: SheetLayout,
+        sheet_name: str,
+        reuse: Optional[Dict[str, Dict]] = None,
+    ) -> Iterator[Dict]:
+        """
+        Пакеты листа по порядку; каждый отдаётся сразу после разбора.
+        Результат пакета зависит только от строк его блока, поэтому пакет,
+        чей отпечаток есть в reuse (прошлый разбор листа), не парсится заново.
+        """
+        reuse = reuse or {}
+        package_boundaries = self._find_package_boundaries(layout)
+        package_boundaries = self._prepend_leading_package_block(
+            layout,
+            package_boundaries,
+            sheet_name
+        )
+
+        if not package_boundaries:
+            logger.warning("Пакеты не найдены, парсим как один блок")
+            fingerprint = _block_fingerprint(all_values, 0, len(all_values), sheet_name, single=True)
+            trace_event("block", package=sheet_name, start=0, end=len(all_values), reused=fingerprint in reuse)
+            if fingerprint in reuse:
+                yield reuse[fingerprint]
+                return
+            header_idx = layout.find_header()
+            if header_idx is None:
+                trace_event("package_skipped", package=sheet_name, reason="no_header")
+                return
+            col_map = self._column_map(layout, header_idx)
+            trace_event("header", package=sheet_name, row=header_idx, columns=col_map)
+            if not self._has_name_source(col_map):
+                trace_event("package_skipped", package=sheet_name, reason="no_name_columns")
+                return
+            pilgrims = self._parse_rows(
+                all_values,
+                header_idx + 1,
+                len(all_values),
+                col_map,
+                require_room=False,
+                require_meal=True,
+            )
+            yield {
+                "package_name": sheet_name,
+                "pilgrims": pilgrims,
+                "count": len(pilgrims),
+                "fingerprint": fingerprint,
+            }
+            return
+
+        found = 0
+        reused = 0
+
+        for pkg_name, start_row, end_row in package_boundaries:
+            fingerprint = _block_fingerprint(all_values, start_row, end_row, pkg_name)
+            trace_event("block", package=pkg_name, start=start_row, end=end_row, reused=fingerprint in reuse)
+            if fingerprint in reuse:
+                found += 1
+                reused += 1
+                logger.debug("Пакет '%s' не изменился, берём из прошлого разбора", pkg_name)
+                yield reuse[fingerprint]
+                continue
 
-            logger.info(f"✅ Найдено {len(packages)} пакетов")
-            return packages
+            header_idx = layout.find_header(start_row, min(start_row + 20, end_row))
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка парсинга по пакетам: {e}")
-            raise ValueError(f"Не удалось распарсить лист по пакетам: {str(e)}")
+            if header_idx is None:
+                logger.warning("Заголовок не найден в пакете '%s'", pkg_name)
+                trace_event("package_skipped", package=pkg_name, reason="no_header")
+                continue
+
+            col_map = self._column_map(layout, header_idx)
+            trace_event("header", package=pkg_name, row=header_idx, columns=col_map)
+
+            if not self._has_name_source(col_map):
+                logger.warning("Колонки с ФИО не найдены в пакете '%s'", pkg_name)
+                trace_event("package_skipped", package=pkg_name, reason="no_name_columns")
+                continue
+
+            pilgrims = self._parse_rows(
+                all_values,
+                header_idx + 1,
+                end_row,
+                col_map,
+                require_room=False,
+                require_meal=True,
+            )
+
+            if not pilgrims:
+                trace_event("package_skipped", package=pkg_name, reason="no_pilgrims")
+            else:
+                found += 1
+                logger.debug("Пакет '%s': %d паломников", pkg_name, len(pilgrims))
+                trace_event("package", package=pkg_name, count=len(pilgrims))
+                yield {
+                    "package_name": pkg_name,
+                    "pilgrims": pilgrims,
+                    "count": len(pilgrims),
+                    "fingerprint": fingerprint,
+                }
+
+        logger.info("✅ Найдено %d пакетов, без изменений: %d", found, reused)
 
     def _get_sheet_values(self, spreadsheet_id: str, sheet_name: str) -> List[List]:
-        """Загружает все значения из листа"""
-        client = google_sheets_service.client
-        spreadsheet = client.open_by_key(spreadsheet_id)
-        worksheet = spreadsheet.worksheet(sheet_name)
-        all_values = worksheet.get_all_values()
+        """
+        Загружает все значения из листа (через общий лимит запросов).
+        Пока ревизия таблицы не изменилась, значения берутся из кэша L1/L2.
+        """
+        revision = google_sheets_service.get_revision(spreadsheet_id)
+        if revision is None:
+            all_values = sheet_flight.do(
+                ("values", spreadsheet_id, sheet_name, ""),
+                lambda: self._download_sheet_values(spreadsheet_id, sheet_name),
+            )
+        else:
+            all_values = sheet_values_cache.get(
+                (spreadsheet_id, sheet_name, revision)
+            )
+            if all_values is None:
+                all_values = sheet_flight.do(
+                    ("values", spreadsheet_id, sheet_name, revision),
+                    lambda: sheet_values_cache.get_or_load(
+                        (spreadsheet_id, sheet_name, revision),
+                        lambda: self._download_sheet_values(spreadsheet_id, sheet_name),
+                    ),
+                )
 
         if not all_values:
             logger.warning("Лист пуст")
+            trace_event("values", rows=0, revision=revision)
             return []
 
+        trace_event("values", rows=len(all_values), revision=revision)
         return all_values
 
-    def _find_package_boundaries(self, all_values: List[List]) -> List[tuple]:
-        package_rows = []
+    def _download_sheet_values(self, spreadsheet_id: str, sheet_name: str) -> List[List]:
+        if not settings.SHEET_COLUMN_RESTRICTED_FETCH:
+            return google_sheets_service.get_sheet_values(spreadsheet_id, sheet_name)
 
-        for idx, row in enumerate(all_values):
-            row_text = ' '.join(str(cell) for cell in row[:5] if cell).strip()
+        if google_read_quota.available() < RESTRICTED_FETCH_MAX_REQUESTS:
+            # Бюджет почти исчерпан: один полный запрос дешевле по квоте
+            trace_event("restricted_fetch_skipped", reason="quota")
+            return google_sheets_service.get_sheet_values(spreadsheet_id, sheet_name)
 
-            if not row_text:
+        values = self._download_needed_columns(spreadsheet_id, sheet_name)
+        if values is None:
+            return google_sheets_service.get_sheet_values(spreadsheet_id, sheet_name)
+        return values
+
+    def _download_needed_columns(self, spreadsheet_id: str, sheet_name: str) -> Optional[List[List]]:
+        """
+        Частичная загрузка широкого листа через values.batchGet:
+        1) первые PROBE_COLUMNS колонок — названия пакетов и кандидаты в заголовки,
+           и в том же запросе первые PROBE_FULL_ROWS строк целиком;
+        2) строки-кандидаты ниже PROBE_FULL_ROWS целиком (если есть) — по ним
+           строятся карты колонок;
+        3) только нужные парсеру колонки (ФИО, документ, ИИН, менеджер, ...),
+           если они не попали в первые PROBE_COLUMNS.
+        Каждый запрос — токен квоты: 1–3 вместо одного у полной загрузки.
+        Остальные ячейки в собранной сетке пустые. None — нужна полная загрузка:
+        кандидатов нет или у какого-то пакета нет кандидата сразу под названием.
+        """
+        requests = 1
+        probe_rows, top_rows = google_sheets_service.batch_get_values(
+            spreadsheet_id,
+            [
+                absolute_range_name(sheet_name, f"A:{_column_letter(PROBE_COLUMNS - 1)}"),
+                absolute_range_name(sheet_name, f"1:{PROBE_FULL_ROWS}"),
+            ],
+        )
+        if not probe_rows:
+            return []
+
+        # Первые PROBE_FULL_ROWS строк уже есть целиком — кандидатов в них ищем
+        # по всей ширине, ниже — только по первым PROBE_COLUMNS колонкам
+        candidate_rows = [
+            idx for idx, row in enumerate(probe_rows)
+            if HEADER_MATCHER.contains_any(
+                CELL_SEPARATOR.join(map(str, top_rows[idx] if idx < len(top_rows) else row)).lower()
+            )
+        ]
+        if not candidate_rows:
+            return None
+        if self._has_package_without_candidate(probe_rows, candidate_rows):
+            # Заголовок такого пакета целиком правее PROBE_COLUMNS: частичная
+            # загрузка его не увидит, и пакет потерялся бы
+            trace_event("restricted_fetch_skipped", reason="header_outside_probe")
+            return None
+
+        full_rows: Dict[int, List] = {
+            idx: top_rows[idx] for idx in candidate_rows if idx < len(top_rows)
+        }
+        row_ranges = _group_consecutive([idx for idx in candidate_rows if idx >= PROBE_FULL_ROWS])
+        if row_ranges:
+            requests += 1
+            row_blocks = google_sheets_service.batch_get_values(
+                spreadsheet_id,
+                [absolute_range_name(sheet_name, f"{start + 1}:{end + 1}") for start, end in row_ranges],
+            )
+            for (start, _), block in zip(row_ranges, row_blocks):
+                for offset, row in enumerate(block):
+                    full_rows[start + offset] = row
+
+        needed_columns = set()
+        for row in full_rows.values():
+            headers = [str(h).strip().lower() for h in row]
+            col_map = self._build_column_map(headers)
+            if self._has_name_source(col_map):
+                needed_columns.update(idx for idx in col_map.values() if idx is not None)
+
+        if not needed_columns:
+            return None
+
+        extra_columns = sorted(idx for idx in needed_columns if idx >= PROBE_COLUMNS)
+        column_values: Dict[int, List] = {}
+        if extra_columns:
+            requests += 1
+            column_ranges = _group_consecutive(extra_columns)
+            column_blocks = google_sheets_service.batch_get_values(
+                spreadsheet_id,
+                [
+                    absolute_range_name(sheet_name, f"{_column_letter(start)}:{_column_letter(end)}")
+                    for start, end in column_ranges
+                ],
+                major_dimension="COLUMNS",
+            )
+            for (start, _), block in zip(column_ranges, column_blocks):
+                for offset, column in enumerate(block):
+                    column_values[start + offset] = column
+
+        width = max([PROBE_COLUMNS] + [idx + 1 for idx in needed_columns])
+        row_count = max([len(probe_rows)] + [len(col) for col in column_values.values()])
+
+        all_values = []
+        for idx in range(row_count):
+            if idx in full_rows:
+                all_values.append(list(full_rows[idx]))
                 continue
 
-            has_dates = bool(PACKAGE_HEADER_RE.search(row_text))
-            if not has_dates:
+            row = list(probe_rows[idx]) if idx < len(probe_rows) else []
+            row.extend([""] * (width - len(row)))
+            for col_idx, column in column_values.items():
+                if idx < len(column):
+                    row[col_idx] = column[idx]
+            all_values.append(row)
+
+        trace_event(
+            "restricted_fetch",
+            columns=sorted(needed_columns),
+            header_candidates=sorted(full_rows),
+            requests=requests,
+        )
+        logger.info(
+            f"Лист '{sheet_name}': частичная загрузка за {requests} запр., "
+            f"{len(needed_columns)} колонок, {len(full_rows)} строк-кандидатов в заголовки"
+        )
+        return fill_gaps(all_values)
+
+    def _has_package_without_candidate(self, probe_rows: List[List], candidate_rows: List[int]) -> bool:
+        """Есть название пакета без строки-кандидата в заголовки в следующих строках"""
+        candidates = set(candidate_rows)
+        for idx, row in enumerate(probe_rows):
+            title = ' '.join(str(cell) for cell in row[:5] if cell).strip()
+            if not title or not PACKAGE_HEADER_RE.search(title):
                 continue
+            if not candidates.intersection(range(idx + 1, idx + 1 + PACKAGE_HEADER_LOOKAHEAD)):
+                return True
+        return False
+
+    def _classify_rows(self, all_values: List[List]) -> SheetLayout:
+        """
+        Один проход по листу: каждая строка нормализуется один раз и
+        получает тип — название пакета, заголовок, данные или пустая.
+        """
+        titles = []
+        is_header = []
+        is_blank = []
+        header_cells = {}
+
+        for idx, row in enumerate(all_values):
+            titles.append(' '.join(str(cell) for cell in row[:5] if cell).strip())
+
+            # Ячейки через разделитель: ключевое слово не может попасть
+            # на границу двух ячеек, поэтому проверка по строке целиком
+            # равносильна проверке каждой ячейки
+            row_text = CELL_SEPARATOR.join(map(str, row)).lower()
+            is_blank.append(not row_text.strip())
 
-            header_nearby = False
-            for k in range(1, 6):
-                check_idx = idx + k
-                if check_idx < len(all_values):
-                    if self._find_header_row(all_values, check_idx, check_idx + 1) is not None:
-                        header_nearby = True
-                        break
+            matches = HEADER_MATCHER.count(row_text)
+            is_header.append(matches >= 2)
+            if matches >= 2:
+                header_cells[idx] = [str(cell).strip().lower() for cell in row]
+
+        kinds = []
+        for idx, title in enumerate(titles):
+            # Название пакета: даты "10.03-20.03" и заголовок в следующих 5 строках
+            if (
+                title
+                and PACKAGE_HEADER_RE.search(title)
+                and any(is_header[idx + 1:idx + 1 + PACKAGE_HEADER_LOOKAHEAD])
+            ):
+                kinds.append(ROW_PACKAGE)
+            elif is_header[idx]:
+                kinds.append(ROW_HEADER)
+            elif is_blank[idx]:
+                kinds.append(ROW_BLANK)
+            else:
+                kinds.append(ROW_DATA)
+
+        return SheetLayout(
+            kinds=kinds,
+            titles=titles,
+            header_rows=sorted(header_cells),
+            header_cells=header_cells,
+        )
+
+    def _column_map(self, layout: SheetLayout, header_idx: int) -> Dict[str, Optional[int]]:
+        """Карта колонок строки-заголовка (строится один раз на строку)"""
+        col_map = layout.column_maps.get(header_idx)
+        if col_map is None:
+            col_map = self._build_column_map(layout.header_cells[header_idx])
+            layout.column_maps[header_idx] = col_map
+        return col_map
+
+    def _find_package_boundaries(self, layout: SheetLayout) -> List[tuple]:
+        package_rows = []
 
-            if header_nearby:
-                package_rows.append((row_text, idx))
-                logger.info(f"Найден пакет в строке {idx}: '{row_text}'")
+        for idx, kind in enumerate(layout.kinds):
+            if kind != ROW_PACKAGE:
+                continue
+            row_text = layout.titles[idx]
+            package_rows.append((row_text, idx))
+            logger.debug("Найден пакет в строке %d: '%s'", idx, row_text)
 
         boundaries = []
         for i, (name, start) in enumerate(package_rows):
             if i + 1 < len(package_rows):
                 end = package_rows[i + 1][1]
             else:
-                end = len(all_values)
+                end = len(layout.kinds)
             boundaries.append((name, start, end))
 
         return boundaries
 
     def _build_column_map(self, headers: List[str]) -> Dict[str, Optional[int]]:
-        surname_idx = self._find_column_index(headers, ['surname', 'фамилия', 'lastname', 'last name'])
-        exclude = {surname_idx} if surname_idx is not None else set()
-        name_idx = self._find_column_index(headers, ['name', 'имя', 'firstname', 'first name'], exclude)
-
-        return {
-            "surname": surname_idx,
-            "name": name_idx,
-            "full_name": self._find_column_index(headers, ['first/last name', 'full name', 'fio', 'фио']),
-            "document": self._find_column_index(headers, [
-                'document number',
-                'document no',
-                'doc number',
-                'document',
-                'passport number',
-                'passport no',
-                'passport',
-                'номер паспорта',
-                'номер документа',
-                'паспорт',
-                'загранпаспорт',
-            ]),
-            "iin": self._find_column_index(headers, ['iin', 'иин', 'iin number', 'personal id']),
-            "manager": self._find_column_index(headers, ['manager', 'менеджер', 'manager name']),
-            "room_type": self._find_column_index(headers, [
-                'type of room', 'room', 'комната', 'тип комнаты', 'тип'
-            ]),
-            "meal_type": self._find_column_index(headers, ['meal a day', 'meal', 'питание']),
-            "comment": self._find_column_index(headers, ['comment', 'сomment', 'коммент', 'примеч']),
+        """Карта колонок заголовка; одинаковые заголовки сопоставляются один раз"""
+        return cached_column_map("sheet", headers, self._match_columns)
+
+    def _match_columns(self, headers: List[str]) -> Dict[str, Optional[int]]:
+        col_map = {
+            field_name: matcher.first_match(headers)
+            for field_name, matcher in COLUMN_MATCHERS.items()
         }
+        # 'name' входит и в 'last name' — имя ищем среди остальных колонок
+        if col_map["surname"] is not None:
+            col_map["name"] = COLUMN_MATCHERS["name"].first_match(headers, {col_map["surname"]})
+        return col_map
 
     def _parse_rows(
         self,
@@ -229,7 +783,7 @@ class SheetPilgrimParser:
         col_map: Dict[str, Optional[int]],
         require_room: bool = False,
         require_meal: bool = False,
-    ) -> List[Dict]:
+    ) -> List[PilgrimRecord]:
         surname_idx = col_map["surname"]
         name_idx = col_map["name"]
         full_name_idx = col_map["full_name"]
@@ -243,6 +797,8 @@ class SheetPilgrimParser:
         pilgrims = []
         current_room_type = None
         current_meal_type = None
+        # Берём один раз: без трассировки в цикле только проверки на None
+        trace = current_trace()
 
         if surname_idx is None and full_name_idx is None:
             return pilgrims
@@ -256,6 +812,8 @@ class SheetPilgrimParser:
                 continue
 
             if required_col_indices and len(row) <= max(required_col_indices):
+                if trace is not None:
+                    trace.event("row_skipped", row=row_idx, reason="short_row")
                 continue
 
             # Определяем тип комнаты (наследуется от предыдущей строки если пусто)
@@ -298,15 +856,23 @@ class SheetPilgrimParser:
             meal_type = current_meal_type or ""
 
             if require_room and not current_room_type:
+                if trace is not None:
+                    _trace_skipped_row(trace, row_idx, "no_room", surname, name)
                 continue
 
             if require_meal and not meal_type:
+                if trace is not None:
+                    _trace_skipped_row(trace, row_idx, "no_meal", surname, name)
                 continue
 
             if self._is_cancelled_row(meal_type, comment, surname, name):
+                if trace is not None:
+                    _trace_skipped_row(trace, row_idx, "cancelled", surname, name)
                 continue
 
             if not self._is_probable_person(surname, name):
+                if trace is not None:
+                    _trace_skipped_row(trace, row_idx, "not_person", surname, name)
                 continue
 
             document = self._normalize_document(document_raw)
@@ -315,59 +881,32 @@ class SheetPilgrimParser:
             # Для сравнения нужен хотя бы один устойчивый идентификатор,
             # в крайнем случае оставляем ФИО (если документ/IIN отсутствуют)
             if not document and not iin and not name:
+                if trace is not None:
+                    _trace_skipped_row(trace, row_idx, "no_identifier", surname, name)
                 continue
 
-            pilgrim = {
-                "surname": surname,
-                "name": name,
-                "document": document,
-                "iin": iin,
-                "manager": manager,
-                "meal_type": meal_type,
-            }
-
-            if room_idx is not None:
-                pilgrim["room_type"] = current_room_type or ""
-
-            pilgrims.append(pilgrim)
-
+            pilgrims.append(PilgrimRecord.make(
+                surname=surname,
+                name=name,
+                document=document,
+                iin=iin,
+                manager=manager,
+                meal_type=meal_type,
+                room_type=(current_room_type or "") if room_idx is not None else None,
+            ))
+            if trace is not None:
+                trace.event("pilgrim", row=row_idx, **pilgrims[-1].to_dict())
+
+        if trace is not None:
+            trace.event("rows", start=start_row, end=end_row, pilgrims=len(pilgrims))
         return pilgrims
 
-    def _find_header_row(self, all_values: List[List], start: int = 0, end: int = 20) -> Optional[int]:
-        keywords = [
-            'surname', 'name', 'document', 'passport', 'document number',
-            'фамилия', 'имя', 'паспорт', 'last name', 'first name',
-            'first/last name', 'iin', 'иин'
-        ]
-
-        for idx in range(start, min(end, len(all_values))):
-            row = all_values[idx]
-            row_lower = [str(cell).strip().lower() for cell in row]
-
-            matches = sum(1 for keyword in keywords if any(keyword in cell for cell in row_lower))
-
-            if matches >= 2:
-                return idx
-
-        return None
-
-    def _find_column_index(self, headers: List[str], possible_names: List[str], exclude: set = None) -> Optional[int]:
-        """Находит индекс колонки по возможным названиям"""
-        skip = exclude or set()
-        for idx, header in enumerate(headers):
-            if idx in skip:
-                continue
-            for name in possible_names:
-                if name in header:
-                    return idx
-        return None
-
     def _has_name_source(self, col_map: Dict[str, Optional[int]]) -> bool:
         return col_map.get("surname") is not None or col_map.get("full_name") is not None
 
     def _prepend_leading_package_block(
         self,
-        all_values: List[List],
+        layout: SheetLayout,
         boundaries: List[Tuple[str, int, int]],
         fallback_name: str,
     ) -> List[Tuple[str, int, int]]:
@@ -382,26 +921,26 @@ class SheetPilgrimParser:
         if first_start <= 0:
             return boundaries
 
-        leading_header_idx = self._find_header_row(all_values, 0, first_start)
-        if leading_header_idx is None or leading_header_idx >= first_start:
+        leading_header_idx = layout.find_header(0, first_start)
+        if leading_header_idx is None:
             return boundaries
 
-        block_name = self._extract_leading_block_name(all_values, leading_header_idx, fallback_name)
+        block_name = self._extract_leading_block_name(layout, leading_header_idx, fallback_name)
         return [(block_name, 0, first_start)] + boundaries
 
     def _extract_leading_block_name(
         self,
-        all_values: List[List],
+        layout: SheetLayout,
         header_idx: int,
         fallback_name: str,
     ) -> str:
         for idx in range(header_idx - 1, -1, -1):
-            row_text = ' '.join(str(cell) for cell in all_values[idx][:5] if cell).strip()
+            row_text = layout.titles[idx]
             if not row_text:
                 continue
             if PACKAGE_HEADER_RE.search(row_text):
                 return row_text
-            if any(kw in row_text.lower() for kw in PACKAGE_KEYWORDS):
+            if PACKAGE_MATCHER.contains_any(row_text.lower()):
                 return row_text
 
         return fallback_name
@@ -419,7 +958,7 @@ class SheetPilgrimParser:
 
     def _is_cancelled_row(self, meal_type: str, comment: str, surname: str, name: str) -> bool:
         text = f"{meal_type} {comment} {surname} {name}".lower()
-        return any(keyword in text for keyword in CANCEL_KEYWORDS)
+        return CANCEL_MATCHER.contains_any(text)
 
     def _is_probable_person(self, surname: str, name: str) -> bool:
         if not surname:
@@ -476,24 +1015,69 @@ class SheetPilgrimParser:
         digits = re.sub(r'\D', '', upper_value)
         return digits if len(digits) >= 10 else ""
 
-    def _log_package_pilgrims(self, package_name: str, pilgrims: List[Dict]) -> None:
-        logger.info(f"Список паломников пакета '{package_name}':")
-        for idx, pilgrim in enumerate(pilgrims, start=1):
-            surname = pilgrim.get("surname", "")
-            name = pilgrim.get("name", "")
-            document = pilgrim.get("document", "") or "-"
-            iin = pilgrim.get("iin", "") or "-"
-            meal = pilgrim.get("meal_type", "") or "-"
-            room = pilgrim.get("room_type", "") or "-"
-            logger.info(
-                f"  {idx:03d}. {surname} {name} | doc={document} | iin={iin} | meal={meal} | room={room}"
-            )
-
     def _clean_document(self, document: str) -> str:
         """Очищает номер документа от лишних символов"""
         cleaned = re.sub(r'[^\w]', '', document)
         return cleaned
 
 
+def _share_records(packages: List[Dict], pilgrims: List[PilgrimRecord]) -> Dict[str, List]:
+    """Записи неизменяемы: одинаковые паломники двух режимов — один объект"""
+    shared = {record: record for package in packages for record in package["pilgrims"]}
+    return {
+        "packages": packages,
+        "pilgrims": [shared.get(record, record) for record in pilgrims],
+    }
+
+
+def _trace_skipped_row(trace: ParseTrace, row_idx: int, reason: str, surname: str, name: str) -> None:
+    # Строки без фамилии — пустые и служебные, их слишком много для трассы
+    if not surname and not name:
+        return
+    trace.event("row_skipped", row=row_idx, reason=reason, surname=surname, name=name)
+
+
+def _block_fingerprint(
+    all_values: List[List],
+    start: int,
+    end: int,
+    package_name: str,
+    single: bool = False,
+) -> str:
+    """Отпечаток строк блока [start, end) вместе с названием пакета"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{int(single)}{CELL_SEPARATOR}{package_name}".encode())
+    for row in all_values[start:end]:
+        digest.update(("\x1e" + CELL_SEPARATOR.join(map(str, row))).encode())
+    return digest.hexdigest()
+
+
+def _decode_parse_result(data: Dict) -> Dict:
+    """Результат _parse_sheet из JSON (записи паломников приходят списками)"""
+    return {
+        "packages": [
+            {**package, "pilgrims": [PilgrimRecord(*item) for item in package["pilgrims"]]}
+            for package in data["packages"]
+        ],
+        "pilgrims": [PilgrimRecord(*item) for item in data["pilgrims"]],
+    }
+
+
+def _column_letter(index: int) -> str:
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    return re.sub(r'\d+', '', rowcol_to_a1(1, index + 1))
+
+
+def _group_consecutive(indices: List[int]) -> List[Tuple[int, int]]:
+    """[1, 2, 3, 7, 8] -> [(1, 3), (7, 8)]"""
+    groups = []
+    for idx in indices:
+        if groups and idx == groups[-1][1] + 1:
+            groups[-1] = (groups[-1][0], idx)
+        else:
+            groups.append((idx, idx))
+    return groups
+
+
 # Синглтон
 sheet_pilgrim_parser = SheetPilgrimParser()
@@ -0,0 +1,93 @@
+"""
+Фоновая предзагрузка листов, найденных поиском по дате.
+
+После /tours/search-by-date оператор почти всегда открывает один из
+найденных листов. Предзагрузка скачивает и парсит первые из них в кэш
+распарсенных листов, и следующий /tours/sheet-pilgrims отвечает сразу.
+
+Предзагрузка идёт в отдельном маленьком пуле (не занимает потоки
+интерактивных запросов) и только пока в общем бюджете Google API есть
+запас — иначе лист пропускается.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+
+from app.core.config import settings
+from app.google_sheet_parser.quota_governor import google_read_quota
+from app.google_sheet_parser.sheet_pilgrim_parser import sheet_pilgrim_parser
+
+logger = logging.getLogger(__name__)
+
+
+class SheetPrefetcher:
+
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sheet-prefetch")
+        self._pending: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "scheduled": 0,
+            "parsed": 0,
+            "skipped_quota": 0,
+            "failed": 0,
+        }
+
+    def schedule(self, sheets: List[Tuple[str, str]]) -> int:
+        """Ставит в очередь первые SHEET_PREFETCH_MAX_SHEETS листов; возвращает сколько поставлено"""
+        if not settings.SHEET_PREFETCH_ENABLED:
+            return 0
+
+        scheduled = 0
+        for key in sheets[:settings.SHEET_PREFETCH_MAX_SHEETS]:
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+                self._stats["scheduled"] += 1
+            try:
+                self._executor.submit(self._prefetch, key)
+            except RuntimeError:
+                # Пул уже остановлен (завершение приложения)
+                with self._lock:
+                    self._pending.discard(key)
+                return scheduled
+            scheduled += 1
+
+        return scheduled
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _prefetch(self, key: Tuple[str, str]) -> None:
+        spreadsheet_id, sheet_name = key
+        try:
+            if google_read_quota.available() < settings.SHEET_PREFETCH_MIN_TOKENS:
+                self._count("skipped_quota")
+                logger.info(f"Предзагрузка листа '{sheet_name}' пропущена: мало квоты Google API")
+                return
+
+            parsed = sheet_pilgrim_parser.get_parsed_sheet(spreadsheet_id, sheet_name)
+            self._count("parsed")
+            logger.info(f"Лист '{sheet_name}' предзагружен: {len(parsed.packages)} пакетов")
+        except Exception as e:
+            self._count("failed")
+            logger.warning(f"Ошибка предзагрузки листа '{sheet_name}': {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+
+# Синглтон
+sheet_prefetcher = SheetPrefetcher(workers=settings.SHEET_PREFETCH_WORKERS)
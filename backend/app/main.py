@@ -1,15 +1,35 @@
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import logging
+import logging.handlers
+import math
+import queue
 
 from app.core.config import settings
 from app.core.database import check_db_connection, init_db
+from app.core.executors import run_blocking, shutdown_executors
+from app.core.uploads import UploadSizeLimitMiddleware
 from app.api.v1 import tours, manifest, dispatch, pilgrims, tour_packages, dashboard
+from app.google_sheet_parser.google_sheets_service import google_sheets_service
+from app.google_sheet_parser.quota_governor import QuotaExceededError
+from app.google_sheet_parser.sheet_prefetch import sheet_prefetcher
+# Запись логов в stderr — в отдельном потоке: обработчики запросов только
+# кладут запись в очередь и не ждут вывода
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(_log_queue, _log_handler, respect_handler_level=True)
+# QueueHandler кладёт в очередь только текст сообщения (с traceback):
+# формат с временем и уровнем применяет обработчик слушателя
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=settings.LOG_LEVEL,
+    handlers=[_queue_handler],
 )
+log_listener.start()
 logger = logging.getLogger(__name__)
 app = FastAPI(
     title=settings.APP_NAME,
@@ -18,6 +38,9 @@ app = FastAPI(
 )
 
 
+# Лимит тела загрузок: сверх MAX_UPLOAD_SIZE_MB — 413 до разбора multipart.
+# Добавлен раньше CORS, чтобы ответ 413 тоже получил CORS-заголовки
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.CORS_ORIGINS,
@@ -26,6 +49,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(QuotaExceededError)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceededError):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
 @app.on_event("startup")
 async def startup_event():
     logger.info(f"🚀 Запуск {settings.APP_NAME} v{settings.APP_VERSION}")
@@ -40,12 +72,22 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Ошибка инициализации БД: {e}")
 
+    # Клиенты Google и токен прогреваются в фоне, как и каталог таблиц/листов
+    google_sheets_service.start_client_refresher()
+    google_sheets_service.start_catalog_refresher()
+
     logger.info("✅ Приложение запущено")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("🛑 Остановка приложения")
+    google_sheets_service.stop_catalog_refresher()
+    google_sheets_service.stop_client_refresher()
+    sheet_prefetcher.shutdown()
+    shutdown_executors()
+    # Дописывает оставшиеся в очереди записи
+    log_listener.stop()
 
 app.include_router(tours.router, prefix="/api/v1")
 app.include_router(manifest.router, prefix="/api/v1")
@@ -68,7 +110,7 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check для мониторинга"""
-    db_ok = check_db_connection()
+    db_ok = await run_blocking(check_db_connection)
 
     return {
         "status": "healthy" if db_ok else "degraded",
@@ -0,0 +1,46 @@
+"""
+Карты колонок по сигнатуре строки-заголовка.
+
+Пакеты одного листа повторяют одну и ту же строку-заголовок, а за сезон
+одни и те же раскладки встречаются в сотнях листов и манифестов. Карта
+колонок для нормализованного заголовка считается один раз и берётся из
+общего LRU — перебор названий колонок уходит из горячего цикла.
+"""
+import hashlib
+from typing import Callable, Dict, Sequence
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+# Разделитель ячеек в сигнатуре (не встречается в нормализованных заголовках)
+HEADER_SEPARATOR = "\x1f"
+
+
+def header_signature(headers: Sequence[str]) -> str:
+    """Хэш нормализованной строки-заголовка; порядок колонок важен"""
+    return hashlib.blake2b(
+        HEADER_SEPARATOR.join(headers).encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+
+
+def cached_column_map(
+    kind: str,
+    headers: Sequence[str],
+    build: Callable[[Sequence[str]], Dict],
+) -> Dict:
+    """
+    Карта колонок для headers из кэша или build(headers).
+    kind разделяет парсеры с разными правилами сопоставления.
+    Карта общая для всех вызовов — её нельзя изменять.
+    """
+    key = (kind, header_signature(headers))
+    column_map = column_map_cache.get(key)
+    if column_map is None:
+        column_map = build(headers)
+        column_map_cache.set(key, column_map)
+    return column_map
+
+
+# Синглтон
+column_map_cache = LRUCache(max_entries=settings.COLUMN_MAP_CACHE_ENTRIES)
@@ -27,3 +27,23 @@ def normalize_document(value: str) -> str:
 
     return cleaned
 
+
+def normalize_document_column(values):
+    """
+    normalize_document для колонки pandas (Series строк) целиком:
+    те же правила, но строковыми операциями над всей колонкой.
+    """
+    upper = values.str.upper()
+    # strip не нужен: пробельные символы и так вырезает [^\w];
+    # регулярка — только для значений, где есть что вырезать
+    has_junk = ~upper.str.isalnum()
+    cleaned = upper.copy()
+    cleaned[has_junk] = upper[has_junk].str.replace(r"[^\w]", "", regex=True)
+
+    invalid = (
+        cleaned.isin(_INVALID_TOKENS)
+        | (cleaned.str.isdigit() & (cleaned.str.len() < 7))
+        # Пустое значение, нет цифр или первая цифра 8 (invalid passport/IIN)
+        | ~cleaned.str.match(r"\D*(?!8)\d")
+    )
+    return cleaned.mask(invalid, "")
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+
+class KeywordMatcher:
+    """
+    Набор ключевых слов, скомпилированный в одно регулярное выражение.
+
+    Текст просматривается за один проход независимо от числа слов:
+    для каждой позиции, где начинается совпадение, берётся самое длинное
+    слово, а слова, входящие в него как подстрока, добавляются из заранее
+    посчитанного замыкания. Следующий поиск начинается со следующего
+    символа, поэтому перекрывающиеся слова не теряются. Результат
+    совпадает с проверкой `keyword in text` для каждого слова по отдельности.
+
+    words=True — слово должно стоять целиком (\\b с обеих сторон),
+    пробел в ключевом слове совпадает с любым количеством пробелов.
+    """
+
+    def __init__(self, keywords: Iterable[str], words: bool = False):
+        self.keywords: List[str] = list(dict.fromkeys(k for k in keywords if k))
+        self.words = words
+
+        patterns = {keyword: self._pattern(keyword) for keyword in self.keywords}
+        # Длинные слова раньше: alternation берёт первое подошедшее
+        ordered = sorted(self.keywords, key=len, reverse=True)
+        alternation = "|".join(patterns[keyword] for keyword in ordered)
+        if words:
+            alternation = rf"\b(?:{alternation})\b"
+        self._regex = re.compile(alternation) if self.keywords else None
+
+        self._by_pattern = {}
+        if words:
+            self._exact = [(re.compile(rf"\b{patterns[k]}\b"), k) for k in ordered]
+        self._implied: Dict[str, FrozenSet[str]] = {
+            keyword: frozenset(other for other in self.keywords if self._contains(keyword, other))
+            for keyword in self.keywords
+        }
+
+    def found(self, text: str) -> FrozenSet[str]:
+        """Все ключевые слова, которые встречаются в text"""
+        if self._regex is None or not text:
+            return frozenset()
+
+        result = set()
+        match = self._regex.search(text)
+        while match is not None:
+            result |= self._implied[self._keyword(match.group())]
+            match = self._regex.search(text, match.start() + 1)
+        return frozenset(result)
+
+    def count(self, text: str) -> int:
+        """Сколько разных ключевых слов встречается в text"""
+        return len(self.found(text))
+
+    def contains_any(self, text: str) -> bool:
+        if self._regex is None or not text:
+            return False
+        return self._regex.search(text) is not None
+
+    def first_match(self, texts: Iterable[str], exclude: Optional[set] = None) -> Optional[int]:
+        """Индекс первого текста, содержащего любое ключевое слово"""
+        skip = exclude or set()
+        for idx, text in enumerate(texts):
+            if idx not in skip and self.contains_any(text):
+                return idx
+        return None
+
+    def _keyword(self, matched: str) -> str:
+        if not self.words:
+            return matched
+        # Пробелы в совпадении могли быть любыми — находим слово по шаблону
+        keyword = self._by_pattern.get(matched)
+        if keyword is None:
+            keyword = next(k for regex, k in self._exact if regex.fullmatch(matched))
+            self._by_pattern[matched] = keyword
+        return keyword
+
+    def _pattern(self, keyword: str) -> str:
+        pattern = re.escape(keyword)
+        if self.words:
+            pattern = pattern.replace(r"\ ", r"\s+")
+        return pattern
+
+    def _contains(self, keyword: str, other: str) -> bool:
+        if not self.words:
+            return other in keyword
+        return re.search(rf"\b{self._pattern(other)}\b", keyword) is not None
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+from app.google_sheet_parser.sheet_pilgrim_parser import ParsedSheet
+from app.services.document_rules import normalize_document
+from app.services.pilgrim_record import PilgrimRecord
+
+
+def compare_manifest(
+    manifest_pilgrims: List[PilgrimRecord],
+    sheet: ParsedSheet,
+) -> Dict[str, List[PilgrimRecord]]:
+    """
+    Сверка манифеста с листом по номеру документа.
+
+    Индекс документов листа уже посчитан в ParsedSheet, поэтому
+    сравнение — операции над множествами в памяти, без обращения к Google.
+    """
+    sheet_docs = sheet.documents
+    manifest_docs = [
+        normalize_document(pilgrim.document.upper())
+        for pilgrim in manifest_pilgrims
+    ]
+    manifest_doc_set = {doc for doc in manifest_docs if doc}
+
+    # Те кто есть и в манифесте и в таблице
+    matched = [
+        sheet_docs[doc]
+        for doc in manifest_docs
+        if doc in sheet_docs
+    ]
+
+    # Есть в таблице, но НЕТ в манифесте
+    in_sheet_not_in_manifest = [
+        pilgrim
+        for doc, pilgrim in sheet_docs.items()
+        if doc not in manifest_doc_set
+    ]
+
+    # Есть в манифесте, но НЕТ в таблице
+    in_manifest_not_in_sheet = [
+        pilgrim
+        for pilgrim, doc in zip(manifest_pilgrims, manifest_docs)
+        if not doc or doc not in sheet_docs
+    ]
+
+    return {
+        "matched": matched,
+        "in_sheet_not_in_manifest": in_sheet_not_in_manifest,
+        "in_manifest_not_in_sheet": in_manifest_not_in_sheet,
+    }
+
@@ -0,0 +1,78 @@
+"""
+Разобранные манифесты по содержимому файла.
+
+Пока оператор сверяет тур, один и тот же файл загружается по многу раз.
+Результат разбора хранится по sha256 содержимого, расширению файла
+(от него зависит движок чтения) и версии парсера (L1 в памяти + Redis):
+повторная загрузка того же файла не парсит его заново, а upload
+возвращает manifest_id. /manifest/compare и постановка отправки
+в очередь принимают manifest_id вместо полного списка паломников.
+"""
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from app.core.cache import TwoTierCache
+from app.core.config import settings
+from app.google_sheet_parser.manifest_parser import MANIFEST_PARSER_VERSION
+from app.services.pilgrim_record import PilgrimRecord
+
+
+@dataclass
+class StoredManifest:
+    manifest_id: str
+    # Имя файла при первой загрузке
+    filename: str
+    pilgrims: List[PilgrimRecord]
+
+
+def _encode(manifest: StoredManifest) -> Dict[str, Any]:
+    return {
+        "manifest_id": manifest.manifest_id,
+        "filename": manifest.filename,
+        "pilgrims": [list(pilgrim) for pilgrim in manifest.pilgrims],
+    }
+
+
+def _decode(data: Dict[str, Any]) -> StoredManifest:
+    return StoredManifest(
+        manifest_id=data["manifest_id"],
+        filename=data["filename"],
+        pilgrims=[PilgrimRecord.make(*item) for item in data["pilgrims"]],
+    )
+
+
+class ManifestStore:
+
+    def __init__(self, l1_max_bytes: int, ttl_seconds: int):
+        self.cache = TwoTierCache(
+            "manifests",
+            l1_max_bytes=l1_max_bytes,
+            ttl_seconds=ttl_seconds,
+            encode=_encode,
+            decode=_decode,
+        )
+
+    @staticmethod
+    def manifest_id(content_digest: str, extension: str) -> str:
+        """manifest_id из sha256 содержимого, расширения и MANIFEST_PARSER_VERSION"""
+        key = f"{MANIFEST_PARSER_VERSION}:{extension.lower()}:{content_digest}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, manifest_id: str) -> Optional[StoredManifest]:
+        return self.cache.get((manifest_id,))
+
+    def put(self, manifest_id: str, filename: str, pilgrims: List[PilgrimRecord]) -> StoredManifest:
+        manifest = StoredManifest(manifest_id=manifest_id, filename=filename, pilgrims=pilgrims)
+        self.cache.set((manifest_id,), manifest)
+        return manifest
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+# Синглтон
+manifest_store = ManifestStore(
+    l1_max_bytes=settings.MANIFEST_CACHE_MAX_MB * 1024 * 1024,
+    ttl_seconds=settings.MANIFEST_CACHE_TTL_SECONDS,
+)
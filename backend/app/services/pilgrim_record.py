@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import sys
+from typing import Any, Dict, Iterable, Mapping, NamedTuple, Optional
+
+# Поля, которые отдаёт /manifest/upload и принимает /manifest/compare
+MANIFEST_FIELDS = ("surname", "name", "document", "iin")
+COMPARE_FIELDS = ("surname", "name", "document", "iin", "manager")
+
+
+class PilgrimRecord(NamedTuple):
+    """
+    Паломник внутри парсеров, кэшей и сравнения.
+
+    Кортеж без __dict__ примерно втрое меньше словаря с теми же полями,
+    а повторяющиеся значения (менеджер, питание, комната, частые имена)
+    интернируются и хранятся один раз. В dict/Pydantic запись
+    превращается только на границе API.
+    """
+    surname: str
+    name: str
+    document: str = ""
+    iin: str = ""
+    manager: str = ""
+    meal_type: str = ""
+    # None — в листе нет колонки с типом комнаты
+    room_type: Optional[str] = None
+
+    @classmethod
+    def make(
+        cls,
+        surname: str,
+        name: str,
+        document: str = "",
+        iin: str = "",
+        manager: str = "",
+        meal_type: str = "",
+        room_type: Optional[str] = None,
+    ) -> "PilgrimRecord":
+        # Номера документов и ИИН уникальны — их не интернируем
+        return cls(
+            sys.intern(surname),
+            sys.intern(name),
+            document,
+            iin,
+            sys.intern(manager),
+            sys.intern(meal_type),
+            sys.intern(room_type) if room_type is not None else None,
+        )
+
+    @classmethod
+    def from_mapping(cls, values: Mapping[str, Any]) -> "PilgrimRecord":
+        fields = {
+            field: str(values.get(field) or "")
+            for field in cls._fields
+            if field != "room_type"
+        }
+        room_type = values.get("room_type")
+        return cls.make(room_type=str(room_type) if room_type is not None else None, **fields)
+
+    def to_dict(self, fields: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """Словарь для ответа API; room_type только если колонка была в листе"""
+        if fields is not None:
+            return {field: getattr(self, field) or "" for field in fields}
+        values = self._asdict()
+        if self.room_type is None:
+            del values["room_type"]
+        return values
@@ -0,0 +1,107 @@
+"""
+Нормализация строк манифеста из DataFrame (путь через pandas):
+построчно через iterrows, построчно через itertuples и по колонкам
+(_records_from_frame). Все три варианта дают одинаковые записи — это
+проверяется перед замером.
+
+Манифест: 5000 строк со смешанными типами ИИН (число, строка, None,
+экспоненциальная запись) и ФИО в одной или двух колонках. Замеряется
+только нормализация и сборка записей, чтение файла — отдельной строкой.
+Варианты чередуются по раундам, печатаются минимум и медиана.
+
+Запуск из backend/:
+    python -m benchmarks.manifest_normalization [--rows 5000] [--rounds 40]
+"""
+import argparse
+import io
+import logging
+import random
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import openpyxl
+import pandas as pd
+
+from app.google_sheet_parser.manifest_parser import MANIFEST_COLUMNS, ManifestParser
+
+SURNAMES = ["Ivanov", "Petrova", "Сидоров", "Ahmetov Ali", "Kim"]
+NAMES = ["Ivan", "Anna", "", "Ерлан", None]
+
+
+def build_manifest(rows: int, seed: int = 1) -> bytes:
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["No", "Last Name", "First Name", "Full Name", "Passport number", "IIN", "Room", "Note"])
+    for i in range(rows):
+        sheet.append([
+            i + 1,
+            rng.choice(SURNAMES),
+            rng.choice(NAMES),
+            "X Y Z",
+            f"N{rng.randint(1000000, 9999999)}",
+            rng.choice([
+                rng.randint(10 ** 11, 10 ** 12 - 1),
+                str(rng.randint(10 ** 11, 10 ** 12 - 1)),
+                None,
+                "1.2345678901E+11",
+            ]),
+            "DBL",
+            rng.choice(["", "vip", None]),
+        ])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    args.add_argument("--rows", type=int, default=5000)
+    args.add_argument("--rounds", type=int, default=40)
+    options = args.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    parser = ManifestParser()
+    content = build_manifest(options.rows)
+
+    started = time.perf_counter()
+    df = pd.read_excel(io.BytesIO(content), sheet_name=0)
+    read_ms = (time.perf_counter() - started) * 1000
+
+    positions = {str(column).strip().lower(): idx for idx, column in enumerate(df.columns)}
+    columns = parser._resolve_columns(list(positions))
+    indices = {
+        field: positions[columns[field]] if columns[field] is not None else None
+        for field in MANIFEST_COLUMNS
+    }
+
+    variants: Dict[str, Callable[[], List]] = {
+        "iterrows (построчно)": lambda: parser._records_from_rows(
+            [row.tolist() for _, row in df.iterrows()], indices
+        ),
+        "itertuples (построчно)": lambda: parser._records_from_rows(
+            df.itertuples(index=False, name=None), indices
+        ),
+        "по колонкам": lambda: parser._records_from_frame(df, indices),
+    }
+
+    results = [fn() for fn in variants.values()]
+    if any(result != results[0] for result in results[1:]):
+        raise SystemExit("Варианты дают разные записи")
+
+    timings: Dict[str, List[float]] = {name: [] for name in variants}
+    for _ in range(options.rounds):
+        for name, fn in variants.items():
+            started = time.perf_counter()
+            fn()
+            timings[name].append((time.perf_counter() - started) * 1000)
+
+    print(f"строк: {len(df)}, записей: {len(results[0])}, раундов: {options.rounds}")
+    for name, values in timings.items():
+        print(f"{name:24s} min {min(values):7.1f} ms   медиана {statistics.median(values):7.1f} ms")
+    print(f"{'pd.read_excel':24s}     {read_ms:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Память, которую держит один разобранный лист: PilgrimRecord против словарей.
+
+Лист: 200 пакетов по 250 паломников (50 тыс. строк). Разбор идёт через
+SheetPilgrimParser.get_parsed_sheet без Google API. Для сравнения те же
+паломники собираются словарями так, как их отдавал прежний парсер:
+отдельный dict на каждый режим (пакеты и общий список); фамилия, имя и
+документ — новые строки после upper(), остальные поля — строки из ячеек
+листа (strip() возвращает тот же объект).
+
+Запуск из backend/:
+    python -m benchmarks.pilgrim_memory
+"""
+import gc
+import logging
+import random
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from app.google_sheet_parser.sheet_pilgrim_parser import SheetPilgrimParser
+
+PACKAGES = 200
+PILGRIMS_PER_PACKAGE = 250
+
+SURNAMES = ["IVANOV", "PETROV", "ABDULLAYEV", "NURLANOV", "SMAGULOV", "AKHMETOV", "KASYMOV", "TOKAEV"]
+NAMES = ["IVAN", "AIGUL", "NURLAN", "DANA"]
+
+
+def build_sheet(seed: int = 1) -> List[List[str]]:
+    rng = random.Random(seed)
+    rows = []
+    for k in range(PACKAGES):
+        rows.append([f"NIYET {k % 28 + 1}.03-{k % 28 + 1}.04"] + [""] * 11)
+        rows.append(["No", "Surname", "Name", "Passport", "IIN", "Manager", "Type of room", "Meal", "Comment"] + [""] * 3)
+        for j in range(PILGRIMS_PER_PACKAGE):
+            rows.append([
+                str(j),
+                rng.choice(SURNAMES) + str(rng.randint(0, 300)),
+                rng.choice(NAMES),
+                "N%07d" % (k * 1000 + j),
+                "0%011d" % (k * 1000 + j),
+                rng.choice(["Aigerim", "Dana"]),
+                rng.choice(["DBL", "TRPL", "QUAD"]),
+                rng.choice(["BB", "HB", "FB"]),
+                "",
+            ] + [""] * 3)
+    return rows
+
+
+class _LocalSheetParser(SheetPilgrimParser):
+    """Парсер, который берёт значения листа из памяти"""
+
+    def __init__(self, values: List[List[str]]):
+        super().__init__()
+        self._values = values
+
+    def _get_sheet_values(self, spreadsheet_id: str, sheet_name: str) -> List[List]:
+        return self._values
+
+
+# Поля, которые прежний парсер получал через upper() — каждый раз новая строка
+FRESH_FIELDS = ("surname", "name", "document")
+
+
+def _old_dict(pilgrim) -> dict:
+    values = pilgrim.to_dict()
+    for field in FRESH_FIELDS:
+        values[field] = values[field].encode("utf-8").decode("utf-8")
+    return values
+
+
+def _as_dicts(parsed) -> Tuple[List, List]:
+    packages = [
+        {"package_name": package["package_name"], "pilgrims": [_old_dict(p) for p in package["pilgrims"]]}
+        for package in parsed.packages
+    ]
+    pilgrims = [_old_dict(p) for p in parsed.pilgrims]
+    return packages, pilgrims
+
+
+def retained(build: Callable[[], object]) -> Tuple[object, int, int]:
+    """(результат, удержанные байты, пик) — по tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def main() -> None:
+    logging.disable(logging.CRITICAL)
+    values = build_sheet()
+    parser = _LocalSheetParser(values)
+
+    parsed, records_bytes, records_peak = retained(lambda: parser.get_parsed_sheet("benchmark", "sheet"))
+    entries = len(parsed.pilgrims) + sum(len(package["pilgrims"]) for package in parsed.packages)
+
+    # Словари строятся из уже разобранного листа: считаем только их самих
+    _, dict_bytes, _ = retained(lambda: _as_dicts(parsed))
+
+    print(f"строк в листе: {len(values)}, записей (оба режима): {entries}")
+    print(f"PilgrimRecord: {records_bytes / 1e6:6.1f} MB удержано, {records_bytes / entries:5.0f} B/запись "
+          f"(пик разбора {records_peak / 1e6:.1f} MB)")
+    print(f"dict:          {dict_bytes / 1e6:6.1f} MB удержано, {dict_bytes / entries:5.0f} B/запись")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import fakeredis
+import pytest
+
+from app.core import redis_client
+from app.google_sheet_parser import sheet_pilgrim_parser as parser_module
+
+CALLERS = 8
+
+SHEET_HEADER = ["No", "Surname", "Name", "Passport", "IIN", "Manager", "Type of room", "Meal", "Comment"]
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch):
+    """Отдельный fakeredis на каждый тест"""
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_client, "_client", client)
+    return client
+
+
+@pytest.fixture
+def no_redis(monkeypatch):
+    """Redis недоступен: кэши и singleflight только в памяти процесса"""
+    monkeypatch.setattr(redis_client, "_client", None)
+    monkeypatch.setattr(redis_client, "_unavailable_until", math.inf)
+
+
+@pytest.fixture
+def parser():
+    parser_module.sheet_values_cache.l1.clear()
+    return parser_module.SheetPilgrimParser()
+
+
+def make_sheet(packages: List[List[List[str]]]) -> List[List[str]]:
+    """
+    Лист из пакетов: строка с названием, заголовок, строки паломников
+    [surname, name, passport, iin, room, meal].
+    """
+    rows = []
+    for idx, pilgrims in enumerate(packages, start=1):
+        rows.append([f"NIYET {idx}.03-{idx + 7}.03"] + [""] * (len(SHEET_HEADER) - 1))
+        rows.append(list(SHEET_HEADER))
+        for number, (surname, name, passport, iin, room, meal) in enumerate(pilgrims, start=1):
+            rows.append([str(number), surname, name, passport, iin, "Dana", room, meal, ""])
+    return rows
+
+
+def run_concurrently(fn, count=CALLERS):
+    """count одновременных вызовов fn; результат или исключение каждого"""
+    barrier = threading.Barrier(count)
+
+    def call():
+        barrier.wait()
+        try:
+            return fn()
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        return [future.result() for future in [pool.submit(call) for _ in range(count)]]
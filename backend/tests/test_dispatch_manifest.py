@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+from app.api.v1.dispatch import (
+    DispatchEnqueueRequest,
+    DispatchSelectionSnapshot,
+    DispatchTourSnapshot,
+    _results_from_manifest,
+)
+from app.core.config import settings
+from app.google_sheet_parser.google_sheets_service import google_sheets_service
+from app.services.manifest_store import manifest_store
+from app.services.pilgrim_record import PilgrimRecord
+from tests.conftest import make_sheet
+
+
+def test_manifest_results_carry_package_names_on_multi_package_sheet(monkeypatch):
+    # Во втором пакете у паломника пустая комната: в общем списке (сверка)
+    # она тянется из первого пакета, в разборе по пакетам — нет
+    sheet = make_sheet([
+        [["IVANOV", "IVAN", "N1234567", "900101300123", "DBL", "BB"]],
+        [
+            ["SMAGULOV", "NURLAN", "N1111111", "850303300789", "", "HB"],
+            ["KIM", "DANA", "n 2222222", "", "TRPL", "HB"],
+        ],
+    ])
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", False)
+    monkeypatch.setattr(google_sheets_service, "get_revision", lambda spreadsheet_id: "rev-1")
+    fetch_threads = []
+
+    def get_sheet_values(spreadsheet_id, sheet_name):
+        fetch_threads.append(threading.current_thread().name)
+        return sheet
+
+    monkeypatch.setattr(google_sheets_service, "get_sheet_values", get_sheet_values)
+
+    manifest_store.put("manifest-1", "manifest.xlsx", [
+        PilgrimRecord.make("IVANOV", "IVAN", "N1234567"),
+        PilgrimRecord.make("SMAGULOV", "NURLAN", "N1111111"),
+        PilgrimRecord.make("KIM", "DANA", "N2222222"),
+        PilgrimRecord.make("ABDULLAYEV", "ALI", "N3333333"),
+    ])
+    request = DispatchEnqueueRequest(
+        tour=DispatchTourSnapshot(spreadsheet_id="spreadsheet", sheet_name="dispatch-multi-package"),
+        selection=DispatchSelectionSnapshot(),
+        manifest_id="manifest-1",
+    )
+
+    results = asyncio.run(_results_from_manifest(request))
+
+    assert [(p.surname, p.package_name) for p in results.matched] == [
+        ("IVANOV", "NIYET 1.03-8.03"),
+        ("SMAGULOV", "NIYET 2.03-9.03"),
+        ("KIM", "NIYET 2.03-9.03"),
+    ]
+    assert [(p.surname, p.package_name) for p in results.in_manifest_not_in_sheet] == [("ABDULLAYEV", "")]
+    assert results.in_sheet_not_in_manifest == []
+    assert request.manifest_filename == "manifest.xlsx"
+    # Лист загружен в пуле Google I/O
+    assert [name.startswith("google-io") for name in fetch_threads] == [True]
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+import uuid
+
+import httpx
+
+from app.core.config import settings
+from app.google_sheet_parser.google_sheets_service import google_sheets_service
+from tests.conftest import make_sheet
+
+SHEET_FETCH_SECONDS = 3
+# /health и /tours/cache/stats должны отвечать намного быстрее загрузки листа
+FAST_RESPONSE_SECONDS = 0.5
+
+
+def test_endpoints_stay_fast_while_sheet_fetch_is_in_flight(monkeypatch):
+    started = threading.Event()
+
+    def slow_get_sheet_values(spreadsheet_id, sheet_name):
+        # Медленный Google API: поток google_io_executor занят, цикл событий — нет
+        started.set()
+        time.sleep(SHEET_FETCH_SECONDS)
+        return make_sheet([[["IVANOV", "IVAN", "N1234567", "900101300123", "DBL", "BB"]]])
+
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", False)
+    monkeypatch.setattr(google_sheets_service, "get_revision", lambda spreadsheet_id: f"rev-{uuid.uuid4().hex}")
+    monkeypatch.setattr(google_sheets_service, "get_sheet_values", slow_get_sheet_values)
+
+    from app.main import app
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            sheet_request = asyncio.create_task(client.post(
+                "/api/v1/tours/sheet-pilgrims",
+                json={"spreadsheet_id": "spreadsheet", "sheet_name": "7.03-14.03 NIYET"},
+            ))
+            assert await asyncio.to_thread(started.wait, 5)
+
+            latencies = {}
+            for path in ("/health", "/api/v1/tours/cache/stats"):
+                begin = time.perf_counter()
+                response = await client.get(path)
+                latencies[path] = time.perf_counter() - begin
+                assert response.status_code == 200, response.text
+
+            assert not sheet_request.done()
+            return latencies, await sheet_request
+
+    latencies, sheet_response = asyncio.run(run())
+
+    assert all(latency < FAST_RESPONSE_SECONDS for latency in latencies.values()), latencies
+    assert sheet_response.status_code == 200, sheet_response.text
+    assert sheet_response.json()["total_count"] == 1
@@ -0,0 +1,29 @@
+import logging
+import sys
+
+from app import main
+
+
+def _record(msg, *args, exc_info=None):
+    return logging.LogRecord("tours", logging.INFO, __file__, 1, msg, args, exc_info)
+
+
+def test_log_line_is_formatted_once():
+    prepared = main._queue_handler.prepare(_record("Найдено %d листов", 3))
+
+    line = main._log_handler.format(prepared)
+
+    assert line.endswith(" - tours - INFO - Найдено 3 листов")
+
+
+def test_traceback_survives_the_queue():
+    try:
+        raise ZeroDivisionError("division by zero")
+    except ZeroDivisionError:
+        prepared = main._queue_handler.prepare(_record("boom", exc_info=sys.exc_info()))
+
+    line = main._log_handler.format(prepared)
+
+    assert " - tours - INFO - boom\nTraceback" in line
+    assert line.count("boom") == 1
+    assert line.rstrip().endswith("ZeroDivisionError: division by zero")
@@ -0,0 +1,117 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from app.google_sheet_parser.manifest_parser import MANIFEST_COLUMNS, manifest_parser
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+CSV_CONTENT = b"surname;name;passport;iin\nIvanov;Ivan;n 1234567;880101300123\nPetrov;;;\n"
+
+
+def test_csv_manifest_parsed_without_pandas_and_openpyxl():
+    # Отдельный интерпретатор: в этом pandas уже мог загрузить другой тест
+    script = (
+        "import sys\n"
+        "from app.google_sheet_parser.manifest_parser import parse_manifest_content\n"
+        f"pilgrims = parse_manifest_content({CSV_CONTENT!r}, 'm.csv')\n"
+        "assert len(pilgrims) == 1, pilgrims\n"
+        "print(sorted({'pandas', 'numpy', 'openpyxl'} & set(sys.modules)))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "[]"
+
+
+def test_pandas_fallback_still_returns_records(monkeypatch):
+    import pandas as pd
+
+    frame = pd.DataFrame({"Surname": ["Ivanov", ""], "Name": ["Ivan", "x"], "IIN": [880101300123.0, None]})
+    monkeypatch.setattr(pd, "read_excel", lambda *args, **kwargs: frame)
+
+    pilgrims = manifest_parser.parse_manifest(b"", "m.xls")
+
+    assert [(p.surname, p.name, p.iin) for p in pilgrims] == [("IVANOV", "IVAN", "880101300123")]
+
+
+SURNAMES = ["Ivanov", "petrova", "Сидоров", "Ahmetov  Ali", " Kim ", "　", "", None, float("nan"), 12345]
+NAMES = ["Ivan", "", " Anna ", "Ерлан ", None, float("nan"), 7.0]
+FULL_NAMES = ["X Y Z", "Ким\tАнна Ли", "  ", "single", None, float("nan")]
+DOCUMENTS = ["N1234567", "n 1234567", "№ 12-34", " AB123 ", "", None, float("nan"), 1234567.0, 98765, "abc!"]
+IINS = [
+    880101300123, 880101300123.0, "880101300123", " 880 101 300 123 ", "880101300123.0", "8801013001.000",
+    "1.2345678901E+11", "1.2E+3", "E12", "12e", "abc", "12-34-56-78-90", " 880101300123　",
+    12.5, 1e20, float("inf"), "", None, float("nan"),
+]
+
+
+def _mixed_frame(seed: int, rows: int = 300):
+    import random
+
+    import pandas as pd
+
+    rng = random.Random(seed)
+    frame = pd.DataFrame({
+        "surname": [rng.choice(SURNAMES) for _ in range(rows)],
+        "name": [rng.choice(NAMES) for _ in range(rows)],
+        "full_name": [rng.choice(FULL_NAMES) for _ in range(rows)],
+        "document": [rng.choice(DOCUMENTS) for _ in range(rows)],
+        "iin": [rng.choice(IINS) for _ in range(rows)],
+    })
+    frame.loc[::7, "document"] = pd.NaT
+    return frame
+
+
+def _typed_iin_frames():
+    import numpy as np
+    import pandas as pd
+
+    base = pd.DataFrame({
+        "surname": ["Ivanov", "Petrov", "Kim", "Li"],
+        "name": ["Ivan", "", None, "Anna"],
+        "full_name": ["", "Petrov Pavel", "Kim Ok", None],
+        "document": [pd.NaT, pd.Timestamp("2024-03-01"), "N1", None],
+    })
+    yield base.assign(iin=np.array([880101300123, 1, 0, -5], dtype=np.int64))
+    yield base.assign(iin=[880101300123.0, np.nan, 1.5e11, 12.25])
+    yield base.assign(iin=pd.Series(["880101300123", None, "1E+11", "x"], dtype=object))
+
+
+def _frames():
+    for seed in range(5):
+        yield _mixed_frame(seed)
+    yield from _typed_iin_frames()
+
+
+def test_frame_path_matches_row_path():
+    indices = {field: idx for idx, field in enumerate(MANIFEST_COLUMNS)}
+
+    for frame in _frames():
+        assert list(frame.columns) == list(MANIFEST_COLUMNS)
+        by_columns = manifest_parser._records_from_frame(frame, indices)
+        by_rows = manifest_parser._records_from_rows(frame.itertuples(index=False, name=None), indices)
+        assert by_columns == by_rows
+
+
+def test_csv_cp1251_text_after_sample_is_decoded(tmp_path):
+    from app.google_sheet_parser import excel_rows
+
+    ascii_rows = "".join(
+        f"Ivanov{i};Ivan;N{1000000 + i};880101300123\n"
+        for i in range(excel_rows.CSV_SAMPLE_BYTES // 30)
+    )
+    content = ("surname;name;passport;iin\n" + ascii_rows + "Сидоров;Ерлан;N7654321;\n").encode("cp1251")
+    assert content[:excel_rows.CSV_SAMPLE_BYTES].isascii()
+    path = tmp_path / "m.csv"
+    path.write_bytes(content)
+
+    for source in (content, str(path)):
+        pilgrims = manifest_parser.parse_manifest(source, "m.csv")
+        assert len(pilgrims) == ascii_rows.count("\n") + 1
+        assert (pilgrims[0].surname, pilgrims[-1].surname, pilgrims[-1].name) == ("IVANOV0", "СИДОРОВ", "ЕРЛАН")
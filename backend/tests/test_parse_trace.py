@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core import parse_trace as parse_trace_module
+from app.core.config import settings
+from app.core.parse_trace import parse_trace, trace_store
+from app.google_sheet_parser.google_sheets_service import google_sheets_service
+from tests.conftest import make_sheet
+
+PACKAGES = [
+    [["IVANOV", "IVAN", "N1234567", "900101300123", "DBL", "BB"]],
+    [["SMAGULOV", "NURLAN", "N1111111", "850303300789", "TRPL", "HB"]],
+]
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    """Лист и ревизия, которые меняет тест; values.get читает state["grid"]"""
+    state = {"grid": make_sheet(PACKAGES), "revision": "rev-1"}
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", False)
+    monkeypatch.setattr(google_sheets_service, "get_revision", lambda spreadsheet_id: state["revision"])
+    monkeypatch.setattr(
+        google_sheets_service, "get_sheet_values",
+        lambda spreadsheet_id, sheet_name: [list(row) for row in state["grid"]],
+    )
+    return state
+
+
+def traced_parse(parser):
+    async def run():
+        async with parse_trace("test") as trace:
+            parsed = parser.get_parsed_sheet("spreadsheet", "sheet")
+        return parsed, trace_store.get(trace.id)
+
+    return asyncio.run(run())
+
+
+def kinds(trace):
+    return [event["event"] for event in trace["events"]]
+
+
+def test_trace_of_unchanged_sheet_explains_every_package(parser, sheet):
+    cached = parser.get_parsed_sheet("spreadsheet", "sheet")
+
+    parsed, trace = traced_parse(parser)
+
+    assert "parsed_cache_hit" not in kinds(trace)
+    assert kinds(trace).count("header") == 2
+    assert kinds(trace).count("package") == 2
+    assert parsed.packages == cached.packages
+    assert parsed.pilgrims == cached.pilgrims
+
+
+def test_trace_does_not_reuse_unchanged_blocks(parser, sheet):
+    parser.get_parsed_sheet("spreadsheet", "sheet")
+    sheet["revision"] = "rev-2"
+    sheet["grid"] = make_sheet([PACKAGES[0], PACKAGES[1] + [["KIM", "DANA", "N2222222", "", "TRPL", "HB"]]])
+
+    parsed, trace = traced_parse(parser)
+
+    blocks = [event for event in trace["events"] if event["event"] == "block"]
+    assert [block["reused"] for block in blocks] == [False, False]
+    assert kinds(trace).count("package") == 2
+    # Изменения относительно прошлой ревизии считаются как обычно
+    assert parsed.changed_packages == [parsed.packages[1]["package_name"]]
+
+
+def test_trace_is_saved_off_the_event_loop(monkeypatch):
+    saved = {}
+    save = trace_store.save
+
+    def recording_save(trace):
+        saved["thread"] = threading.current_thread()
+        save(trace)
+
+    monkeypatch.setattr(parse_trace_module.trace_store, "save", recording_save)
+
+    async def run():
+        async with parse_trace("test") as trace:
+            trace.event("step")
+        return threading.current_thread(), trace.id
+
+    loop_thread, trace_id = asyncio.run(run())
+
+    assert saved["thread"] is not loop_thread
+    assert kinds(trace_store.get(trace_id)) == ["step"]
+
+
+def test_disabled_trace_records_nothing():
+    async def run():
+        async with parse_trace("test", enabled=False) as trace:
+            return trace
+
+    assert asyncio.run(run()) is None
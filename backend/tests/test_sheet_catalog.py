@@ -0,0 +1,107 @@
+import time
+
+from app.google_sheet_parser.revision_probe import SpreadsheetRevisions
+from app.google_sheet_parser.sheet_catalog import SheetCatalog, SheetCatalogCache
+
+TTL = 3600
+
+
+def revisions(**files):
+    return SpreadsheetRevisions(
+        {spreadsheet_id: {"name": f"Туры {spreadsheet_id}", "revision": rev} for spreadsheet_id, rev in files.items()},
+        probed_at=time.time(),
+    )
+
+
+def make_cache(built_at):
+    builds = []
+
+    def loader():
+        builds.append(1)
+        return SheetCatalog(
+            spreadsheets={"Туры a": "a"},
+            worksheets={"a": ["7.03-14.03"]},
+            revisions={"a": "1"},
+            built_at=time.time(),
+        )
+
+    cache = SheetCatalogCache(loader, ttl_seconds=TTL)
+    cache._catalog = SheetCatalog(
+        spreadsheets={"Туры a": "a", "Туры b": "b"},
+        worksheets={"a": ["7.03-14.03"], "b": ["1.04-8.04"]},
+        revisions={"a": "1", "b": "1"},
+        built_at=built_at,
+    )
+    return cache, builds
+
+
+def test_partial_update_keeps_full_rebuild_schedule():
+    built_at = time.time() - TTL + 60
+    cache, builds = make_cache(built_at)
+
+    updated = cache.apply_revisions(revisions(a="2", b="1"), lambda ids: {i: ["10.04-17.04"] for i in ids})
+
+    assert updated.worksheets["a"] == ["10.04-17.04"]
+    assert updated.built_at == built_at
+    assert updated.updated_at > built_at
+    assert updated.version == updated.updated_at
+    assert builds == []
+
+
+def test_full_rebuild_happens_after_ttl_despite_partial_updates():
+    cache, builds = make_cache(time.time() - TTL - 1)
+    cache._catalog.updated_at = time.time()
+
+    catalog = cache.get()
+
+    assert builds == [1]
+    assert catalog.worksheets == {"a": ["7.03-14.03"]}
+
+
+def test_catalog_round_trips_through_json():
+    catalog = SheetCatalog(spreadsheets={"x": "1"}, built_at=10.0, updated_at=20.0)
+
+    restored = SheetCatalog.from_json(catalog.to_json())
+
+    assert (restored.built_at, restored.updated_at, restored.version) == (10.0, 20.0, 20.0)
+
+
+def test_revision_probe_lists_same_tables_as_catalog(monkeypatch):
+    from app.google_sheet_parser.google_sheets_service import google_sheets_service
+
+    files = [
+        {"id": "a", "name": "Туры 2026", "version": "1"},
+        {"id": "b", "name": "Hikmet2026", "version": "2"},
+        {"id": "c", "name": "Архив 2019", "version": "3"},
+    ]
+    pages = [
+        {"files": files[:2], "nextPageToken": "page-2"},
+        {"files": files[2:]},
+    ]
+    queries = []
+
+    class Response:
+        def __init__(self, page):
+            self.page = page
+
+        def json(self):
+            return self.page
+
+    class HttpClient:
+        def request(self, method, url, params):
+            queries.append(params)
+            return Response(pages[len(queries) - 1])
+
+    class Client:
+        http_client = HttpClient()
+
+    monkeypatch.setattr(google_sheets_service, "_api_call_with_retry", lambda func: func(Client()))
+    monkeypatch.setattr(google_sheets_service, "_target_years", lambda: ["2026", "2027"])
+
+    listed = google_sheets_service._list_spreadsheet_revisions(["2026", "2027"])
+    catalog_tables = google_sheets_service._filter_year_tables({f["name"]: f["id"] for f in files})
+
+    # "Hikmet2026": name contains "2026" в Drive его не находит
+    assert "name contains" not in queries[0]["q"]
+    assert [f["id"] for f in listed] == ["a", "b"]
+    assert sorted(catalog_tables.values()) == ["a", "b"]
@@ -0,0 +1,214 @@
+import threading
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.google_sheet_parser import sheet_pilgrim_parser as parser_module
+from app.google_sheet_parser.google_sheets_service import google_sheets_service
+from tests.conftest import make_sheet, run_concurrently
+
+SPREADSHEET_ID = "spreadsheet"
+SHEET_NAME = "7.03-14.03 NIYET"
+
+SHEET = make_sheet([
+    [
+        ["IVANOV", "IVAN", "N1234567", "900101300123", "DBL", "BB"],
+        ["PETROVA", "ANNA", "N7654321", "910202400456", "DBL", "BB"],
+    ],
+    [
+        ["SMAGULOV", "NURLAN", "N1111111", "850303300789", "TRPL", "HB"],
+    ],
+])
+
+
+@pytest.fixture
+def google(monkeypatch):
+    """Google API без сети: считает загрузки, каждая идёт 0.2 с"""
+    downloads = []
+    lock = threading.Lock()
+
+    def get_sheet_values(spreadsheet_id, sheet_name):
+        with lock:
+            downloads.append(("values", sheet_name))
+        time.sleep(0.2)
+        return [list(row) for row in SHEET]
+
+    def batch_get_values(spreadsheet_id, ranges, major_dimension="ROWS"):
+        with lock:
+            downloads.append(("batch", tuple(ranges)))
+        time.sleep(0.2)
+        return [[list(row) for row in SHEET] for _ in ranges]
+
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", False)
+    monkeypatch.setattr(google_sheets_service, "get_revision", lambda spreadsheet_id: "rev-1")
+    monkeypatch.setattr(google_sheets_service, "get_sheet_values", get_sheet_values)
+    monkeypatch.setattr(google_sheets_service, "batch_get_values", batch_get_values)
+    return downloads
+
+
+@pytest.mark.parametrize("redis_mode", ["redis", "no_redis"])
+def test_concurrent_get_parsed_sheet_downloads_once(request, parser, google, redis_mode):
+    if redis_mode == "no_redis":
+        request.getfixturevalue("no_redis")
+
+    results = run_concurrently(lambda: parser.get_parsed_sheet(SPREADSHEET_ID, SHEET_NAME))
+
+    assert len(google) == 1
+    first = results[0]
+    assert [package["count"] for package in first.packages] == [2, 1]
+    assert all(result.packages == first.packages for result in results)
+    assert all(result.pilgrims == first.pilgrims for result in results)
+
+
+def test_concurrent_get_parsed_sheet_shares_leader_error(parser, google, monkeypatch):
+    def fail(spreadsheet_id, sheet_name):
+        google.append(("values", sheet_name))
+        time.sleep(0.2)
+        raise RuntimeError("API недоступен")
+
+    monkeypatch.setattr(google_sheets_service, "get_sheet_values", fail)
+
+    results = run_concurrently(lambda: parser.get_parsed_sheet(SPREADSHEET_ID, SHEET_NAME))
+
+    assert len(google) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert all("API недоступен" in str(result) for result in results)
+
+
+def test_concurrent_preload_downloads_once(parser, google):
+    results = run_concurrently(lambda: parser.preload_sheet_values([(SPREADSHEET_ID, SHEET_NAME)]))
+
+    assert len(google) == 1
+    assert google[0][0] == "batch"
+    assert sum(results) >= 1
+
+    parsed = parser.get_parsed_sheet(SPREADSHEET_ID, SHEET_NAME)
+    assert len(google) == 1
+    assert len(parsed.pilgrims) == 3
+
+
+def test_parsed_sheet_is_reused_until_revision_changes(parser, google, monkeypatch):
+    first = parser.get_parsed_sheet(SPREADSHEET_ID, SHEET_NAME)
+    assert parser.get_parsed_sheet(SPREADSHEET_ID, SHEET_NAME) is first
+    assert len(google) == 1
+
+    monkeypatch.setattr(google_sheets_service, "get_revision", lambda spreadsheet_id: "rev-2")
+    second = parser.get_parsed_sheet(SPREADSHEET_ID, SHEET_NAME)
+
+    assert len(google) == 2
+    assert second.revision == "rev-2"
+    assert second.previous_revision == "rev-1"
+    assert second.changed_packages == []
+
+
+def _wide_sheet(packages):
+    """Лист шире PROBE_COLUMNS: паспорт и ИИН правее колонки H"""
+    rows = []
+    for idx, pilgrims in enumerate(packages, start=1):
+        rows.append([f"NIYET {idx}.03-{idx + 7}.03"] + [""] * 11)
+        rows.append(["No", "Surname", "Name", "x1", "x2", "x3", "x4", "x5", "Passport", "junk", "IIN", "Meal"])
+        for number, (surname, passport) in enumerate(pilgrims, start=1):
+            rows.append([str(number), surname, "IVAN", "a", "b", "c", "d", "e", passport, "zz", "", "BB"])
+    return rows
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+@pytest.fixture
+def wide_google(monkeypatch):
+    """values.get/values.batchGet по сетке из state["grid"]; запоминает запросы"""
+    state = {"grid": [], "requests": []}
+
+    def get_sheet_values(spreadsheet_id, sheet_name):
+        state["requests"].append(("get", sheet_name))
+        return [list(row) for row in state["grid"]]
+
+    def batch_get_values(spreadsheet_id, ranges, major_dimension="ROWS"):
+        state["requests"].append(("batch", tuple(ranges), major_dimension))
+        grid = state["grid"]
+        blocks = []
+        for rng in ranges:
+            start, end = rng.split("!")[1].split(":")
+            if start.isdigit():
+                blocks.append([list(row) for row in grid[int(start) - 1:int(end)]])
+                continue
+            first, last = _column_index(start), _column_index(end)
+            if major_dimension == "COLUMNS":
+                blocks.append([[row[i] if i < len(row) else "" for row in grid] for i in range(first, last + 1)])
+            else:
+                blocks.append([row[first:last + 1] for row in grid])
+        return blocks
+
+    monkeypatch.setattr(google_sheets_service, "get_revision", lambda spreadsheet_id: None)
+    monkeypatch.setattr(google_sheets_service, "get_sheet_values", get_sheet_values)
+    monkeypatch.setattr(google_sheets_service, "batch_get_values", batch_get_values)
+    return state
+
+
+def _parse_both_ways(wide_google, monkeypatch):
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", True)
+    restricted = parser_module.SheetPilgrimParser().get_parsed_sheet(SPREADSHEET_ID, "restricted")
+    requests = list(wide_google["requests"])
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", False)
+    full = parser_module.SheetPilgrimParser().get_parsed_sheet(SPREADSHEET_ID, "full")
+    return restricted, full, requests
+
+
+def test_restricted_fetch_single_package_takes_two_requests(wide_google, monkeypatch):
+    wide_google["grid"] = _wide_sheet([[("IVANOV", "N1234567"), ("PETROV", "N7654321")]])
+    restricted, full, requests = _parse_both_ways(wide_google, monkeypatch)
+
+    # Проба + первые строки одним запросом, затем нужные колонки
+    assert [request[0] for request in requests] == ["batch", "batch"]
+    assert [pilgrim.document for pilgrim in restricted.pilgrims] == ["N1234567", "N7654321"]
+    assert restricted.pilgrims == full.pilgrims
+    assert [p["pilgrims"] for p in restricted.packages] == [p["pilgrims"] for p in full.packages]
+
+
+def test_restricted_fetch_reads_headers_below_probe_rows(wide_google, monkeypatch):
+    first = [(f"SURNAME{i}", f"N{1000000 + i}") for i in range(parser_module.PROBE_FULL_ROWS)]
+    wide_google["grid"] = _wide_sheet([first, [("SMAGULOV", "N1111111")]])
+    restricted, full, requests = _parse_both_ways(wide_google, monkeypatch)
+
+    assert len(requests) == 3
+    assert len(restricted.packages) == 2
+    assert restricted.pilgrims == full.pilgrims
+    assert [p["pilgrims"] for p in restricted.packages] == [p["pilgrims"] for p in full.packages]
+
+
+def test_restricted_fetch_falls_back_to_one_request_on_low_quota(wide_google, monkeypatch):
+    monkeypatch.setattr(parser_module.google_read_quota, "available", lambda: 2.0)
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", True)
+    wide_google["grid"] = _wide_sheet([[("IVANOV", "N1234567")]])
+
+    parsed = parser_module.SheetPilgrimParser().get_parsed_sheet(SPREADSHEET_ID, "low-quota")
+
+    assert wide_google["requests"] == [("get", "low-quota")]
+    assert [pilgrim.document for pilgrim in parsed.pilgrims] == ["N1234567"]
+
+
+def _far_right_package(pilgrims):
+    """Пакет, у которого ФИО и паспорт только в колонках правее PROBE_COLUMNS"""
+    rows = [["NIYET 20.03-27.03"] + [""] * 11]
+    rows.append(["", "", "", "", "", "", "", "", "Surname", "Name", "Passport", "Meal"])
+    for surname, passport in pilgrims:
+        rows.append(["", "", "", "", "", "", "", "", surname, "IVAN", passport, "BB"])
+    return rows
+
+
+def test_restricted_fetch_falls_back_when_package_header_is_outside_probe(wide_google, monkeypatch):
+    first = [(f"SURNAME{i}", f"N{1000000 + i}") for i in range(parser_module.PROBE_FULL_ROWS)]
+    wide_google["grid"] = _wide_sheet([first]) + _far_right_package([("SMAGULOV", "N1111111")])
+    restricted, full, requests = _parse_both_ways(wide_google, monkeypatch)
+
+    # Проба, затем полная загрузка вместо частичной
+    assert [request[0] for request in requests] == ["batch", "get"]
+    assert len(full.packages) == 2
+    assert restricted.pilgrims == full.pilgrims
+    assert [p["pilgrims"] for p in restricted.packages] == [p["pilgrims"] for p in full.packages]
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.google_sheet_parser.google_sheets_service import google_sheets_service
+from tests.conftest import make_sheet
+
+SHEET = make_sheet([[["IVANOV", "IVAN", "N1234567", "900101300123", "DBL", "BB"]]])
+
+
+def post_batch(sheets):
+    from app.main import app
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            return await client.post(
+                "/api/v1/tours/sheet-pilgrims/batch",
+                json={"sheets": [{"spreadsheet_id": "spreadsheet", "sheet_name": name} for name in sheets]},
+            )
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def google(monkeypatch, parser):
+    """batchGet падает, листы грузятся по одному; "broken" — ошибка API"""
+    state = {"active": 0, "max_active": 0, "fetched": []}
+    lock = threading.Lock()
+
+    def batch_get_values(spreadsheet_id, ranges, major_dimension="ROWS"):
+        raise RuntimeError("batchGet недоступен")
+
+    def get_sheet_values(spreadsheet_id, sheet_name):
+        with lock:
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+            state["fetched"].append(sheet_name)
+        try:
+            time.sleep(0.1)
+            if sheet_name.startswith("broken"):
+                raise RuntimeError("лист недоступен")
+            return [list(row) for row in SHEET]
+        finally:
+            with lock:
+                state["active"] -= 1
+
+    monkeypatch.setattr(settings, "SHEET_COLUMN_RESTRICTED_FETCH", False)
+    monkeypatch.setattr(google_sheets_service, "get_revision", lambda spreadsheet_id: "rev-1")
+    monkeypatch.setattr(google_sheets_service, "batch_get_values", batch_get_values)
+    monkeypatch.setattr(google_sheets_service, "get_sheet_values", get_sheet_values)
+    return state
+
+
+def test_batch_falls_back_to_single_sheets_and_reports_failures(google):
+    response = post_batch(["1.03-8.03 NIYET", "broken 2.03-9.03", "3.03-10.03 NIYET"])
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["success"] is False
+    assert body["failed_count"] == 1
+    assert body["total_count"] == 2
+    results = {result["sheet_name"]: result for result in body["results"]}
+    assert results["1.03-8.03 NIYET"]["success"] is True
+    assert results["3.03-10.03 NIYET"]["total_count"] == 1
+    assert results["broken 2.03-9.03"]["success"] is False
+    assert "лист недоступен" in results["broken 2.03-9.03"]["error"]
+    assert sorted(google["fetched"]) == sorted(results)
+
+
+def test_batch_limits_parallel_sheet_fetches(google, monkeypatch):
+    monkeypatch.setattr(settings, "GOOGLE_SHEETS_FETCH_CONCURRENCY", 2)
+
+    response = post_batch([f"{day}.03-{day + 7}.03 NIYET" for day in range(1, 9)])
+
+    assert response.status_code == 200, response.text
+    assert response.json()["total_count"] == 8
+    assert google["max_active"] == 2
@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.core.singleflight import SingleFlight
+from tests.conftest import CALLERS, run_concurrently
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_concurrent_calls_execute_once(shared):
+    flight = SingleFlight("test")
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"rows": [1, 2, 3]}
+
+    results = run_concurrently(lambda: flight.do(("key",), load, shared=shared))
+
+    assert len(calls) == 1
+    assert results == [{"rows": [1, 2, 3]}] * CALLERS
+    assert flight.stats()["executed"] == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_waiters_get_leader_exception():
+    flight = SingleFlight("test")
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("quota")
+
+    results = run_concurrently(lambda: flight.do(("key",), load))
+
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == "quota" for result in results)
+
+
+def test_waiter_in_other_process_gets_result_from_redis():
+    # Два экземпляра SingleFlight с общим Redis — как два воркера uvicorn
+    leader, follower = SingleFlight("test"), SingleFlight("test")
+    started = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        time.sleep(0.3)
+        return [1, 2]
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(leader.do, ("key",), load)
+        started.wait(5)
+        second = pool.submit(follower.do, ("key",), load)
+        assert first.result() == [1, 2]
+        assert second.result() == [1, 2]
+
+    assert len(calls) == 1
+    assert follower.stats()["shared_remote"] == 1
+
+
+def test_failed_call_is_not_cached():
+    flight = SingleFlight("test")
+
+    with pytest.raises(RuntimeError):
+        flight.do(("key",), lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+
+    assert flight.do(("key",), lambda: "ok") == "ok"
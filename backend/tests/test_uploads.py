@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import io
+import os
+import threading
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI, File, UploadFile
+
+from app.api.v1 import manifest as manifest_api
+from app.core import uploads
+from app.core.config import settings
+from app.core.uploads import UploadSizeLimitMiddleware, UploadTooLargeError, upload_digest
+
+LIMIT = 1024
+
+
+def _client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def _limited_app():
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_bytes=LIMIT)
+    calls = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        calls.append(file.filename)
+        return {"size": len(await file.read())}
+
+    return app, calls
+
+
+def _multipart(content: bytes) -> bytes:
+    return (
+        b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"m.csv\"\r\n"
+        b"Content-Type: text/csv\r\n\r\n" + content + b"\r\n--b--\r\n"
+    )
+
+
+def test_content_length_over_limit_rejected_before_body_is_read():
+    app, calls = _limited_app()
+    middleware = UploadSizeLimitMiddleware(app, max_bytes=LIMIT)
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/upload",
+        "headers": [
+            (b"content-type", b"multipart/form-data; boundary=b"),
+            (b"content-length", str(100 * 1024 * 1024).encode()),
+        ],
+    }
+    received = []
+    sent = []
+
+    async def receive():
+        received.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+
+    assert received == []
+    assert calls == []
+    assert sent[0]["type"] == "http.response.start"
+    assert sent[0]["status"] == 413
+
+
+def test_streamed_body_over_limit_is_cut_off():
+    app, calls = _limited_app()
+    body = _multipart(b"x" * (1024 * 1024))
+    streamed = 0
+
+    async def chunks():
+        nonlocal streamed
+        for start in range(0, len(body), 8192):
+            streamed += 8192
+            yield body[start:start + 8192]
+
+    async def run():
+        async with _client(app) as client:
+            # Генератор без Content-Length: размер известен только по мере чтения
+            return await client.post(
+                "/upload",
+                content=chunks(),
+                headers={"content-type": "multipart/form-data; boundary=b"},
+            )
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 413
+    assert "detail" in response.json()
+    assert calls == []
+    # Чтение прекращено вскоре после лимита, а не после всего тела
+    assert streamed <= uploads.MULTIPART_OVERHEAD_BYTES + LIMIT + 8192
+
+
+def test_body_within_limit_passes_through():
+    app, calls = _limited_app()
+
+    async def run():
+        async with _client(app) as client:
+            return await client.post("/upload", files={"file": ("m.csv", b"x" * LIMIT)})
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json() == {"size": LIMIT}
+    assert calls == ["m.csv"]
+
+
+def test_upload_digest_rewinds_and_checks_size():
+    file = io.BytesIO(b"abc" * 10)
+    file.read(5)
+
+    digest = upload_digest(file, max_bytes=30)
+
+    assert digest == hashlib.sha256(b"abc" * 10).hexdigest()
+    assert file.tell() == 0
+    with pytest.raises(UploadTooLargeError):
+        upload_digest(file, max_bytes=29)
+
+
+@pytest.fixture
+def manifest_app(monkeypatch):
+    from app.main import app
+
+    # Разбор в threadpool вместо пула процессов
+    monkeypatch.setattr(settings, "PARSE_PROCESSES", 0)
+    return app
+
+
+def test_manifest_upload_hashes_off_loop_and_reuses_result(manifest_app, monkeypatch):
+    digest_threads = []
+
+    def recording_digest(file, max_bytes):
+        digest_threads.append(threading.current_thread())
+        return upload_digest(file, max_bytes)
+
+    monkeypatch.setattr(manifest_api, "upload_digest", recording_digest)
+    surname = f"ivanov{uuid.uuid4().hex[:8]}"
+    content = f"surname,name,document\n{surname},ivan,N123\n".encode()
+
+    async def run():
+        async with _client(manifest_app) as client:
+            first = await client.post("/api/v1/manifest/upload", files={"file": ("m.csv", content)})
+            second = await client.post("/api/v1/manifest/upload", files={"file": ("m.csv", content)})
+            return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first.status_code == 200, first.text
+    assert first.json()["cached"] is False
+    assert first.json()["count"] == 1
+    assert second.json()["cached"] is True
+    assert second.json()["manifest_id"] == first.json()["manifest_id"]
+    assert len(digest_threads) == 2
+    assert all(thread is not threading.main_thread() for thread in digest_threads)
+
+
+def test_manifest_upload_over_limit_returns_413(manifest_app, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_SIZE_MB", 0)
+
+    async def run():
+        async with _client(manifest_app) as client:
+            return await client.post("/api/v1/manifest/upload", files={"file": ("m.csv", b"surname\nx\n")})
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 413
+
+
+def test_manifest_upload_parses_from_temp_file_path(manifest_app, monkeypatch):
+    seen = []
+    parse = manifest_api.parse_manifest_content
+
+    def recording_parse(source, filename):
+        with open(source, "rb") as saved:
+            seen.append((source, saved.read()))
+        return parse(source, filename)
+
+    monkeypatch.setattr(manifest_api, "parse_manifest_content", recording_parse)
+    content = f"surname,name,document\npetrov{uuid.uuid4().hex[:8]},ivan,N123\n".encode()
+
+    async def run():
+        async with _client(manifest_app) as client:
+            return await client.post("/api/v1/manifest/upload", files={"file": ("m.csv", content)})
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200, response.text
+    [(path, saved)] = seen
+    assert isinstance(path, str) and path.endswith(".csv")
+    assert saved == content
+    # Временный файл удалён после разбора
+    assert not os.path.exists(path)
+
+
+def test_manifest_cache_key_depends_on_parser_version_and_extension(manifest_app, monkeypatch):
+    from app.services import manifest_store as store_module
+
+    content = f"surname,name,document\nsidorov{uuid.uuid4().hex[:8]},ivan,N123\n".encode()
+
+    async def upload(filename):
+        async with _client(manifest_app) as client:
+            response = await client.post("/api/v1/manifest/upload", files={"file": (filename, content)})
+            return response.json()
+
+    first = asyncio.run(upload("m.csv"))
+    monkeypatch.setattr(store_module, "MANIFEST_PARSER_VERSION", store_module.MANIFEST_PARSER_VERSION + 1)
+    after_deploy = asyncio.run(upload("m.csv"))
+
+    assert after_deploy["cached"] is False
+    assert after_deploy["manifest_id"] != first["manifest_id"]
+    digest = hashlib.sha256(content).hexdigest()
+    assert store_module.manifest_store.manifest_id(digest, ".csv") != store_module.manifest_store.manifest_id(digest, ".xlsx")
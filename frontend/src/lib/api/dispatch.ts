@@ -35,11 +35,13 @@ export interface DispatchEnqueueRequest {
     q_touragent?: string;
     q_touragent_bin?: string;
   };
-  results: {
+  // Без results нужен manifest_id — сверку выполнит сервер
+  results?: {
     matched: DispatchPerson[];
     in_sheet_not_in_manifest: DispatchPerson[];
     in_manifest_not_in_sheet: DispatchPerson[];
   };
+  manifest_id?: string;
   manifest_filename?: string;
   max_attempts?: number;
 }
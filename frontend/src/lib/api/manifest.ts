@@ -13,6 +13,10 @@ export interface Pilgrim {
 
 export interface UploadManifestResponse {
   success: boolean;
+  // Хеш содержимого файла: передаётся в compare/enqueue вместо списка
+  manifest_id: string;
+  // Файл с таким содержимым уже разбирали
+  cached?: boolean;
   pilgrims: Pilgrim[];
   count: number;
   message: string;
@@ -21,7 +25,9 @@ export interface UploadManifestResponse {
 export interface CompareRequest {
   spreadsheet_id: string;
   sheet_name: string;
-  manifest_pilgrims: Pilgrim[];
+  // Нужен manifest_id или manifest_pilgrims
+  manifest_id?: string;
+  manifest_pilgrims?: Pilgrim[];
 }
 
 export interface CompareResponse {
@@ -29,6 +35,8 @@ export interface CompareResponse {
   matched: Pilgrim[];
   in_sheet_not_in_manifest: Pilgrim[];
   in_manifest_not_in_sheet: Pilgrim[];
+  revision?: string | null;
+  trace_id?: string | null;
   message: string;
 }
 
@@ -41,9 +41,43 @@ export interface SheetPilgrimsResponse {
   success: boolean;
   packages: PackageInfo[];
   total_count: number;
+  revision?: string | null;
+  previous_revision?: string | null;
+  changed_packages?: string[] | null;
+  trace_id?: string | null;
   message: string;
 }
 
+export interface SheetPilgrimsResult {
+  spreadsheet_id: string;
+  sheet_name: string;
+  success: boolean;
+  packages: PackageInfo[];
+  total_count: number;
+  revision?: string | null;
+  error?: string | null;
+}
+
+export interface BatchSheetPilgrimsResponse {
+  success: boolean;
+  results: SheetPilgrimsResult[];
+  total_count: number;
+  failed_count: number;
+  message: string;
+}
+
+export type SheetPilgrimsStreamEvent =
+  | ({ type: 'package' } & PackageInfo)
+  | {
+      type: 'done';
+      total_count: number;
+      package_count: number;
+      revision?: string | null;
+      previous_revision?: string | null;
+      changed_packages?: string[] | null;
+    }
+  | { type: 'error'; message: string };
+
 /**
  * Поиск туров по дате в Google Sheets
  */
@@ -54,6 +88,20 @@ export const searchToursByDate = async (dateShort: string): Promise<SearchByDate
   return response.data;
 };
 
+/**
+ * Поиск туров по диапазону дат вылета ("10.02"–"20.02" или с годом)
+ */
+export const searchToursByRange = async (
+  dateFrom: string,
+  dateTo: string
+): Promise<SearchByDateResponse> => {
+  const response = await api.post<SearchByDateResponse>('/api/v1/tours/search-by-range', {
+    date_from: dateFrom,
+    date_to: dateTo,
+  });
+  return response.data;
+};
+
 /**
  * Получить паломников из листа, сгруппированных по пакетам
  */
@@ -68,6 +116,75 @@ export const getSheetPilgrims = async (
   return response.data;
 };
 
+/**
+ * Паломники нескольких листов одним запросом; ошибки — по каждому листу
+ */
+export const getSheetPilgrimsBatch = async (
+  sheets: { spreadsheetId: string; sheetName: string }[]
+): Promise<BatchSheetPilgrimsResponse> => {
+  const response = await api.post<BatchSheetPilgrimsResponse>('/api/v1/tours/sheet-pilgrims/batch', {
+    sheets: sheets.map((sheet) => ({
+      spreadsheet_id: sheet.spreadsheetId,
+      sheet_name: sheet.sheetName,
+    })),
+  });
+  return response.data;
+};
+
+/**
+ * Паломники листа по пакетам в потоке (NDJSON): onPackage вызывается
+ * для каждого пакета, как только сервер его разобрал
+ */
+export const streamSheetPilgrims = async (
+  spreadsheetId: string,
+  sheetName: string,
+  onPackage: (pkg: PackageInfo) => void
+): Promise<Omit<Extract<SheetPilgrimsStreamEvent, { type: 'done' }>, 'type'>> => {
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${api.defaults.baseURL}/api/v1/tours/sheet-pilgrims/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify({ spreadsheet_id: spreadsheetId, sheet_name: sheetName }),
+  });
+
+  if (!response.ok || !response.body) {
+    const error = await response.json().catch(() => null);
+    throw new Error(error?.detail || `Ошибка получения паломников: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    buffer += decoder.decode(value, { stream: !done });
+
+    const lines = buffer.split('\n');
+    buffer = lines.pop() ?? '';
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const event = JSON.parse(line) as SheetPilgrimsStreamEvent;
+      if (event.type === 'package') {
+        const { type: _type, ...pkg } = event;
+        onPackage(pkg);
+      } else if (event.type === 'done') {
+        const { type: _type, ...summary } = event;
+        return summary;
+      } else {
+        throw new Error(event.message);
+      }
+    }
+
+    if (done) {
+      throw new Error('Поток паломников оборвался');
+    }
+  }
+};
+
 /**
  * Тест подключения к Google Sheets
  */